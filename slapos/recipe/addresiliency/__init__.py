@@ -40,16 +40,24 @@ class Recipe(GenericSlapRecipe):
     def _install(self):
         slap_connection = self.buildout['slap-connection']
 
+        kw = {
+            'server_url': slap_connection['server-url'],
+            'key_file': slap_connection.get('key-file'),
+            'cert_file': slap_connection.get('cert-file'),
+            'computer_guid': slap_connection['computer-id'],
+            'partition_id': slap_connection['partition-id'],
+            'software_release': slap_connection['software-release-url'],
+            'namebase': self.parameter_dict['namebase'],
+            'takeover_triggered_file_path': self.options['takeover-triggered-file-path'],
+        }
+        if 'takeover-report-file-path' in self.options:
+            # JSON report with the duration of each phase of the takeover
+            kw['report_file_path'] = self.options['takeover-report-file-path']
+        if 'takeover-timeout' in self.options:
+            # seconds after which a phase failing again and again is given up
+            kw['timeout'] = float(self.options['takeover-timeout'])
+
         return self.createPythonScript(
             self.options['wrapper-takeover'],
             __name__ + '.takeover.takeover',
-            kw={
-                'server_url': slap_connection['server-url'],
-                'key_file': slap_connection.get('key-file'),
-                'cert_file': slap_connection.get('cert-file'),
-                'computer_guid': slap_connection['computer-id'],
-                'partition_id': slap_connection['partition-id'],
-                'software_release': slap_connection['software-release-url'],
-                'namebase': self.parameter_dict['namebase'],
-                'takeover_triggered_file_path': self.options['takeover-triggered-file-path'],
-            })
+            kw=kw)
@@ -1,18 +1,109 @@
 # -*- coding: utf-8 -*-
+import json
 import logging
+import random
 import time
-import traceback
 
-import slapos
-from slapos.slap.slap import NotFoundError
+from slapos.recipe.librecipe.slapclient import getSlapClient
+from slapos.slap import ConnectionError, NotFoundError, ResourceNotReady, \
+  ServerError
 
 log = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG)
 
+# Errors after which the master may accept the same call later.
+RETRY_EXCEPTION_TUPLE = ConnectionError, NotFoundError, ResourceNotReady, \
+  ServerError
+
+class Backoff(object):
+  """Delays between retries: exponential, with jitter so that partitions
+  retrying at the same time do not hammer the master together"""
+
+  def __init__(self, initial=1, maximum=60, factor=2, jitter=.5):
+    self.initial = initial
+    self.maximum = maximum
+    self.factor = factor
+    self.jitter = jitter
+
+  def __iter__(self):
+    delay = self.initial
+    while True:
+      yield delay * random.uniform(1 - self.jitter, 1)
+      delay = min(delay * self.factor, self.maximum)
+
+
+# Default time after which a phase is given up, in seconds.
+PHASE_TIMEOUT = 3600
+
+class Takeover(object):
+  """Run the phases of a takeover, retrying each of them as soon as the
+  master may accept it, and time them
+
+  A phase still failing after timeout seconds is given up: the last error
+  is raised, so that the takeover script exits with a non-zero status.
+  """
+
+  def __init__(self, backoff=None, timeout=PHASE_TIMEOUT):
+    self.backoff = backoff or Backoff()
+    self.timeout = timeout
+    self.phase_list = []
+    self.start = time.time()
+
+  def phase(self, name, func, *args, **kw):
+    start = time.time()
+    deadline = start + self.timeout
+    attempts = 0
+    delay_iterator = iter(self.backoff)
+    try:
+      while True:
+        attempts += 1
+        try:
+          return func(*args, **kw)
+        except RETRY_EXCEPTION_TUPLE as e:
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            log.error('%s failed (%r), giving up after %s attempt(s)',
+                      name, e, attempts)
+            raise
+          delay = min(next(delay_iterator), remaining)
+          log.warning('%s failed (%r), retrying in %.1f seconds...',
+                      name, e, delay, exc_info=log.isEnabledFor(logging.DEBUG))
+          time.sleep(delay)
+    finally:
+      duration = time.time() - start
+      log.debug('%s done in %.3f seconds (%s attempt(s))',
+                name, duration, attempts)
+      self.phase_list.append({
+        'name': name,
+        'duration': duration,
+        'attempts': attempts,
+      })
+
+  def report(self, **kw):
+    end = time.time()
+    report = {
+      'start': self.start,
+      'end': end,
+      'duration': end - self.start,
+      'phase-list': self.phase_list,
+    }
+    report.update(kw)
+    return report
+
+
+def _request(partition, **kw):
+  requested = partition.request(**kw)
+  requested.getId() # until it is allocated
+  return requested
+
 def takeover(server_url, key_file, cert_file, computer_guid,
              partition_id, software_release, namebase,
              winner_instance_suffix = None,
-             takeover_triggered_file_path=None):
+             takeover_triggered_file_path=None,
+             report_file_path=None,
+             dry_run=False,
+             backoff=None,
+             timeout=PHASE_TIMEOUT):
   """
   This function does
 
@@ -24,20 +115,26 @@ def takeover(server_url, key_file, cert_file, computer_guid,
 
   Then, after running slapgrid-cp a few times, the winner takes over and
   a new cp is created to replace it as an importer.
+
+  Each call to the master is retried with exponential backoff as long as
+  the master is not ready, and the duration of each phase is written as
+  JSON to report_file_path. A phase failing for more than timeout seconds
+  makes the takeover fail. With dry_run, the takeover-triggered file is
+  not written, so that it can be run against a stand-in master.
   """
+  engine = Takeover(backoff, timeout)
 
-  slap = slapos.slap.slap()
-  slap.initializeConnection(server_url, key_file, cert_file)
-  current_partition = slap.registerComputerPartition(computer_guid=computer_guid,
-                                                     partition_id=partition_id)
+  current_partition = getSlapClient().getComputerPartition(
+    server_url, computer_guid, partition_id, key_file, cert_file)
 
   # partition that will take over.
   if winner_instance_suffix:
     winner_instance_name = namebase + winner_instance_suffix
     # XXX: we hardcode a lot of values here, because request is a settergetter, all at once.
-    cp_winner = current_partition.request(software_release=software_release,
-                                  software_type='%s-import' % namebase,
-                                  partition_reference=winner_instance_name)
+    cp_winner = engine.phase('request-winner', _request, current_partition,
+                             software_release=software_release,
+                             software_type='%s-import' % namebase,
+                             partition_reference=winner_instance_name)
   else:
     # This script is run in the winning partition: use this one as winner
     cp_winner = current_partition
@@ -47,34 +144,37 @@ def takeover(server_url, key_file, cert_file, computer_guid,
   cp_exporter_ref = namebase + '0'       # this is ok. the boss is always number zero.
 
   # partition to be deactivated
-  cp_broken = cp_winner.request(software_release=software_release,
-                                software_type='frozen',
-                                state='stopped',
-                                partition_reference=cp_exporter_ref)
+  cp_broken = engine.phase('freeze-broken', _request, cp_winner,
+                           software_release=software_release,
+                           software_type='frozen',
+                           state='stopped',
+                           partition_reference=cp_exporter_ref)
 
   broken_new_ref = 'broken-{}'.format(time.strftime("%d-%b_%H:%M:%S", time.gmtime()))
 
   log.debug("Renaming {}: {}".format(cp_broken.getId(), broken_new_ref))
 
-  cp_broken.rename(new_name=broken_new_ref)
+  engine.phase('rename-broken', cp_broken.rename, new_name=broken_new_ref)
 
   log.debug("Renaming {}: {}".format(cp_winner.getId(), cp_exporter_ref))
 
   # update name (and later, software type) for the partition that will take over
-  while True:
-    time.sleep(10)
-    try:
-      cp_winner.rename(new_name=cp_exporter_ref)
-      break
-    except NotFoundError:
-      traceback.print_exc()
-      log.warning('Impossible to rename. Retrying in a few seconds...')
+  engine.phase('rename', cp_winner.rename, new_name=cp_exporter_ref)
   log.debug('Renamed.')
 
-  cp_winner.bang(message='partitions have been renamed!')
+  engine.phase('bang', cp_winner.bang, message='partitions have been renamed!')
   # Note: Root instance will reconfigure itself the winning instance (software_type
   # and parameters.)
 
-  # Create "lock" file preventing equeue to run import scripts
-  # XXX hardcoded
-  open(takeover_triggered_file_path, 'w').write('')
+  report = engine.report(**{'dry-run': dry_run})
+  log.info('Takeover done in %.3f seconds', report['duration'])
+  if report_file_path:
+    with open(report_file_path, 'w') as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+
+  if not dry_run:
+    # Create "lock" file preventing equeue to run import scripts
+    # XXX hardcoded
+    with open(takeover_triggered_file_path, 'w') as f:
+      f.write('')
+  return report
@@ -75,6 +75,9 @@ class Recipe(GenericBaseRecipe):
     self.createFile(openssl_configuration, self.substituteTemplate(
       self.getTemplateFilename('openssl.cnf.ca.in'), config))
 
+    kw = {}
+    if self.options.get('workers'):
+      kw['workers'] = int(self.options['workers'])
     return self.createPythonScript(
       self.options['wrapper'],
       __name__ + '.certificate_authority.runCertificateAuthority',
@@ -82,7 +85,8 @@ class Recipe(GenericBaseRecipe):
        os.path.join(self.ca_dir, 'cacert.pem'),
        self.options['openssl-binary'],
        openssl_configuration,
-       self.request_directory)
+       self.request_directory),
+      kw,
     )
 
 class Request(Recipe):
@@ -1,11 +1,25 @@
 from __future__ import print_function
 
+import errno
 import os
+import shutil
 import subprocess
-import time
+import threading
+import traceback
+from multiprocessing.pool import ThreadPool
 from six.moves import configparser
+import six
 import uuid
 
+from slapos.recipe.librecipe.inotify import subfiles
+
+
+def serialHex(serial):
+  """Format a serial number like openssl, i.e. with an even number of
+  hexadecimal digits, which 'openssl ca' requires in its serial file"""
+  serial = '%X' % serial
+  return '0' * (len(serial) & 1) + serial
+
 
 def popenCommunicate(command_list, input=None):
   subprocess_kw = dict(stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
@@ -30,6 +44,11 @@ class CertificateAuthority:
     self.openssl_binary = openssl_binary
     self.openssl_configuration = openssl_configuration
     self.request_dir = request_dir
+    # openssl.cnf.ca.in expects the CA key to be in <ca_dir>/private
+    self.ca_dir = os.path.dirname(certificate)
+    self._database_lock = threading.Lock()
+    self._request_lock = threading.Lock()
+    self._request_lock_dict = {}
 
   def checkAuthority(self):
     file_list = [ self.key, self.certificate ]
@@ -59,6 +78,119 @@ class CertificateAuthority:
         pass
       raise
 
+  def _getIssuer(self):
+    """Load CA key and certificate, unless cryptography is not available,
+    in which case openssl commands are used"""
+    try:
+      return self._issuer
+    except AttributeError:
+      pass
+    try:
+      from cryptography import x509
+      from cryptography.hazmat.backends import default_backend
+      from cryptography.hazmat.primitives import serialization
+    except ImportError:
+      issuer = None
+    else:
+      backend = default_backend()
+      with open(self.key, 'rb') as f:
+        key = serialization.load_pem_private_key(f.read(), None, backend)
+      with open(self.certificate, 'rb') as f:
+        certificate = x509.load_pem_x509_certificate(f.read(), backend)
+      issuer = key, certificate
+    self._issuer = issuer
+    return issuer
+
+  def _nextSerial(self):
+    """Allocate a serial number the same way 'openssl ca' does"""
+    serial_file = os.path.join(self.ca_dir, 'serial')
+    with open(serial_file) as f:
+      serial = int(f.read().strip(), 16)
+    shutil.copyfile(serial_file, serial_file + '.old')
+    with open(serial_file, 'w') as f:
+      f.write(serialHex(serial + 1) + '\n')
+    return serial
+
+  def _issueCertificate(self, common_name, key, certificate):
+    """Create a key and a certificate signed by the CA, in-process
+
+    The result is the same as with 'openssl req' + 'openssl ca' using
+    openssl.cnf.ca.in, including the update of the CA database."""
+    import datetime
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    backend = default_backend()
+    ca_key, ca_certificate = self._getIssuer()
+    openssl_short_name = {
+      NameOID.COUNTRY_NAME: 'C',
+      NameOID.STATE_OR_PROVINCE_NAME: 'ST',
+      NameOID.ORGANIZATION_NAME: 'O',
+      NameOID.COMMON_NAME: 'CN',
+      NameOID.EMAIL_ADDRESS: 'emailAddress',
+    }
+    # nsComment = "OpenSSL Generated Certificate", as IA5String
+    ns_comment = x509.UnrecognizedExtension(
+      x509.ObjectIdentifier('2.16.840.1.113730.1.13'),
+      b'\x16\x1dOpenSSL Generated Certificate')
+
+    private_key = rsa.generate_private_key(65537, 2048, backend)
+    # policy_match: other fields of the request are dropped
+    ca_subject = ca_certificate.subject
+    attribute_list = []
+    for oid in NameOID.COUNTRY_NAME, NameOID.STATE_OR_PROVINCE_NAME, \
+               NameOID.ORGANIZATION_NAME:
+      attribute_list += ca_subject.get_attributes_for_oid(oid)
+    attribute_list.append(x509.NameAttribute(NameOID.COMMON_NAME,
+                                             six.text_type(common_name)))
+    attribute_list += ca_subject.get_attributes_for_oid(NameOID.EMAIL_ADDRESS)
+    subject = x509.Name(attribute_list)
+
+    now = datetime.datetime.utcnow()
+    not_after = now + datetime.timedelta(days=3650)
+    ca_ski = ca_certificate.extensions.get_extension_for_class(
+      x509.SubjectKeyIdentifier).value
+    builder = x509.CertificateBuilder(
+    ).subject_name(subject
+    ).issuer_name(ca_subject
+    ).public_key(private_key.public_key()
+    ).not_valid_before(now
+    ).not_valid_after(not_after
+    ).add_extension(x509.BasicConstraints(ca=False, path_length=None), False
+    ).add_extension(ns_comment, False
+    ).add_extension(
+      x509.SubjectKeyIdentifier.from_public_key(private_key.public_key()),
+      False
+    ).add_extension(
+      x509.AuthorityKeyIdentifier.from_issuer_subject_key_identifier(ca_ski),
+      False)
+
+    with self._database_lock:
+      serial = self._nextSerial()
+      cert = builder.serial_number(serial).sign(
+        ca_key, hashes.SHA256(), backend)
+      pem = cert.public_bytes(serialization.Encoding.PEM)
+      serial = serialHex(serial)
+      with open(os.path.join(self.ca_dir, 'newcerts', serial + '.pem'),
+                'wb') as f:
+        f.write(pem)
+      with open(os.path.join(self.ca_dir, 'index.txt'), 'a') as f:
+        f.write('V\t%s\t\t%s\tunknown\t%s\n' % (
+          not_after.strftime('%y%m%d%H%M%SZ'), serial, ''.join(
+            '/%s=%s' % (openssl_short_name[x.oid], x.value)
+            for x in attribute_list)))
+
+    fd = os.open(key, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+      f.write(private_key.private_bytes(serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    # Write the certificate last: requesters wait for both files.
+    with open(certificate + '.tmp', 'wb') as f:
+      f.write(pem)
+    os.rename(certificate + '.tmp', certificate)
+
   def _checkCertificate(self, common_name, key, certificate):
     file_list = [key, certificate]
     ready = True
@@ -73,14 +205,18 @@ class CertificateAuthority:
         os.unlink(f)
     csr = certificate + '.csr'
     try:
+      if self._getIssuer():
+        self._issueCertificate(common_name, key, certificate)
+        return True
       popenCommunicate([self.openssl_binary, 'req', '-config',
         self.openssl_configuration, '-nodes', '-new', '-keyout',
         key, '-out', csr, '-days', '3650'],
         common_name + '\n')
       try:
-        popenCommunicate([self.openssl_binary, 'ca', '-batch', '-config',
-          self.openssl_configuration, '-out', certificate,
-          '-infiles', csr])
+        with self._database_lock:
+          popenCommunicate([self.openssl_binary, 'ca', '-batch', '-config',
+            self.openssl_configuration, '-out', certificate,
+            '-infiles', csr])
       finally:
         if os.path.exists(csr):
           os.unlink(csr)
@@ -96,24 +232,58 @@ class CertificateAuthority:
     else:
       return True
 
+  def checkRequest(self, request_file):
+    # Requests are processed concurrently, but not the same one twice.
+    # A lock is only kept while a request is being processed.
+    with self._request_lock:
+      try:
+        lock = self._request_lock_dict[request_file]
+      except KeyError:
+        lock = self._request_lock_dict[request_file] = [threading.Lock(), 0]
+      lock[1] += 1
+    try:
+      with lock[0]:
+        self._checkRequest(request_file)
+    finally:
+      with self._request_lock:
+        lock[1] -= 1
+        if not lock[1]:
+          del self._request_lock_dict[request_file]
+
+  def _checkRequest(self, request_file):
+    parser = configparser.RawConfigParser()
+    try:
+      with open(request_file) as f:
+        parser.readfp(f)
+    except IOError as e:
+      if e.errno == errno.ENOENT:
+        return
+      raise
+    if self._checkCertificate(parser.get('certificate', 'name'),
+        parser.get('certificate', 'key_file'), parser.get('certificate',
+          'certificate_file')):
+      print('Created certificate %r' % parser.get('certificate', 'name'))
+
   def checkRequestDir(self):
     for request_file in os.listdir(self.request_dir):
-      parser = configparser.RawConfigParser()
-      parser.readfp(open(os.path.join(self.request_dir, request_file), 'r'))
-      if self._checkCertificate(parser.get('certificate', 'name'),
-          parser.get('certificate', 'key_file'), parser.get('certificate',
-            'certificate_file')):
-        print('Created certificate %r' % parser.get('certificate', 'name'))
-
-def runCertificateAuthority(*args):
-  ca = CertificateAuthority(*args)
-  while True:
-    ca.checkAuthority()
-    ca.checkRequestDir()
-    # XXX
-    # Antoine: I really don't like that at all. It wastes useful CPU time.
-    #          I think it would be a greater idea to use pyinotify
-    #          <http://pyinotify.sourceforge.net/>
-    #          Or we could use select() with socket as well.
-    time.sleep(60)
-    # end XXX
+      self.checkRequest(os.path.join(self.request_dir, request_file))
+
+def runCertificateAuthority(key, certificate, openssl_binary,
+    openssl_configuration, request_dir, workers=4):
+  """Wait for new or modified requests and process them, using up to
+  `workers` threads to generate keys and certificates."""
+  ca = CertificateAuthority(key, certificate, openssl_binary,
+    openssl_configuration, request_dir)
+  ca.checkAuthority()
+  pool = ThreadPool(workers)
+  def checkRequest(request_file):
+    try:
+      ca.checkRequest(request_file)
+    except Exception:
+      traceback.print_exc()
+  try:
+    # subfiles lists existing requests first.
+    for request_file in subfiles(request_dir):
+      pool.apply_async(checkRequest, (request_file,))
+  finally:
+    pool.terminate()
@@ -24,9 +24,16 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
 #
 ##############################################################################
+import errno
+import fcntl
+import hashlib
 import os
+import subprocess
+import sys
+import time
 
 from slapos.recipe.librecipe import GenericBaseRecipe
+from slapos.recipe.librecipe.shared import openSharedFile
 from zc.buildout import UserError
 
 from six.moves import map
@@ -54,24 +61,121 @@ class Recipe(GenericBaseRecipe):
 
 
 class Part(GenericBaseRecipe):
+  """Cron entry
+
+  With 'splay' (in seconds), the entry is delayed by a stable amount of time
+  that depends on the partition and the name of the entry, so that
+  partitions using the same schedule do not all run at the same time.
+
+  With 'concurrency-tag', at most 'concurrency-limit' (1 by default) commands
+  with the same tag run at the same time on the host, using lock files in
+  'concurrency-directory' (/tmp by default), which must be shared by all
+  partitions, and is created like /tmp if it does not exist.
+  """
 
   def install(self):
+    options = self.options
     try:
-      periodicity = self.options['frequency']
+      periodicity = options['frequency']
     except KeyError:
-      periodicity = self.options['time']
+      periodicity = options['time']
       try:
         periodicity = systemd_to_cron(periodicity)
       except Exception:
         raise UserError("Invalid systemd calendar spec %r" % periodicity)
-    cron_d = self.options['cron-entries']
-    name = self.options['name']
+    cron_d = options['cron-entries']
+    name = options['name']
     filename = os.path.join(cron_d, name)
+    path_list = [filename]
+
+    command = options['command']
+    tag = options.get('concurrency-tag')
+    if tag:
+      wrapper = options.get('concurrency-wrapper') or os.path.join(
+        self.buildout['buildout']['bin-directory'], name + '-limited')
+      command = self.createPythonScript(wrapper, __name__ + '.limit',
+        (options.get('concurrency-directory', '/tmp'), tag,
+         int(options.get('concurrency-limit', 1)), command))
+      path_list.append(command)
+
+    splay = int(options.get('splay', 0))
+    if splay:
+      partition_id = self.buildout.get('slap-connection', {}).get(
+        'partition-id') or self.buildout['buildout']['directory']
+      periodicity, delay = splay_cron(periodicity,
+                                      splay_offset(partition_id, name, splay))
+      if delay:
+        command = 'sleep %s && %s' % (delay, command)
 
     with open(filename, 'w') as part:
-      part.write('%s %s\n' % (periodicity, self.options['command']))
-
-    return [filename]
+      part.write('%s %s\n' % (periodicity, command))
+
+    return path_list
+
+
+def splay_offset(partition_id, name, splay):
+  """Stable offset in [0, splay] seconds"""
+  return int(hashlib.md5(('%s\0%s' % (partition_id, name)).encode('utf-8')
+                         ).hexdigest(), 16) % (splay + 1)
+
+def splay_cron(spec, offset):
+  """Delay a cron spec by offset seconds
+
+  Return the spec with its minute field shifted, and the remaining delay in
+  seconds. The minute field is shifted within the hour (or within the step of
+  '*/n'), so that the period between 2 runs is preserved. If it can not be
+  shifted, the delay is less than a minute.
+  """
+  spec = symbolic_dict.get(spec.lstrip('@'), spec)
+  if ' ' not in spec: # @reboot
+    return spec, offset
+  minute, rest = spec.split(' ', 1)
+  minutes, seconds = divmod(offset, 60)
+  if minutes:
+    try:
+      if minute.isdigit() or ',' in minute:
+        minute = ','.join(str((int(x) + minutes) % 60)
+                          for x in minute.split(','))
+      else:
+        x, step = minute.split('/')
+        step = int(step)
+        if x == '*':
+          start = 0
+        else:
+          start, end = map(int, x.split('-'))
+          if end + step < 60:
+            raise ValueError # not the whole hour
+        minute = '%s-59/%s' % ((start + minutes) % step, step)
+      return '%s %s' % (minute, rest), seconds
+    except ValueError:
+      pass
+  return spec, offset % 60
+
+
+def limit(directory, tag, limit, command, interval=1):
+  """Run command when less than limit commands with the same tag run"""
+  fd_list = []
+  try:
+    for i in range(limit):
+      fd_list.append(openSharedFile(directory,
+        'slapos-cron-%s.%s.lock' % (tag, i), os.O_RDONLY))
+    while True:
+      for fd in fd_list:
+        try:
+          fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+          if e.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        else:
+          for x in fd_list:
+            if x != fd:
+              os.close(x)
+          fd_list = [fd]
+          sys.exit(subprocess.call(command, shell=True))
+      time.sleep(interval)
+  finally:
+    for fd in fd_list:
+      os.close(fd)
 
 
 day_of_week_dict = dict((name, dow) for dow, name in enumerate(
@@ -28,6 +28,22 @@ from slapos.recipe.librecipe import GenericBaseRecipe
 from zc.buildout import UserError
 
 class Recipe(GenericBaseRecipe):
+  """
+  Run an equeue daemon.
+
+  By default, this is the equeue of slapos.toolbox ('equeue-binary'), which
+  runs commands one at a time. If any of the following options is given,
+  slapos.recipe.equeue_server is run instead:
+
+    workers (optional)
+      Number of commands that can run in parallel. Default: 1.
+    priority (optional)
+      Lines of 'PRIORITY PATTERN': commands matching a glob pattern run
+      before pending commands of higher priority values, e.g. 0 for
+      notifications and 10 for imports. Default priority: 0.
+    stats-file (optional)
+      JSON file with the queue depth and wait times.
+  """
 
   def __init__(self, buildout, name, options):
     if not options['lockfile'].endswith('.lock'):
@@ -35,6 +51,12 @@ class Recipe(GenericBaseRecipe):
     super(Recipe, self).__init__(buildout, name, options)
 
   def install(self):
+    options = self.options
+    if 'workers' in options or 'priority' in options \
+       or 'stats-file' in options:
+      return self.createPythonScript(options['wrapper'],
+        'slapos.recipe.equeue_server.main', kw=self._getServerOptions())
+
     args = [
       self.options['equeue-binary'],
       '--database', self.options['database'],
@@ -52,3 +74,30 @@ class Recipe(GenericBaseRecipe):
     args.append(self.options['socket'])
 
     return self.createWrapper(self.options['wrapper'], args)
+
+  def _getServerOptions(self):
+    options = self.options
+    priority_list = []
+    for line in options.get('priority', '').splitlines():
+      line = line.split(None, 1)
+      if line:
+        try:
+          priority, pattern = line
+          priority_list.append((int(priority), pattern.strip()))
+        except ValueError:
+          raise UserError('Invalid priority line: %r' % ' '.join(line))
+    kw = {
+      'socket_path': options['socket'],
+      'database': options['database'],
+      'logfile': options['log'],
+      'lockfile': options['lockfile'],
+      'workers': int(options.get('workers', 1)),
+      'priority_list': priority_list,
+      'stats_file': options.get('stats-file'),
+    }
+    if 'takeover-triggered-file-path' in options:
+      kw['takeover_triggered_file_path'] = \
+        options['takeover-triggered-file-path']
+    if 'loglevel' in options:
+      kw['loglevel'] = options['loglevel']
+    return kw
@@ -0,0 +1,291 @@
+##############################################################################
+#
+# Copyright (c) 2010 Vifib SARL and Contributors. All Rights Reserved.
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsibility of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# guarantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+##############################################################################
+"""Execution queue with a pool of workers
+
+This is a drop-in replacement of the equeue of slapos.toolbox: clients send
+{"command": ..., "timestamp": ...} as JSON to the UNIX socket, the command is
+echoed back, and it is run unless it already ran with a newer timestamp
+(according to the GNU dbm database, which maps commands to the timestamp of
+their last successful run) or a takeover was triggered. The lock file exists
+while commands run.
+
+But instead of running commands one at a time, in no particular order:
+
+- up to 'workers' commands run in parallel, but never the same executable
+  twice at the same time;
+- pending commands are run by increasing priority (first matching pattern
+  of 'priority_list', 0 by default), then in order of arrival, so that
+  e.g. notifications are not stuck behind a slow import;
+- a command that is already pending is not queued again: its timestamp is
+  updated;
+- the queue depth and the time commands waited are written as JSON to
+  'stats_file', for monitoring.
+"""
+import errno
+import fnmatch
+import heapq
+import io
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from six.moves import socketserver
+
+
+class EqueueServer(socketserver.ThreadingUnixStreamServer):
+
+  daemon_threads = True
+
+  def __init__(self, socket_path, db, logger, lockfile,
+               takeover_triggered_file_path=None, workers=1,
+               priority_list=(), stats_file=None, timeout=3):
+    self.db = db
+    self.logger = logger
+    self.lockfile = lockfile
+    self.takeover_triggered_file_path = takeover_triggered_file_path
+    self.priority_list = priority_list
+    self.stats_file = stats_file
+    self.timeout = timeout
+    self.condition = threading.Condition()
+    self.db_lock = threading.Lock()
+    # heap of [priority, sequence, command, timestamp, queued time]
+    self.queue = []
+    self.pending_dict = {}
+    self.running_set = set()
+    self._sequence = itertools.count()
+    self.stats = {
+      'workers': workers,
+      'processed': 0,
+      'failed': 0,
+      'skipped': 0,
+      'deduplicated': 0,
+      'last-wait': 0,
+      'max-wait': 0,
+    }
+    self._total_wait = 0
+    try: # left by a previous process
+      os.remove(lockfile)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+    socketserver.ThreadingUnixStreamServer.__init__(
+      self, socket_path, None)
+    for _ in range(workers):
+      thread = threading.Thread(target=self._work)
+      thread.daemon = True
+      thread.start()
+    self._writeStats()
+
+  def getPriority(self, command):
+    for priority, pattern in self.priority_list:
+      if fnmatch.fnmatch(command, pattern):
+        return priority
+    return 0
+
+  def push(self, command, timestamp):
+    with self.condition:
+      entry = self.pending_dict.get(command)
+      if entry is not None:
+        self.logger.info("%r is already pending.", command)
+        entry[3] = max(entry[3], timestamp)
+        self.stats['deduplicated'] += 1
+      else:
+        entry = self.pending_dict[command] = [self.getPriority(command),
+          next(self._sequence), command, timestamp, time.time()]
+        heapq.heappush(self.queue, entry)
+        self.condition.notify()
+      self._writeStats()
+
+  def _pop(self):
+    # The first pending command whose executable is not already running.
+    for entry in sorted(self.queue):
+      if entry[2].split('\0', 1)[0] not in self.running_set:
+        self.queue.remove(entry)
+        heapq.heapify(self.queue)
+        del self.pending_dict[entry[2]]
+        return entry
+
+  def _work(self):
+    while True:
+      with self.condition:
+        while True:
+          entry = self._pop()
+          if entry is not None:
+            break
+          self.condition.wait()
+        _, _, command, timestamp, queued = entry
+        executable = command.split('\0', 1)[0]
+        if not self.running_set:
+          open(self.lockfile, 'w').close()
+        self.running_set.add(executable)
+        wait = time.time() - queued
+        stats = self.stats
+        stats['processed'] += 1
+        stats['last-wait'] = wait
+        stats['max-wait'] = max(stats['max-wait'], wait)
+        self._total_wait += wait
+        self._writeStats()
+      result = None
+      try:
+        result = self._runCommandIfNeeded(command, timestamp)
+      finally:
+        with self.condition:
+          self.running_set.remove(executable)
+          if not self.running_set:
+            os.remove(self.lockfile)
+          if result is not None:
+            self.stats[result] += 1
+          self._writeStats()
+          self.condition.notify_all()
+
+  def _hasTakeoverBeenTriggered(self):
+    path = self.takeover_triggered_file_path
+    return path and os.path.exists(path)
+
+  def _runCommandIfNeeded(self, command, timestamp):
+    """Run the command, and return 'skipped' or 'failed' if it was not
+    run successfully"""
+    if self._hasTakeoverBeenTriggered():
+      self.logger.info('Takeover has been triggered, preventing to run import script.')
+      return 'skipped'
+    cmd_list = command.split('\0')
+    cmd_readable = ' '.join(cmd_list)
+    cmd_executable = cmd_list[0]
+    with self.db_lock:
+      if cmd_executable in self.db and \
+         timestamp <= int(self.db[cmd_executable]):
+        self.logger.info("%s already run.", cmd_readable)
+        return 'skipped'
+    self.logger.info("Running %s, %s with output:", cmd_readable, timestamp)
+    try:
+      self.logger.info(subprocess.check_output(cmd_list,
+        stderr=subprocess.STDOUT, universal_newlines=True))
+    except (OSError, subprocess.CalledProcessError) as e:
+      self.logger.warning("%s failed: %s\n%s", cmd_readable, e,
+                          getattr(e, 'output', ''))
+      return 'failed'
+    self.logger.info("%s finished successfully.", cmd_readable)
+    with self.db_lock:
+      self.db[cmd_executable] = str(timestamp)
+      sync = getattr(self.db, 'sync', None)
+      if sync is not None:
+        sync()
+
+  def _writeStats(self):
+    if not self.stats_file:
+      return
+    now = time.time()
+    stats = dict(self.stats)
+    stats['pending'] = len(self.queue)
+    stats['running'] = len(self.running_set)
+    pending_by_priority = stats['pending-by-priority'] = {}
+    for x in self.queue:
+      priority = str(x[0])
+      pending_by_priority[priority] = pending_by_priority.get(priority, 0) + 1
+    stats['oldest-pending-wait'] = max(
+      [now - x[4] for x in self.queue] or [0])
+    started = self.stats['processed']
+    stats['average-wait'] = self._total_wait / started if started else 0
+    tmp = self.stats_file + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump(stats, f, sort_keys=True)
+    os.rename(tmp, self.stats_file)
+
+  def process_request_thread(self, request, client_address):
+    self.logger.debug("Connection with file descriptor %d", request.fileno())
+    request.settimeout(self.timeout)
+    request_string = io.BytesIO()
+    try:
+      while True:
+        segment = request.recv(1024)
+        if not segment:
+          break
+        request_string.write(segment)
+    except socket.timeout:
+      pass
+    command = '127'
+    timestamp = None
+    try:
+      request_parameters = json.loads(request_string.getvalue().decode())
+      timestamp = request_parameters['timestamp']
+      command = str(request_parameters['command'])
+      self.logger.info("New command %r at %s", command, timestamp)
+    except (ValueError, KeyError, TypeError):
+      self.logger.warning("Error during the unserialization of json "
+                          "message of %r file descriptor. The message "
+                          "was %r", request.fileno(), request_string.getvalue())
+    try:
+      request.send(command.encode())
+    except Exception:
+      self.logger.warning("Couldn't respond to %r", request.fileno())
+    self.shutdown_request(request)
+    if timestamp is not None:
+      self.push(command, timestamp)
+
+
+def remove_existing_file(path):
+  try:
+    os.remove(path)
+  except OSError as e:
+    if e.errno != errno.ENOENT:
+      raise
+
+
+def main(socket_path, database, logfile, lockfile, loglevel='INFO',
+         takeover_triggered_file_path=None, workers=1, priority_list=(),
+         stats_file=None):
+  from six.moves import dbm_gnu as gdbm
+  logger = logging.getLogger('equeue')
+  # Natively support logrotate
+  handler = logging.handlers.WatchedFileHandler(logfile)
+  handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+  logger.addHandler(handler)
+  logger.setLevel(getattr(logging, loglevel))
+
+  signal.signal(signal.SIGHUP, lambda *args: sys.exit(-1))
+  signal.signal(signal.SIGTERM, lambda *args: sys.exit())
+
+  remove_existing_file(socket_path)
+  try:
+    server = EqueueServer(socket_path, gdbm.open(database, 'cs', 0o700),
+                          logger, lockfile, takeover_triggered_file_path,
+                          workers, priority_list, stats_file)
+    logger.info("Starting server on %r", socket_path)
+    server.serve_forever()
+  finally:
+    remove_existing_file(socket_path)
+    # Kill running commands, and ourselves.
+    os.kill(0, signal.SIGKILL)
@@ -26,15 +26,85 @@
 ##############################################################################
 
 from six.moves import configparser
+import fcntl
+import json
 import os
 import netaddr
 import socket
+from contextlib import contextmanager
 from six.moves import range
+from slapos.recipe.librecipe.shared import openSharedFile
+
+REGISTRY_FILENAME = 'slapos-free-port.json'
+
+
+class PortRegistry(object):
+  """
+  Host-local table of the ports allocated to (partition, section), in a JSON
+  file of a directory shared by all partitions, locked while a port is
+  allocated, so that 2 partitions running buildout at the same time do not
+  pick the same port.
+
+  A port remains allocated to the same section: it is only checked to be
+  free. Other ports are picked from a cursor per range, which moves forward
+  and skips allocated ports, so that a free port is usually found at once.
+  """
+
+  def __init__(self, directory):
+    self.directory = directory
+    self.path = os.path.join(directory, REGISTRY_FILENAME)
+
+  @contextmanager
+  def _open(self):
+    fd = openSharedFile(self.directory, REGISTRY_FILENAME)
+    with os.fdopen(fd, 'r+') as f:
+      fcntl.flock(f, fcntl.LOCK_EX)
+      try:
+        try:
+          table = json.load(f)
+        except ValueError: # new or corrupted: ports will be checked anyway
+          table = {}
+        table.setdefault('allocated', {})
+        table.setdefault('next', {})
+        yield table
+        # Rewrite in place: in a sticky directory, the file of another
+        # user can not be replaced.
+        f.seek(0)
+        f.truncate()
+        json.dump(table, f, sort_keys=True)
+        f.flush()
+      finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+  def allocate(self, key, minimum, maximum, is_free):
+    """Return the port allocated to key in [minimum, maximum[, or 0"""
+    with self._open() as table:
+      allocated = table['allocated']
+      port = allocated.pop(key, None)
+      if port is not None and minimum <= port < maximum and is_free(port):
+        allocated[key] = port
+        return port
+      used = set(allocated.values())
+      cursor = '%s-%s' % (minimum, maximum)
+      start = table['next'].get(cursor, minimum) - minimum
+      count = maximum - minimum
+      for i in range(count):
+        port = minimum + (start + i) % count
+        if port not in used and is_free(port):
+          allocated[key] = port
+          table['next'][cursor] = port + 1
+          return port
+      return 0
+
 
 class Recipe(object):
   """
   Uses the socket python standard library to get an unused port.
 
+  With 'registry-directory', the port is allocated in a PortRegistry in this
+  directory, which must be shared by all partitions of the host, and is
+  created like /tmp if it does not exist.
+
   Notice : this recipe may still fail because of race condition : if a new
   process spawns and use the picked port before the service for which it has
   been generated starts, then the service won't start. Therefore, the result
@@ -81,7 +151,26 @@ class Recipe(object):
       self.options['port'] = str(0)
       return
 
-    self.options['port'] = str(self._getFreePort())
+    registry = options.get('registry-directory')
+    if registry:
+      # The buildout directory identifies the partition even if several
+      # SlapOS nodes run on the host.
+      port = PortRegistry(registry).allocate(
+        '%s %s' % (buildout['buildout']['directory'], name),
+        self.minimum, self.maximum, self._isFree)
+    else:
+      port = self._getFreePort()
+    self.options['port'] = str(port)
+
+  def _isFree(self, port):
+    sock = socket.socket(self.inet_family, socket.SOCK_STREAM)
+    try:
+      sock.bind((self.ip, port))
+      return True
+    except socket.error:
+      return False
+    finally:
+      sock.close()
 
   def _getFreePort(self):
     """
@@ -91,14 +180,8 @@ class Recipe(object):
     a standard environment.
     """
     for port in range(self.minimum, self.maximum):
-      sock = socket.socket(self.inet_family, socket.SOCK_STREAM)
-      try:
-        sock.bind((self.ip, port))
+      if self._isFree(port):
         break
-      except socket.error:
-        continue
-      finally:
-        sock.close()
     else:
       port = 0
 
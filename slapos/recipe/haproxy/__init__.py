@@ -24,6 +24,10 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
 #
 ##############################################################################
+import hashlib
+
+import six
+
 from slapos.recipe.librecipe import GenericBaseRecipe
 
 class Recipe(GenericBaseRecipe):
@@ -50,6 +54,23 @@ class Recipe(GenericBaseRecipe):
 
   address -- string with list of all url to check
     Example: 127.0.0.1:12004 127.0.0.1:12005
+
+  maxconn -- default maximum number of connections per server
+
+  timeout-queue -- default maximum time a request waits in the queue of a
+    backend (60s by default, see haproxy.cfg.in)
+
+  check-interval -- default interval between health checks (3s)
+
+  backend-dict -- {name: (port, backend_list)} or
+    {name: (port, backend_list, option_dict)}, where option_dict may
+    override maxconn, timeout-queue and check-interval for this backend
+
+  stats-exporter-path -- optional location of a stats exporter to generate,
+    which polls the socket every 'stats-exporter-interval' seconds (10) and
+    serves the stats of the last 'stats-exporter-window' polls (60) as JSON
+    on / and as Prometheus text on /metrics, on 'stats-exporter-ip' (ip by
+    default) and 'stats-exporter-port'
   """
 
   def install(self):
@@ -85,32 +106,52 @@ class Recipe(GenericBaseRecipe):
       'haproxy-server-snippet.cfg.in')
     listen_snippet_filename = self.getTemplateFilename(
       'haproxy-listen-snippet.cfg.in')
-    server_snippet = ""
     ip = self.options['ip']
     server_check_path = self.options.get('server-check-path', None)
     if server_check_path:
       httpchk = 'option httpchk GET %s' % server_check_path
     else:
       httpchk = ''
-    # FIXME: maxconn must be provided per-backend, not globally
-    maxconn = self.options['maxconn']
+    default_dict = {
+      'maxconn': self.options['maxconn'],
+      'timeout-queue': self.options.get('timeout-queue'),
+      'check-interval': self.options.get('check-interval', '3s'),
+    }
+    # Templates are read once, not for each backend and server.
+    with open(listen_snippet_filename) as f:
+      listen_snippet = f.read()
+    with open(server_snippet_filename) as f:
+      server_line = f.read()
+    snippet_list = []
     i = 0
-    for name, (port, backend_list) in backend_dict.iteritems():
-      server_snippet += self.substituteTemplate(
-        listen_snippet_filename, {
-          'name': name,
-          'ip': ip,
-          'port': port,
-          'httpchk': httpchk,
-        })
+    for name, backend in sorted(six.iteritems(backend_dict)):
+      port, backend_list = backend[:2]
+      option_dict = dict(default_dict, **(backend[2] if len(backend) > 2
+                                          else {}))
+      timeout_queue = option_dict['timeout-queue']
+      snippet_list.append(listen_snippet % {
+        'name': name,
+        'ip': ip,
+        'port': port,
+        'httpchk': httpchk,
+        'timeout_queue': 'timeout queue %s' % timeout_queue
+                         if timeout_queue else '',
+      })
+      server_dict = {
+        'check_interval': option_dict['check-interval'],
+        'cluster_zope_thread_amount': option_dict['maxconn'],
+      }
       for address in backend_list:
         i += 1
-        server_snippet += self.substituteTemplate(
-          server_snippet_filename, {
-            'name': '%s_%s' % (name, i),
-            'address': address,
-            'cluster_zope_thread_amount': maxconn,
-          })
+        server_dict['name'] = '%s_%s' % (name, i)
+        # Server names change when backends are added, but sticky sessions
+        # must not move to another server: the cookie depends on the address,
+        # without disclosing it.
+        server_dict['cookie'] = '%s_%s' % (
+          name, hashlib.sha1(address.encode()).hexdigest()[:10])
+        server_dict['address'] = address
+        snippet_list.append(server_line % server_dict)
+    server_snippet = ''.join(snippet_list)
 
     configuration_path = self.createFile(
       self.options['conf-path'],
@@ -127,4 +168,15 @@ class Recipe(GenericBaseRecipe):
       self.options['ctl-path'],
       __name__ + '.haproxy.haproxyctl',
       (self.options['socket-path'],))
-    return [configuration_path, wrapper_path, ctl_path]
+    path_list = [configuration_path, wrapper_path, ctl_path]
+    stats_exporter_path = self.options.get('stats-exporter-path')
+    if stats_exporter_path:
+      path_list.append(self.createPythonScript(
+        stats_exporter_path,
+        __name__ + '.haproxy.exporter',
+        (self.options['socket-path'],
+         self.options.get('stats-exporter-ip', ip),
+         int(self.options['stats-exporter-port']),
+         float(self.options.get('stats-exporter-interval', 10)),
+         int(self.options.get('stats-exporter-window', 60)))))
+    return path_list
@@ -1,24 +1,256 @@
+from __future__ import print_function
+import csv
+import io
+import json
+import logging
 import socket
+import threading
+import time
+from collections import deque
+
+from six.moves import BaseHTTPServer, input, socketserver
+
 try:
   import readline
 except ImportError:
   pass
 
+logger = logging.getLogger(__name__)
+
 def haproxyctl(socket_path):
   while True:
     try:
-      l = raw_input('> ')
+      l = input('> ')
     except EOFError:
-      print
+      print()
       break
     if l == 'quit':
       break
     s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
     s.connect(socket_path)
-    s.send('%s\n' % l)
+    s.send(('%s\n' % l).encode())
     while True:
       r = s.recv(1024)
       if not r:
         break
-      print r
+      print(r.decode('utf-8', 'replace'))
+    s.close()
+
+
+def query(socket_path, command, timeout=10):
+  """Send a command to the stats socket and return the answer"""
+  s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    s.settimeout(timeout)
+    s.connect(socket_path)
+    s.sendall(('%s\n' % command).encode())
+    data = []
+    while True:
+      r = s.recv(65536)
+      if not r:
+        break
+      data.append(r)
+  finally:
     s.close()
+  return b''.join(data).decode('utf-8', 'replace')
+
+def parse_stat(text):
+  """Return the rows of 'show stat' as dicts"""
+  text = text.lstrip('# ')
+  return list(csv.DictReader(io.StringIO(text)))
+
+def parse_info(text):
+  """Return the fields of 'show info' as a dict"""
+  info = {}
+  for line in text.splitlines():
+    key, sep, value = line.partition(':')
+    if sep:
+      info[key.strip()] = value.strip()
+  return info
+
+def percentile(sorted_list, p):
+  """Nearest-rank percentile of a sorted list"""
+  if not sorted_list:
+    return None
+  return sorted_list[max(0, -(-len(sorted_list) * p // 100) - 1)]
+
+def _int(value):
+  try:
+    return int(value)
+  except (TypeError, ValueError):
+    return None
+
+
+class StatsCollector(object):
+  """Poll the stats socket and keep the last 'window' samples per backend
+
+  A sample is the queue depth (qcur), the session rate (rate) and the
+  average response time over the last 1024 requests (rtime, in ms). The
+  response time percentiles are computed over the samples of the window.
+  """
+
+  INFO_KEY_TUPLE = ('Name', 'Version', 'Uptime_sec', 'CurrConns', 'MaxConn',
+                    'ConnRate', 'SessRate', 'Run_queue', 'Idle_pct')
+
+  def __init__(self, socket_path, window=60):
+    self.socket_path = socket_path
+    self.window = window
+    self.sample_dict = {}
+    self.lock = threading.Lock()
+    self.snapshot = {'time': None, 'error': 'no data yet', 'info': {},
+                     'backends': {}}
+
+  def poll(self):
+    now = time.time()
+    try:
+      stat_list = parse_stat(query(self.socket_path, 'show stat'))
+      info = parse_info(query(self.socket_path, 'show info'))
+    except (socket.error, ValueError) as e:
+      logger.warning('Could not query %s: %s', self.socket_path, e)
+      with self.lock:
+        self.snapshot = dict(self.snapshot, error=str(e))
+      return
+    backend_dict = {}
+    for row in stat_list:
+      if row.get('svname') != 'BACKEND':
+        continue
+      name = row['pxname']
+      samples = self.sample_dict.get(name)
+      if samples is None:
+        samples = self.sample_dict[name] = deque(maxlen=self.window)
+      sample = (_int(row.get('qcur')) or 0, _int(row.get('rate')) or 0,
+                _int(row.get('rtime')))
+      samples.append(sample)
+      queue_list = [x[0] for x in samples]
+      rate_list = [x[1] for x in samples]
+      rtime_list = sorted(x[2] for x in samples if x[2] is not None)
+      backend_dict[name] = {
+        'status': row.get('status'),
+        'sessions-current': _int(row.get('scur')),
+        'sessions-total': _int(row.get('stot')),
+        'queue-current': sample[0],
+        'queue-max': max(queue_list),
+        'queue-average': float(sum(queue_list)) / len(queue_list),
+        'session-rate-current': sample[1],
+        'session-rate-average': float(sum(rate_list)) / len(rate_list),
+        'response-time-current': sample[2],
+        'response-time-p50': percentile(rtime_list, 50),
+        'response-time-p90': percentile(rtime_list, 90),
+        'response-time-p99': percentile(rtime_list, 99),
+        'servers-up': sum(1 for x in stat_list
+          if x['pxname'] == name and x['svname'] not in ('FRONTEND', 'BACKEND')
+          and x.get('status', '').startswith('UP')),
+        'samples': len(samples),
+      }
+    for name in set(self.sample_dict).difference(backend_dict):
+      del self.sample_dict[name]
+    with self.lock:
+      self.snapshot = {
+        'time': now,
+        'error': None,
+        'info': dict((k, info[k]) for k in self.INFO_KEY_TUPLE if k in info),
+        'backends': backend_dict,
+      }
+
+  def getSnapshot(self):
+    with self.lock:
+      return self.snapshot
+
+  def run(self, interval):
+    while True:
+      try:
+        self.poll()
+      except Exception as e:
+        # Keep polling, but do not serve the last snapshot as if it was up
+        # to date.
+        logger.exception('Could not collect the stats of %s',
+                         self.socket_path)
+        with self.lock:
+          self.snapshot = dict(self.snapshot, error=repr(e))
+      time.sleep(interval)
+
+
+PROMETHEUS_METRIC_LIST = (
+  # name, key, type, help
+  ('queue_current', 'queue-current', 'gauge', 'Requests in the queue'),
+  ('queue_max', 'queue-max', 'gauge', 'Maximum queue depth over the window'),
+  ('queue_average', 'queue-average', 'gauge',
+   'Average queue depth over the window'),
+  ('session_rate', 'session-rate-current', 'gauge',
+   'Sessions per second over the last second'),
+  ('session_rate_average', 'session-rate-average', 'gauge',
+   'Average session rate over the window'),
+  ('sessions_current', 'sessions-current', 'gauge', 'Current sessions'),
+  ('sessions_total', 'sessions-total', 'counter', 'Total sessions'),
+  ('servers_up', 'servers-up', 'gauge', 'Servers that are up'),
+)
+
+def prometheus(snapshot):
+  """Format a snapshot of StatsCollector as Prometheus text"""
+  line_list = []
+  backend_dict = snapshot['backends']
+  def metric(name, key, type, help, label_function=None):
+    line_list.append('# HELP haproxy_backend_%s %s' % (name, help))
+    line_list.append('# TYPE haproxy_backend_%s %s' % (name, type))
+    for backend, stats in sorted(backend_dict.items()):
+      for labels, value in (label_function(stats) if label_function
+                            else [('', stats[key])]):
+        if value is not None:
+          line_list.append('haproxy_backend_%s{backend="%s"%s} %s' % (
+            name, backend.replace('\\', '\\\\').replace('"', '\\"'),
+            labels, value))
+  for x in PROMETHEUS_METRIC_LIST:
+    metric(*x)
+  metric('response_time_milliseconds', None, 'gauge',
+         'Percentiles of the average response time over the window',
+         lambda stats: [(',quantile="%s"' % q,
+                         stats['response-time-p%s' % int(q * 100)])
+                        for q in (.5, .9, .99)])
+  line_list.append('# HELP haproxy_up Whether the last poll succeeded')
+  line_list.append('# TYPE haproxy_up gauge')
+  line_list.append('haproxy_up %s' % int(not snapshot['error']))
+  return '\n'.join(line_list) + '\n'
+
+
+class StatsServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+  daemon_threads = True
+
+  class RequestHandlerClass(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+      pass
+
+    def do_GET(self):
+      snapshot = self.server.collector.getSnapshot()
+      if self.path == '/metrics':
+        body = prometheus(snapshot)
+        content_type = 'text/plain; version=0.0.4'
+      elif self.path in ('/', '/stats.json'):
+        body = json.dumps(snapshot, sort_keys=True)
+        content_type = 'application/json'
+      else:
+        return self.send_error(404)
+      body = body.encode()
+      self.send_response(200)
+      self.send_header('Content-Type', content_type)
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+  def __init__(self, address, collector):
+    self.collector = collector
+    if ':' in address[0]:
+      self.address_family = socket.AF_INET6
+    BaseHTTPServer.HTTPServer.__init__(self, address,
+                                       self.RequestHandlerClass)
+
+def exporter(socket_path, ip, port, interval=10, window=60):
+  """Poll the stats socket every 'interval' seconds, and serve the stats as
+  JSON on / and as Prometheus text on /metrics"""
+  logging.basicConfig(level=logging.INFO)
+  collector = StatsCollector(socket_path, window)
+  thread = threading.Thread(target=collector.run, args=(interval,))
+  thread.daemon = True
+  thread.start()
+  StatsServer((ip, int(port)), collector).serve_forever()
@@ -1,22 +1,46 @@
+from slapos.recipe.librecipe import GenericBaseRecipe, getFileWriter
+from slapos.recipe.librecipe.writer import dumpsCanonicalJSON
 
-from slapos.recipe.librecipe import GenericBaseRecipe
-
-import json
-import os
+import hashlib
 
 class Recipe(GenericBaseRecipe):
+    """
+    Dump options of the section to a JSON file.
 
-    def install(self):
-        parameter_dict = {
+    The file is only rewritten when its content changes, so that services
+    watching it are not reloaded needlessly.
+
+    Input:
+      json-output
+        Path of the JSON file.
+      json-diff (optional)
+        Path of a file listing the keys that were added (+), removed (-) or
+        changed (~) the last time the JSON file changed.
+
+    Output:
+      json-fingerprint
+        SHA-256 of the JSON file content, which only depends on the dumped
+        values.
+    """
+
+    OPTION_LIST = 'json-output', 'json-diff', 'json-fingerprint', 'recipe'
+
+    def _options(self, options):
+        options['json-fingerprint'] = hashlib.sha256(
+            dumpsCanonicalJSON(self._getParameterDict(options))).hexdigest()
+
+    def _getParameterDict(self, options):
+        return {
             key: value
-            for key, value in self.options.items()
-            if key not in ['json-output', 'recipe']
+            for key, value in options.items()
+            if key not in self.OPTION_LIST
         }
 
-        with os.fdopen(os.open(self.options['json-output'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as fout:
-            fout.write(json.dumps(parameter_dict, indent=2, sort_keys=True))
-
+    def install(self):
+        getFileWriter(self.buildout['buildout'].get('directory')).writeJSON(
+            self.options['json-output'],
+            self._getParameterDict(self.options),
+            diff=self.options.get('json-diff'))
         return [self.options['json-output']]
 
     update = install
-
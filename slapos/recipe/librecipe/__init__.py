@@ -29,7 +29,6 @@ from slapos import slap
 import os
 import zc.buildout
 import zc.recipe.egg
-from hashlib import md5
 import stat
 import netaddr
 import time
@@ -41,6 +40,7 @@ import json
 from .generic import GenericBaseRecipe
 from .genericslap import GenericSlapRecipe
 from .filehash import filehash, generateHashFromFiles
+from .writer import getFileWriter
 
 # Utility functions to (de)serialise live python objects in order to send them
 # to master.
@@ -193,24 +193,10 @@ class BaseSlapRecipe:
 
     Raises os related errors"""
 
-    file_altered = False
-    if not os.path.exists(path):
-      open(path, 'w').write(content)
-      file_altered = True
-    else:
-      new_sum = md5()
-      current_sum = md5()
-      new_sum.update(content)
-      current_sum.update(open(path, 'r').read())
-      if new_sum.digest() != current_sum.digest():
-        file_altered = True
-        open(path, 'w').write(content)
-
-    if oct(stat.S_IMODE(os.stat(path).st_mode)) != mode:
-      os.chmod(path, int(mode, 8))
-      file_altered = True
-
-    return file_altered
+    if not isinstance(content, bytes):
+      content = content.encode('utf-8')
+    return getFileWriter(self.work_directory).write(path, content,
+      int(mode, 8))
 
   def createBackupDirectory(self, name, mode='0700'):
     """Creates named directory in self.backup_directory and returns its path"""
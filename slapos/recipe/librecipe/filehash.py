@@ -25,11 +25,15 @@
 #
 ##############################################################################
 from __future__ import print_function
+import errno
 import hashlib
-import shutil
+import json
 import os
+import stat
+from multiprocessing.pool import ThreadPool
 
 DEFAULT_HASH = 'sha512'
+BUFFER_SIZE = 1 << 20
 
 class Hash(object):
 
@@ -42,34 +46,103 @@ class Hash(object):
   def read(self):
     return self._hash.hexdigest()
 
+def _hashfile(filename, type_):
+  digest = hashlib.new(type_)
+  with open(filename, 'rb') as file_:
+    while True:
+      data = file_.read(BUFFER_SIZE)
+      if not data:
+        return digest.hexdigest()
+      digest.update(data)
+
 def filehash(filename, type_=DEFAULT_HASH):
   if not os.path.isfile(filename):
     raise ValueError("%r isn't a file" % filename)
-
-  digest = Hash(type_)
-  with open(filename, 'r') as file_:
-    shutil.copyfileobj(file_, digest)
-  return digest.read()
+  return _hashfile(filename, type_)
+
+def _mtime_ns(st):
+  try:
+    return st.st_mtime_ns
+  except AttributeError: # Python 2
+    return int(st.st_mtime * 1e9)
+
+# Digests of files hashed by generateHashFromFiles are kept for the whole
+# process, which is usually a buildout run, as long as files are not modified.
+_hash_from_files_cache = {}
+hash_from_files_stats = {'hit': 0, 'miss': 0, 'read': 0}
+
+def _hashFromFile(path):
+  st = os.stat(path)
+  key = _mtime_ns(st), st.st_size, st.st_ino
+  try:
+    cached_key, result = _hash_from_files_cache[path]
+  except KeyError:
+    pass
+  else:
+    if cached_key == key:
+      hash_from_files_stats['hit'] += 1
+      return result
+  hash_from_files_stats['miss'] += 1
+  hash_from_files_stats['read'] += 1
+  with open(path, 'rb') as afile:
+    size = os.fstat(afile.fileno()).st_size
+    file_hasher = hashlib.md5()
+    while size >= 0:
+      data = afile.read(BUFFER_SIZE)
+      if not data:
+        break
+      size -= len(data)
+      file_hasher.update(data)
+    if size:
+      # Modified while reading.
+      afile.seek(0)
+      data = afile.read()
+      file_hasher = hashlib.md5(data)
+      size = len(data)
+    else:
+      size = afile.tell()
+  result = b"%u\n" % size + file_hasher.digest()
+  # Cache under the key of the file before it was read: if it was modified
+  # meanwhile, it will be read again next time.
+  _hash_from_files_cache[path] = key, result
+  return result
 
 def generateHashFromFiles(file_list):
+  """Return a digest of the contents of files in file_list, reading only
+  files that were modified since they were hashed by this process"""
   hasher = hashlib.md5()
   for path in file_list:
-    with open(path, 'rb') as afile:
-      buf = afile.read()
-    hasher.update(b"%u\n" % len(buf))
-    hasher.update(buf)
+    hasher.update(_hashFromFile(path))
   return hasher.hexdigest()
 
+def _loadManifest(manifest, type_):
+  try:
+    with open(manifest) as f:
+      data = json.load(f)
+  except (IOError, OSError) as e:
+    if e.errno != errno.ENOENT:
+      raise
+  except ValueError: # corrupted manifest
+    pass
+  else:
+    if data.get('type') == type_:
+      return data['files']
+  return {}
+
 # Home made hashdeep <http://md5deep.sourceforge.net/>
-def dirhash(dirname, type_=DEFAULT_HASH):
+def dirhash(dirname, type_=DEFAULT_HASH, manifest=None, jobs=4):
   """Walk into a directory an return a unique hash for
-  the directory structure and its files content."""
+  the directory structure and its files content.
+
+  The hash of each file content is computed separately, so that if a
+  manifest path is given, it can be saved there with file stat information:
+  next calls only rehash files whose size, inode, mtime or ctime changed.
+  The result does not depend on whether a manifest is used or not.
+  Files are hashed in parallel by up to `jobs` threads."""
 
   if not os.path.isdir(dirname):
     raise ValueError("%r isn't a directory" % dirname)
 
-  digest = Hash(type_)
-
   # List the directory structure
   path_list = []
   for dirname, dirlist, filelist in os.walk(dirname, followlinks=False):
@@ -77,30 +150,75 @@ def dirhash(dirname, type_=DEFAULT_HASH):
       path_list.append(os.path.join(dirname, filename))
   path_list.sort()
 
+  old_files = _loadManifest(manifest, type_) if manifest else {}
+  files = {}
+  to_hash = []
   for path in path_list:
-    # Change the hash even if the file or the directory is empty
-    digest.write(path)
+    try:
+      st = os.stat(path)
+    except OSError: # e.g. broken symlink
+      continue
+    if stat.S_ISREG(st.st_mode):
+      key = [st.st_size, st.st_ino, _mtime_ns(st), st.st_ctime]
+      entry = old_files.get(path)
+      if entry and entry[:-1] == key:
+        files[path] = entry
+      else:
+        files[path] = key
+        to_hash.append(path)
+
+  if to_hash:
+    pool = ThreadPool(min(jobs, len(to_hash)))
+    try:
+      for path, file_digest in zip(to_hash, pool.imap(
+          lambda path: _hashfile(path, type_), to_hash)):
+        files[path].append(file_digest)
+    finally:
+      pool.close()
+      pool.join()
+
+  if manifest:
+    tmp = manifest + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump({'type': type_, 'files': files}, f)
+    os.rename(tmp, manifest)
 
+  digest = Hash(type_)
+  for path in path_list:
+    entry = files.get(path)
+    # Change the hash even if the file or the directory is empty
+    if not isinstance(path, bytes):
+      path = path.encode('utf-8', 'surrogateescape')
+    digest.write(path + b'\0')
     # Update the hash with file content
-    if os.path.isfile(path):
-      with open(path, 'r') as file_:
-        shutil.copyfileobj(file_, digest)
+    if entry:
+      digest.write(entry[-1].encode())
+    digest.write(b'\n')
 
   return digest.read()
 
-def pathhash(path, type_=DEFAULT_HASH):
+def pathhash(path, type_=DEFAULT_HASH, manifest=None, jobs=4):
   if os.path.isdir(path):
-    return dirhash(path, type_)
+    return dirhash(path, type_, manifest, jobs)
   elif os.path.isfile(path):
     return filehash(path, type_)
   raise ValueError("%r isn't a directory nor a file" % path)
 
-# you can use python -m slapos.recipe.librecipe.filehash [hash] path
+def main(args=None):
+  import argparse
+  parser = argparse.ArgumentParser(
+    description="Hash a file, or a directory structure and its files content.")
+  parser.add_argument('-m', '--manifest',
+    help="Keep the hash of each file of the directory in this manifest,"
+         " so that only modified files are hashed by next calls.")
+  parser.add_argument('-j', '--jobs', type=int, default=4,
+    help="Number of files of the directory hashed in parallel.")
+  parser.add_argument('type', nargs='?', default=DEFAULT_HASH)
+  parser.add_argument('path')
+  args = parser.parse_args(args)
+  print(args.path, '-',
+        pathhash(args.path, args.type, args.manifest, args.jobs))
+
+# you can use python -m slapos.recipe.librecipe.filehash [-m manifest] [hash] path
 if __name__ == '__main__':
-  import sys
-  if len(sys.argv) == 1:
-    raise ValueError("Not enough command line arguments")
-  if len(sys.argv) == 2:
-    print(sys.argv[1], '-', pathhash(sys.argv[1]))
-  else:
-    print(sys.argv[2], '-', pathhash(sys.argv[2], sys.argv[1]))
+  main()
@@ -26,14 +26,12 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
 #
 ##############################################################################
-import errno
 import logging
 import os
 import sys
 import inspect
 import re
 import shutil
-import stat
 from six.moves.urllib.parse import quote
 import itertools
 import six
@@ -45,7 +43,15 @@ import pkg_resources
 from zc.buildout import easy_install, UserError
 from zc.recipe.egg import Egg
 
-from slapos.recipe.librecipe import shlex
+from slapos.recipe.librecipe import shlex, workingset, writer
+
+LAUNCHER_TEMPLATE = """#!/bin/sh
+''':'
+exec %s -S "$0" "$@"
+'''
+%s
+generic_exec(%s)
+"""
 
 class GenericBaseRecipe(object):
   """Boilerplate class for all Buildout recipes providing helpful methods like
@@ -86,8 +92,29 @@ class GenericBaseRecipe(object):
   def getWorkingSet(self):
     """If you want do override the default working set"""
     egg = Egg(self.buildout, 'slapos.cookbook', self.options.copy())
-    requirements, ws = egg.working_set()
-    return ws
+    buildout_section = self.buildout['buildout']
+    directory = buildout_section.get('directory')
+    # Everything that may change the result of the resolution,
+    # apart from the content of eggs directories.
+    option_dict = {k: buildout_section.get(k, '') for k in (
+      'allow-hosts', 'allow-picked-versions', 'allow-unknown-extras',
+      'newest', 'offline', 'prefer-final', 'use-dependency-links')}
+    option_dict['find-links'] = egg.options.get('find-links', '')
+    option_dict['index'] = egg.options.get('index') or ''
+    versions = dict(easy_install.default_versions())
+    versions_section = buildout_section.get('versions')
+    if versions_section and versions_section in self.buildout:
+      versions.update(self.buildout[versions_section])
+    option_dict['versions'] = '\n'.join(
+      '%s = %s' % x for x in sorted(six.iteritems(versions)))
+    return workingset.getWorkingSet(
+      [r.strip() for r in egg.options.get('eggs', egg.name).splitlines()
+       if r.strip()],
+      egg.options['eggs-directory'],
+      egg.options['develop-eggs-directory'],
+      lambda: egg.working_set()[1],
+      directory and os.path.join(directory, workingset.CACHE_FILENAME),
+      option_dict)
 
   def _options(self, options):
     """Options Hook method. This method can be overriden in child classes"""
@@ -99,25 +126,10 @@ class GenericBaseRecipe(object):
     The parent directory should exists, else it would raise IOError"""
     if not isinstance(content, bytes):
       content = content.encode('utf-8')
-    # Try to reuse existing file. This is particularly
+    # Reuse existing file if it has the same content. This is particularly
     # important to avoid excessive IO during update.
-    try:
-      with open(name, 'rb') as f:
-        if f.read(len(content)+1) == content:
-          if None is not mode != stat.S_IMODE(os.fstat(f.fileno()).st_mode):
-            os.fchmod(f.fileno(), mode)
-          return os.path.abspath(name)
-    except (IOError, OSError) as e:
-      pass
-    try:
-      os.unlink(name)
-    except OSError as e:
-      if e.errno != errno.ENOENT:
-        raise
-    with open(name, 'wb') as f:
-      if mode is not None:
-        os.fchmod(f.fileno(), mode)
-      f.write(content)
+    writer.getFileWriter(self.buildout['buildout'].get('directory')).write(
+      name, content, mode)
     return os.path.abspath(name)
 
   def createExecutable(self, name, content, mode=0o700):
@@ -158,9 +170,19 @@ class GenericBaseRecipe(object):
     """Create a wrapper script for process replacement"""
     assert args
     if kw:
-      return self.createPythonScript(path,
-        'slapos.recipe.librecipe.execute.generic_exec',
-        (args, env) if env else (args,), kw)
+      # Embed slapos.recipe.librecipe.launcher so that the wrapper only needs
+      # a Python interpreter started without site: importing generic_exec
+      # from the slapos.cookbook egg would load pkg_resources and much more.
+      # The first lines are valid for both sh and Python, which avoids any
+      # shebang size limitation.
+      args = [repr(list(args))]
+      if env:
+        args.append(repr(env))
+      args += map('%s=%r'.__mod__, sorted(six.iteritems(kw)))
+      return self.createFile(path, LAUNCHER_TEMPLATE % (
+          shlex.quote(sys.executable),
+          pkg_resources.resource_string(__name__, 'launcher.py').decode(),
+          ', '.join(args)), 0o700)
 
     # Simple case: creates a basic shell script for process replacement.
     # This must be kept minimal to avoid code duplication with generic_exec.
@@ -24,12 +24,8 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
 #
 ##############################################################################
-from slapos import slap
-import time
-
 from .generic import GenericBaseRecipe
-
-CONNECTION_CACHE = {}
+from .slapclient import getSlapClient
 
 class GenericSlapRecipe(GenericBaseRecipe):
   """Base class for all slap.recipe.* needing SLAP informations like instance
@@ -40,7 +36,7 @@ class GenericSlapRecipe(GenericBaseRecipe):
   def __init__(self, buildout, name, options):
     """Default initialisation"""
     GenericBaseRecipe.__init__(self, buildout, name, options)
-    self.slap = slap.slap()
+    self.slap_client = getSlapClient(buildout)
 
     # SLAP related information
     slap_connection = buildout['slap-connection']
@@ -52,17 +48,11 @@ class GenericSlapRecipe(GenericBaseRecipe):
     self.cert_file = slap_connection.get('cert-file')
 
   def install(self):
-
-    cache_key = "%s_%s" % (self.computer_id, self.computer_partition_id)
-    self.computer_partition = CONNECTION_CACHE.get(cache_key, None)
-
-    self.slap.initializeConnection(self.server_url, self.key_file,
+    self.slap = self.slap_client.getSlap(self.server_url, self.key_file,
         self.cert_file)
-    if self.computer_partition is None:
-      self.computer_partition = self.slap.registerComputerPartition(
-        self.computer_id,
-        self.computer_partition_id)
-      CONNECTION_CACHE[cache_key] = self.computer_partition
+    self.computer_partition = self.slap_client.getComputerPartition(
+      self.server_url, self.computer_id, self.computer_partition_id,
+      self.key_file, self.cert_file)
 
     self.request = self.computer_partition.request
     self.setConnectionDict = self.computer_partition.setConnectionDict
@@ -0,0 +1,151 @@
+# This module is embedded as is in wrappers generated by
+# GenericBaseRecipe.createWrapper, which run it with 'python -S'.
+# It must therefore only depend on the standard library, import modules
+# only when needed and stay compatible with all supported Python versions.
+import os
+import sys
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO   = 0x00000080
+IN_CREATE     = 0x00000100
+IN_DELETE     = 0x00000200
+
+def _libc():
+  from ctypes import CDLL
+  # CDLL(None) gives the symbols of the running process, which is much
+  # faster than ctypes.util.find_library.
+  return CDLL(None, use_errno=True)
+
+def _check(result):
+  if result < 0:
+    from ctypes import get_errno
+    e = get_errno()
+    raise OSError(e, os.strerror(e))
+  return result
+
+def _encode(path):
+  if isinstance(path, bytes):
+    return path
+  return path.encode(sys.getfilesystemencoding(), 'surrogateescape')
+
+def _decode(name):
+  if str is bytes:
+    return name
+  return name.decode(sys.getfilesystemencoding(), 'surrogateescape')
+
+def _wait_files_creation(file_list):
+  import struct
+  # Establish a list of directory and subfiles.
+  directories = {}
+  for f in file_list:
+    dirname, filename = os.path.split(f)
+    directories.setdefault(dirname, {})[filename] = False
+
+  def all_files_exists():
+    return all(all(files.values()) for files in directories.values())
+
+  libc = _libc()
+  fd = _check(libc.inotify_init())
+  try:
+    watchdescriptors = {}
+    for dirname in directories:
+      watchdescriptors[_check(libc.inotify_add_watch(fd, _encode(dirname),
+        IN_CREATE | IN_DELETE | IN_MOVED_TO | IN_MOVED_FROM))] = dirname
+    # Test existence after watching, so that we don't miss an event.
+    for dirname, files in directories.items():
+      for filename in files:
+        files[filename] = os.path.lexists(os.path.join(dirname, filename))
+
+    while not all_files_exists():
+      data = os.read(fd, 65536)
+      i = 0
+      while i < len(data):
+        wd, mask, cookie, length = struct.unpack_from('iIII', data, i)
+        i += 16
+        name = _decode(data[i:i+length].rstrip(b'\0'))
+        i += length
+        directory = directories[watchdescriptors[wd]]
+        if name in directory:
+          directory[name] = bool(mask & (IN_CREATE | IN_MOVED_TO))
+  finally:
+    os.close(fd)
+
+def _running_cmdline(pid):
+  with open('/proc/%s/cmdline' % pid) as f:
+    return f.read().split('\0')[:-1]
+
+def generic_exec(args, extra_environ=None, wait_list=None,
+                 pidfile=None, reserve_cpu=False, private_tmpfs=(),
+                 #shebang_workaround=False, # XXX: still needed ?
+                 ):
+  args = list(args)
+
+  if pidfile:
+    try:
+      with open(pidfile) as f:
+        pid = int(f.read())
+      running = _running_cmdline(pid)
+    except Exception:
+      pass
+    else:
+      # With chained shebangs, several paths may be inserted at the beginning.
+      n = len(args)
+      for i in range(1+len(running)-n):
+        if args == running[i:n+i]:
+          sys.exit("Already running with pid %s." % pid)
+    with open(pidfile, 'w') as f:
+      f.write(str(os.getpid()))
+
+  args += sys.argv[1:]
+
+  if reserve_cpu:
+    # If the CGROUPS cpuset is available (and prepared by slap format),
+    # request an exclusive CPU core for this process.
+    with open(os.path.expanduser('~/.slapos-cpu-exclusive'), 'a') as f:
+      f.write('%s\n' % os.getpid())
+
+  if wait_list:
+    _wait_files_creation(wait_list)
+
+  if private_tmpfs:
+    from ctypes import c_char_p, c_int, c_ulong
+    libc = _libc()
+    libc.mount.argtypes = c_char_p, c_char_p, c_char_p, c_ulong, c_char_p
+    libc.unshare.argtypes = c_int,
+    CLONE_NEWNS   = 0x00020000
+    CLONE_NEWUSER = 0x10000000
+    import errno
+    uid = os.getuid()
+    gid = os.getgid()
+    try:
+      _check(libc.unshare(CLONE_NEWUSER |CLONE_NEWNS))
+    except OSError as e:
+      # User namespaces are disabled or not permitted (e.g. in a container):
+      # run with plain directories rather than not at all.
+      if e.errno not in (errno.EPERM, errno.EINVAL, errno.ENOSPC,
+                         errno.EUSERS):
+        raise
+      sys.stderr.write("private_tmpfs not permitted (%s),"
+                       " using plain directories\n" % e)
+      unshared = False
+    else:
+      unshared = True
+      with open('/proc/self/setgroups', 'w') as f: f.write('deny')
+      with open('/proc/self/uid_map', 'w') as f: f.write('%s %s 1' % (uid, uid))
+      with open('/proc/self/gid_map', 'w') as f: f.write('%s %s 1' % (gid, gid))
+    for size, path in private_tmpfs:
+      try:
+        os.mkdir(path)
+      except OSError as e:
+        if e.errno != errno.EEXIST:
+          raise
+      if unshared:
+        _check(libc.mount(b'tmpfs', _encode(path), b'tmpfs', 0,
+                          _encode('size=' + size)))
+
+  if extra_environ:
+    env = os.environ.copy()
+    env.update(extra_environ)
+    os.execve(args[0], args, env)
+  else:
+    os.execv(args[0], args)
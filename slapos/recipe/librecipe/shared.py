@@ -0,0 +1,70 @@
+##############################################################################
+#
+# Copyright (c) 2010 Vifib SARL and Contributors. All Rights Reserved.
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsibility of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# guarantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+##############################################################################
+"""Files shared by the partitions of a host, which run as different users"""
+import errno
+import os
+import stat
+
+
+def openSharedFile(directory, name, flags=os.O_RDWR):
+  """Open the file 'name' of 'directory', creating both if needed, and
+  return its file descriptor
+
+  A directory created here is, like /tmp, sticky and writable by all
+  partitions. Symlinks are not followed. A file created here is readable
+  and writable by all partitions, but the mode of an existing file is left
+  as is, since it may belong to someone else.
+  """
+  try:
+    os.mkdir(directory)
+  except OSError as e:
+    if e.errno != errno.EEXIST:
+      raise
+  else:
+    os.chmod(directory, 0o1777) # regardless of the umask
+  if not stat.S_ISDIR(os.lstat(directory).st_mode):
+    raise OSError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), directory)
+  path = os.path.join(directory, name)
+  flags |= os.O_NOFOLLOW
+  while True:
+    try:
+      fd = os.open(path, flags | os.O_CREAT | os.O_EXCL, 0o666)
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise
+    else:
+      try:
+        os.fchmod(fd, 0o666) # regardless of the umask
+      except BaseException:
+        os.close(fd)
+        raise
+      return fd
+    try:
+      return os.open(path, flags)
+    except OSError as e:
+      if e.errno != errno.ENOENT: # removed in the meantime
+        raise
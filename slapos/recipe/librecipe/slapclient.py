@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# vim: set et sts=2:
+##############################################################################
+#
+# Copyright (c) 2010 Vifib SARL and Contributors. All Rights Reserved.
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsibility of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# guarantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+##############################################################################
+"""SLAP master client shared by all recipes of a buildout run
+
+Recipes used to create their own slap connection and to fetch the partition
+information again, so that a single instance buildout did many identical
+round-trips to the master. A SlapClient keeps one connection per master
+(reusing HTTP connections), one partition object per partition, and it
+memoizes what is read from the master during the run.
+"""
+import atexit
+import copy
+import logging
+import threading
+
+import requests
+from slapos import slap
+
+logger = logging.getLogger(__name__)
+
+CLIENT_ATTRIBUTE = '_slapos_recipe_slap_client'
+
+
+_process_client = None
+
+
+def getSlapClient(buildout=None):
+  """Return the SlapClient shared by all recipes of the given buildout
+
+  Without buildout, e.g. in scripts run by the partition, return the client
+  shared by the whole process. If the buildout object can not hold it (e.g.
+  a plain dict in tests), a new client is returned, which is then only
+  shared by the caller.
+  """
+  global _process_client
+  if buildout is None:
+    if _process_client is None:
+      _process_client = SlapClient()
+    return _process_client
+  try:
+    return getattr(buildout, CLIENT_ATTRIBUTE)
+  except AttributeError:
+    client = SlapClient()
+    try:
+      setattr(buildout, CLIENT_ATTRIBUTE, client)
+    except AttributeError:
+      pass
+    else:
+      atexit.register(client.report)
+    return client
+
+
+class ComputerPartition(object):
+  """Proxy to a slap ComputerPartition memoizing the information it reads
+
+  getInstanceParameterDict, getConnectionParameterDict, getState and
+  getInstanceGuid query the master once. Returned values are copies so that
+  callers can modify them freely.
+  """
+
+  def __init__(self, computer_partition):
+    self._computer_partition = computer_partition
+    self._cache = {}
+    # Last connection parameters published during the run, by slave
+    # reference (None for the partition itself).
+    self.published_dict = {}
+
+  def __getattr__(self, name):
+    return getattr(self._computer_partition, name)
+
+  def _get(self, name):
+    try:
+      value = self._cache[name]
+    except KeyError:
+      value = self._cache[name] = getattr(self._computer_partition, name)()
+    return copy.deepcopy(value)
+
+  def getInstanceParameterDict(self):
+    return self._get('getInstanceParameterDict')
+
+  def getConnectionParameterDict(self):
+    return self._get('getConnectionParameterDict')
+
+  def getConnectionParameter(self, key):
+    try:
+      return self.getConnectionParameterDict()[key]
+    except KeyError:
+      raise slap.NotFoundError("%s not found" % key)
+
+  def getState(self):
+    return self._get('getState')
+
+  def getInstanceGuid(self):
+    return self._get('getInstanceGuid')
+
+  def setConnectionDict(self, connection_dict, slave_reference=None):
+    self._computer_partition.setConnectionDict(connection_dict,
+                                               slave_reference)
+    self.published_dict[slave_reference or None] = copy.deepcopy(
+      connection_dict)
+    if slave_reference is None:
+      self._cache['getConnectionParameterDict'] = dict(connection_dict)
+
+
+class SlapClient(object):
+  """Connections to SlapOS masters and partitions used during a run"""
+
+  def __init__(self):
+    self._slap_dict = {}
+    self._partition_dict = {}
+    # Recipes may use the client from several threads.
+    self._lock = threading.RLock()
+    self.round_trips = 0
+    # Connection parameters of instances requested during the run
+    self.connection_parameter_dict = {}
+
+  def _countRoundTrips(self, connection_helper, session):
+    do_request = getattr(connection_helper, 'do_request', None)
+    if do_request is None:
+      return
+    method_dict = {requests.get: session.get, requests.post: session.post}
+    def wrapper(method, *args, **kw):
+      with self._lock:
+        self.round_trips += 1
+      return do_request(method_dict.get(method, method), *args, **kw)
+    connection_helper.do_request = wrapper
+
+  def getSlap(self, server_url, key_file=None, cert_file=None):
+    """Return the slap object connected to the given master"""
+    key = server_url, key_file, cert_file
+    with self._lock:
+      try:
+        return self._slap_dict[key]
+      except KeyError:
+        pass
+      connection = slap.slap()
+      connection.initializeConnection(server_url, key_file, cert_file)
+      # Keep HTTP connections alive for all requests to this master.
+      self._countRoundTrips(getattr(connection, '_connection_helper', None),
+                            requests.Session())
+      self._slap_dict[key] = connection
+      return connection
+
+  def getComputerPartition(self, server_url, computer_id, partition_id,
+                           key_file=None, cert_file=None):
+    """Return the memoizing proxy to the given partition"""
+    key = server_url, key_file, cert_file, computer_id, partition_id
+    with self._lock:
+      try:
+        return self._partition_dict[key]
+      except KeyError:
+        pass
+      computer_partition = self._partition_dict[key] = ComputerPartition(
+        self.getSlap(server_url, key_file, cert_file)
+          .registerComputerPartition(computer_id, partition_id))
+      return computer_partition
+
+  def report(self):
+    if self.round_trips:
+      logger.info("%s round-trip(s) to SlapOS master", self.round_trips)
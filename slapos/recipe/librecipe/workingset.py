@@ -0,0 +1,124 @@
+##############################################################################
+#
+# Copyright (c) 2010 Vifib SARL and Contributors. All Rights Reserved.
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsibility of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# guarantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+##############################################################################
+"""Cache of working sets computed by zc.recipe.egg
+
+Resolving a working set is slow and every section generating a Python script
+does it again. Working sets are kept in memory for the whole buildout process,
+and the list of their distributions is also saved on disk so that next runs
+skip egg resolution as long as eggs and develop eggs directories are not
+modified, and options affecting resolution (like version pins) are the same.
+"""
+import errno
+import json
+import os
+
+import pkg_resources
+import six
+
+CACHE_FILENAME = '.slapos-working-set-cache.json'
+
+# Process-wide counters, to check that a run where nothing changed
+# did not resolve any egg.
+stats = {'hit': 0, 'miss': 0}
+
+_memory_cache = {}
+
+def _mtime(path):
+  try:
+    return os.stat(path).st_mtime
+  except OSError:
+    return None
+
+def _load(cache_file):
+  try:
+    with open(cache_file) as f:
+      return json.load(f)
+  except (IOError, OSError) as e:
+    if e.errno != errno.ENOENT:
+      raise
+  except ValueError: # corrupted cache
+    pass
+  return {}
+
+def _save(cache_file, name, stamp, ws):
+  cache = _load(cache_file)
+  cache[name] = {
+    'stamp': stamp,
+    'distributions': [(dist.project_name, dist.location) for dist in ws],
+  }
+  tmp = cache_file + '.tmp'
+  with open(tmp, 'w') as f:
+    json.dump(cache, f, indent=2, sort_keys=True)
+  os.rename(tmp, cache_file)
+
+def _restore(distribution_list):
+  """Rebuild a working set from (project name, location) pairs, or return
+  None if any of the distributions is not found anymore."""
+  ws = pkg_resources.WorkingSet([])
+  for project_name, location in distribution_list:
+    key = pkg_resources.safe_name(project_name).lower()
+    for dist in pkg_resources.find_distributions(location, only=True):
+      if dist.key == key:
+        ws.add(dist, location)
+        break
+    else:
+      return None
+  return ws
+
+def getWorkingSet(egg_list, eggs_directory, develop_eggs_directory, resolve,
+                  cache_file=None, options=None):
+  """Return the working set for egg_list, calling resolve() only if there is
+  no valid cached one.
+
+  The cache is invalidated when eggs or develop eggs directories are modified,
+  or when options (a dict of strings, e.g. version pins) differ.
+  If cache_file is given, the working set is also persisted there.
+  """
+  name = '\n'.join(egg_list)
+  stamp = [eggs_directory, _mtime(eggs_directory),
+           develop_eggs_directory, _mtime(develop_eggs_directory),
+           sorted([k, v] for k, v in six.iteritems(options or {}))]
+  memory_key = name, json.dumps(stamp)
+  try:
+    ws = _memory_cache[memory_key]
+  except KeyError:
+    ws = None
+    if cache_file:
+      entry = _load(cache_file).get(name)
+      if entry and entry['stamp'] == stamp:
+        ws = _restore(entry['distributions'])
+    if ws is None:
+      stats['miss'] += 1
+      ws = resolve()
+      if cache_file:
+        _save(cache_file, name, stamp, ws)
+    else:
+      stats['hit'] += 1
+    _memory_cache[memory_key] = ws
+  else:
+    stats['hit'] += 1
+  return ws
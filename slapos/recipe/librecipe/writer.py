@@ -0,0 +1,235 @@
+##############################################################################
+#
+# Copyright (c) 2010 Vifib SARL and Contributors. All Rights Reserved.
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsibility of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# guarantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+##############################################################################
+"""Change-detecting file writer
+
+Recipes used to read every existing file in order to decide whether it had to
+be rewritten. FileWriter keeps an index of (path, size, mtime, inode, sha256)
+for the files it wrote, so that an unchanged file is detected with a single
+stat. Changed files are written to a temporary file and renamed over the
+destination once synced to disk. Directories containing renamed files are
+synced once for the whole buildout run, when the writer is committed.
+
+Only the sync of directories is batched: each file is synced and renamed
+as soon as it is written, because sections installed later in the same run
+may use it (e.g. run a wrapper), and renaming a file whose data is not yet
+on disk could leave it empty after a crash.
+"""
+import atexit
+import binascii
+import errno
+import hashlib
+import json
+import logging
+import os
+import stat
+
+from .filehash import _mtime_ns
+
+INDEX_FILENAME = '.slapos-file-index.json'
+
+logger = logging.getLogger(__name__)
+
+_writer_dict = {}
+
+def getFileWriter(directory=None):
+  """Return the writer shared by all recipes of the buildout running in
+  directory. Without directory, the index is only kept in memory, so files
+  that existed before are compared by content."""
+  if directory:
+    directory = os.path.abspath(directory)
+  else:
+    directory = None
+  try:
+    return _writer_dict[directory]
+  except KeyError:
+    writer = _writer_dict[directory] = FileWriter(
+      directory and os.path.join(directory, INDEX_FILENAME))
+    atexit.register(writer.commit)
+    return writer
+
+def dumpsCanonicalJSON(data):
+  """Serialise data to JSON bytes that only depend on its value"""
+  return json.dumps(data, indent=2, sort_keys=True,
+                    separators=(',', ': ')).encode('utf-8')
+
+def diffJSON(old, new):
+  """Return a list of (sign, key) for keys of new (a dict) that were added
+  (+), removed (-) or changed (~) compared to old"""
+  if not (isinstance(old, dict) and isinstance(new, dict)):
+    return [('~', '.')] if old != new else []
+  result = []
+  for key in sorted(set(old).union(new)):
+    if key not in old:
+      result.append(('+', key))
+    elif key not in new:
+      result.append(('-', key))
+    elif old[key] != new[key]:
+      result.append(('~', key))
+  return result
+
+class FileWriter(object):
+
+  def __init__(self, index_path=None):
+    self.index_path = index_path
+    self.index = {}
+    if index_path:
+      try:
+        with open(index_path) as f:
+          self.index = json.load(f)
+      except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+          raise
+      except ValueError: # corrupted index
+        pass
+    self._pending = set()
+    self._index_modified = False
+    self.written_files = 0
+    self.written_bytes = 0
+    self.unchanged_files = 0
+
+  def _isUnchanged(self, path, st, digest, content):
+    entry = self.index.get(path)
+    if entry is not None:
+      if entry == [st.st_size, _mtime_ns(st), st.st_ino, digest]:
+        return True
+    if st.st_size != len(content) or not stat.S_ISREG(st.st_mode):
+      return False
+    # Not indexed or modified outside of the writer: compare contents.
+    with open(path, 'rb') as f:
+      if f.read(len(content) + 1) != content:
+        return False
+    self._updateIndex(path, st, digest)
+    return True
+
+  def _updateIndex(self, path, st, digest):
+    self.index[path] = [st.st_size, _mtime_ns(st), st.st_ino, digest]
+    self._index_modified = True
+
+  def write(self, path, content, mode=None):
+    """Write content (bytes) to path unless it already has this content,
+    and set its mode. Return whether the file was created or altered."""
+    path = os.path.abspath(path)
+    digest = hashlib.sha256(content).hexdigest()
+    try:
+      st = os.stat(path)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise
+      st = None
+    else:
+      if self._isUnchanged(path, st, digest, content):
+        self.unchanged_files += 1
+        if None is not mode != stat.S_IMODE(st.st_mode):
+          os.chmod(path, mode)
+          return True
+        return False
+    if mode is None and st:
+      mode = stat.S_IMODE(st.st_mode)
+    dirname, basename = os.path.split(path)
+    while 1:
+      tmp = os.path.join(dirname, '.%s.%s' % (
+        basename, binascii.hexlify(os.urandom(4)).decode()))
+      try:
+        # Without mode, the new file gets the default one (umask applied).
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        break
+      except OSError as e:
+        if e.errno != errno.EEXIST:
+          raise
+    try:
+      if mode is not None:
+        os.fchmod(fd, mode)
+      with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(fd)
+      os.rename(tmp, path)
+    except:
+      os.unlink(tmp)
+      raise
+    self._updateIndex(path, os.stat(path), digest)
+    self._pending.add(dirname)
+    self.written_files += 1
+    self.written_bytes += len(content)
+    return True
+
+  def writeJSON(self, path, data, mode=0o600, diff=None):
+    """Write data to path as canonical JSON, like write(). If diff is given,
+    it is the path of a file where the keys that changed are listed whenever
+    the content changes. Return the SHA-256 of the content, which does not
+    depend on the ordering of dicts and can be used as a fingerprint of data.
+    """
+    content = dumpsCanonicalJSON(data)
+    if diff:
+      try:
+        with open(path, 'rb') as f:
+          old = f.read()
+      except IOError as e:
+        if e.errno != errno.ENOENT:
+          raise
+        old = None
+    if self.write(path, content, mode) and diff and old != content:
+      try:
+        old = json.loads(old.decode('utf-8'))
+      except (AttributeError, ValueError): # new or invalid file
+        old = {}
+      self.write(diff, ''.join(
+        '%s %s\n' % x for x in diffJSON(old, data)).encode('utf-8'), mode)
+    return hashlib.sha256(content).hexdigest()
+
+  def commit(self):
+    """Sync directories containing renamed files, and save the index"""
+    for directory in self._pending:
+      try:
+        fd = os.open(directory, os.O_RDONLY)
+      except OSError: # removed since
+        continue
+      try:
+        os.fsync(fd)
+      finally:
+        os.close(fd)
+    self._pending.clear()
+    if self._index_modified and self.index_path:
+      tmp = self.index_path + '.tmp'
+      try:
+        with open(tmp, 'w') as f:
+          json.dump(self.index, f)
+          f.flush()
+          os.fsync(f.fileno())
+      except IOError as e:
+        if e.errno != errno.ENOENT:
+          raise
+        # the directory was removed
+      else:
+        os.rename(tmp, self.index_path)
+      self._index_modified = False
+    if self.written_files or self.unchanged_files:
+      logger.info('%s', self.report())
+
+  def report(self):
+    return ('%s file(s) written (%s bytes), %s file(s) unchanged'
+      % (self.written_files, self.written_bytes, self.unchanged_files))
@@ -25,35 +25,118 @@
 #
 ##############################################################################
 import os
+import shutil
+import subprocess
+import sys
+from multiprocessing.pool import ThreadPool
 
 from slapos.recipe.librecipe import GenericBaseRecipe
+from zc.buildout import UserError
+
+# codec: (compress options, extension, default level)
+# %(threads)s is 0 to use all cores.
+CODEC_DICT = {
+  'gzip': ('-%(level)s', '.gz', 9),
+  'pigz': ('-%(level)s -p %(threads)s', '.gz', 9),
+  'zstd': ('-%(level)s -T%(threads)s', '.zst', 3),
+  'xz': ('-%(level)s -T%(threads)s', '.xz', 6),
+}
 
 class Recipe(GenericBaseRecipe):
+  """logrotate configuration and wrapper
+
+  'compress-codec' is one of gzip (the default, with 'gzip-binary' and
+  'gunzip-binary'), pigz, zstd or xz, with 'compress-binary' and
+  'uncompress-binary'. 'compress-level' defaults to the usual level of the
+  codec, and 'compress-threads' to all cores.
+
+  With 'parallel' greater than 1, the entries are rotated concurrently by as
+  many logrotate processes, each with its own state file.
+  """
 
   def install(self):
-    logrotate_d = self.options['logrotate-entries']
-    logrotate_conf_file = self.options['conf']
+    options = self.options
+    logrotate_d = options['logrotate-entries']
+    logrotate_conf_file = options['conf']
+
+    codec = options.get('compress-codec', 'gzip')
+    try:
+      compress_options, extension, level = CODEC_DICT[codec]
+    except KeyError:
+      raise UserError("Unknown compress-codec %r" % codec)
+    if codec == 'gzip':
+      compress_binary = options.get('compress-binary', options['gzip-binary'])
+      uncompress_binary = options.get('uncompress-binary',
+                                      options['gunzip-binary'])
+    else:
+      compress_binary = options['compress-binary']
+      uncompress_binary = options['uncompress-binary']
+    threads = int(options.get('compress-threads', 0))
+    if codec == 'pigz' and not threads:
+      compress_options = compress_options.split(' -p', 1)[0]
+    compress_options %= {
+      'level': options.get('compress-level', level),
+      'threads': threads,
+    }
 
     logrotate_conf = [
-      'compresscmd %s' % self.options['gzip-binary'],
-      'compressoptions -9',
-      'uncompresscmd %s' % self.options['gunzip-binary'],
-      'include %s' % logrotate_d,
+      'compresscmd %s' % compress_binary,
+      'compressoptions %s' % compress_options,
+      'compressext %s' % extension,
+      'uncompresscmd %s' % uncompress_binary,
     ]
+    parallel = int(options.get('parallel', 1))
+    if parallel <= 1:
+      logrotate_conf.append('include %s' % logrotate_d)
 
     logrotate_conf_file = self.createFile(logrotate_conf_file,
         '\n'.join(logrotate_conf))
 
-    state_file = self.options['state-file']
-
-    logrotate = self.createWrapper(
-      self.options['wrapper'],
-      (self.options['logrotate-binary'],
-        '-s', state_file, logrotate_conf_file),
-    )
+    state_file = options['state-file']
+
+    if parallel > 1:
+      logrotate = self.createPythonScript(
+        options['wrapper'],
+        __name__ + '.run',
+        (options['logrotate-binary'], logrotate_conf_file, logrotate_d,
+         state_file, parallel))
+    else:
+      logrotate = self.createWrapper(
+        options['wrapper'],
+        (options['logrotate-binary'],
+          '-s', state_file, logrotate_conf_file),
+      )
 
     return [logrotate, logrotate_conf_file]
 
+
+def run(logrotate_binary, conf, logrotate_d, state_file, parallel):
+  """Rotate the entries of logrotate_d with up to 'parallel' processes
+
+  Each entry has its own state file, initialized from the common one that is
+  used when entries are rotated by a single process.
+  """
+  args = sys.argv[1:]
+  state_d = state_file + '.d'
+  if not os.path.isdir(state_d):
+    os.mkdir(state_d)
+  cmd_list = []
+  for name in sorted(os.listdir(logrotate_d)):
+    if name.startswith('.') or name.endswith('~'):
+      continue
+    entry_state_file = os.path.join(state_d, name)
+    if not os.path.exists(entry_state_file) and os.path.exists(state_file):
+      shutil.copyfile(state_file, entry_state_file)
+    cmd_list.append([logrotate_binary] + args + [
+      '-s', entry_state_file, conf, os.path.join(logrotate_d, name)])
+  pool = ThreadPool(parallel)
+  try:
+    # Return codes are negative for processes killed by a signal.
+    sys.exit(max([abs(x) for x in pool.map(subprocess.call, cmd_list, 1)]
+                 or [0]))
+  finally:
+    pool.close()
+
 class Part(GenericBaseRecipe):
 
   def install(self):
@@ -63,7 +146,7 @@ class Part(GenericBaseRecipe):
     conf = [
       'daily',
       'dateext',
-      'rotate 3650',
+      'rotate %s' % self.options.get('rotate', 3650),
       'compress',
       'delaycompress',
       'notifempty',
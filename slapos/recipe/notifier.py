@@ -26,6 +26,7 @@
 ##############################################################################
 import os
 from hashlib import sha512
+from slapos.recipe import notifier_feed
 from slapos.recipe.librecipe import GenericBaseRecipe
 from slapos.util import str2bytes
 
@@ -69,7 +70,8 @@ class Notify(GenericBaseRecipe):
 
   def createNotifier(self, notifier_binary, wrapper, executable,
                      log, title, notification_url, feed_url, max_run='1', pidfile=None,
-                     instance_root_name=None, log_url=None, status_item_directory=None):
+                     instance_root_name=None, log_url=None, status_item_directory=None,
+                     feed_store_directory=None, feed_max_items=None):
 
     if not os.path.exists(log):
       # Just a touch
@@ -83,6 +85,19 @@ class Notify(GenericBaseRecipe):
             '--notification-url',
             ]
     cmd += notification_url.split(' ')
+    # Keep only the last items of the feed, in a bounded store
+    feed_store_directory = feed_store_directory or self.options.get('feed-store-directory')
+    if feed_store_directory:
+      feed_max_items = int(feed_max_items or self.options.get('feed-max-items', 100))
+      store = notifier_feed.FeedStore(
+        os.path.join(feed_store_directory, os.path.basename(log)),
+        feed_max_items)
+      notifier_feed.migrate(log, store)
+      # The log is bounded before running the executable, so the notifier
+      # stays the process that is checked against the pidfile.
+      executable = self.createPythonScript(wrapper + '-feed',
+        'slapos.recipe.notifier_feed.run',
+        (store.path, feed_max_items, log, executable))
     cmd += '--executable', executable
     # For a more verbose mode, writing feed items for any action
     instance_root_name = instance_root_name or self.options.get('instance-root-name', None)
@@ -118,4 +133,6 @@ class Notify(GenericBaseRecipe):
                                  notification_url=options['notify'],
                                  feed_url=feed_url,
                                  max_run=options.get('max-run', "1"))
+    if options.get('feed-store-directory'):
+      return [script, script + '-feed']
     return [script]
@@ -0,0 +1,251 @@
+##############################################################################
+#
+# Copyright (c) 2010 Vifib SARL and Contributors. All Rights Reserved.
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsibility of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# guarantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+##############################################################################
+"""Bounded store of the items of a notifier feed
+
+A store keeps the last 'capacity' items of a feed in 2 files:
+
+- an append-only segment file with the items,
+- a fixed-size index, whose header gives the capacity, the number of items
+  ever appended and the generation of the segment, followed by a ring of
+  'capacity' slots with the offset and length of each retained item.
+
+Reading the latest N items only reads their N slots and records. When the
+segment contains more dead items than retained ones, it is compacted into a
+new generation, and the index is switched atomically.
+
+The notifier of slapos.toolbox runs an executable, then appends an item to
+its log, as a CSV row, before notifying that the feed, which is served by
+reading the whole log, changed. So 'run' is used as a wrapper of the
+executable: rows appended to the log by previous runs are imported into the
+store, and the log is rewritten with the retained items only, so that its
+size, and the time to serve it, are bounded. The executable then runs as
+usual.
+"""
+import csv
+import errno
+import fcntl
+import io
+import os
+import struct
+import sys
+from contextlib import contextmanager
+
+import six
+
+MAGIC = b'SLAPFEED'
+HEADER = struct.Struct('>8sQQQ') # magic, capacity, count, generation
+SLOT = struct.Struct('>QI') # offset, length
+# Do not compact small segments.
+COMPACT_MIN_SIZE = 1 << 16
+
+
+class FeedStore(object):
+
+  def __init__(self, path, capacity=100):
+    self.path = path
+    self.capacity = capacity
+
+  def _segment(self, generation):
+    return '%s.%s.segment' % (self.path, generation)
+
+  @contextmanager
+  def _lock(self):
+    with open(self.path + '.lock', 'a') as f:
+      fcntl.flock(f, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+  def _readHeader(self, index):
+    header = index.read(HEADER.size)
+    if len(header) < HEADER.size:
+      return None
+    magic, capacity, count, generation = HEADER.unpack(header)
+    if magic != MAGIC:
+      raise ValueError('%s is not a feed index' % self.path)
+    return capacity, count, generation
+
+  def _writeIndex(self, capacity, count, generation, slot_list):
+    """Create a new index, slot_list being the slots of the retained items,
+    from the oldest"""
+    slots = bytearray(SLOT.size * capacity)
+    for i, slot in enumerate(slot_list, count - len(slot_list)):
+      SLOT.pack_into(slots, i % capacity * SLOT.size, *slot)
+    tmp = self.path + '.index.tmp'
+    with open(tmp, 'wb') as f:
+      f.write(HEADER.pack(MAGIC, capacity, count, generation))
+      f.write(slots)
+    os.rename(tmp, self.path + '.index')
+
+  def exists(self):
+    return os.path.exists(self.path + '.index')
+
+  def __len__(self):
+    try:
+      with open(self.path + '.index', 'rb') as index:
+        capacity, count, _ = self._readHeader(index)
+    except IOError as e:
+      if e.errno != errno.ENOENT:
+        raise
+      return 0
+    return min(capacity, count)
+
+  def _slots(self, index, capacity, count, n):
+    # slots of the latest n items, from the newest
+    for i in range(count - 1, count - 1 - min(n, capacity, count), -1):
+      index.seek(HEADER.size + i % capacity * SLOT.size)
+      yield SLOT.unpack(index.read(SLOT.size))
+
+  def latest(self, n=None):
+    """Return the latest n items (all retained items by default), from the
+    newest"""
+    with self._lock():
+      try:
+        index = open(self.path + '.index', 'rb')
+      except IOError as e:
+        if e.errno != errno.ENOENT:
+          raise
+        return []
+      with index:
+        capacity, count, generation = self._readHeader(index)
+        slot_list = list(self._slots(index, capacity, count,
+                                     capacity if n is None else n))
+      if not slot_list:
+        return []
+      result = []
+      with open(self._segment(generation), 'rb') as segment:
+        for offset, length in slot_list:
+          segment.seek(offset)
+          result.append(segment.read(length))
+      return result
+
+  def append(self, item):
+    """Append an item (bytes), dropping the oldest one if the store is full"""
+    with self._lock():
+      try:
+        index = open(self.path + '.index', 'r+b')
+      except IOError as e:
+        if e.errno != errno.ENOENT:
+          raise
+        self._writeIndex(self.capacity, 0, 0, ())
+        index = open(self.path + '.index', 'r+b')
+      with index:
+        capacity, count, generation = self._readHeader(index)
+        with open(self._segment(generation), 'ab') as segment:
+          offset = segment.tell()
+          segment.write(item)
+        index.seek(HEADER.size + count % capacity * SLOT.size)
+        index.write(SLOT.pack(offset, len(item)))
+        count += 1
+        index.seek(0)
+        index.write(HEADER.pack(MAGIC, capacity, count, generation))
+        slot_list = list(self._slots(index, capacity, count, capacity))
+      live = sum(length for _, length in slot_list)
+      size = offset + len(item)
+      if size > COMPACT_MIN_SIZE and size > 2 * live:
+        self._compact(capacity, count, generation, slot_list[::-1])
+
+  def _compact(self, capacity, count, generation, slot_list):
+    new_slot_list = []
+    with open(self._segment(generation), 'rb') as old, \
+         open(self._segment(generation + 1), 'wb') as new:
+      for offset, length in slot_list:
+        old.seek(offset)
+        new_slot_list.append((new.tell(), length))
+        new.write(old.read(length))
+    self._writeIndex(capacity, count, generation + 1, new_slot_list)
+    os.remove(self._segment(generation))
+
+
+# Items of the notifier can be big (they contain the output of commands).
+csv.field_size_limit(sys.maxsize)
+
+def splitLog(data):
+  """Split the content of a feed log into items, i.e. the CSV rows written
+  by the notifier, each one serialised again like the notifier does"""
+  if six.PY2:
+    return [dumpRow(row) for row in csv.reader(io.BytesIO(data))]
+  return [dumpRow(row) for row in csv.reader(io.StringIO(
+    data.decode('utf-8', 'surrogateescape'), newline=''))]
+
+
+def dumpRow(row):
+  if six.PY2:
+    f = io.BytesIO()
+    csv.writer(f).writerow(row)
+    return f.getvalue()
+  f = io.StringIO()
+  csv.writer(f).writerow(row)
+  return f.getvalue().encode('utf-8', 'surrogateescape')
+
+
+def migrate(log, store):
+  """Import into the store the items of the feed log that it does not
+  contain yet, i.e. all of them the first time, then those appended by the
+  notifier since the log was written from the store"""
+  try:
+    with open(log, 'rb') as f:
+      data = f.read()
+  except IOError as e:
+    if e.errno != errno.ENOENT:
+      raise
+    data = b''
+  item_list = splitLog(data)
+  # Items after the newest one of the store are new.
+  for last in store.latest(1):
+    if last in item_list:
+      del item_list[:len(item_list) - item_list[::-1].index(last)]
+  for item in item_list[-store.capacity:]:
+    store.append(item)
+  if not store.exists():
+    store._writeIndex(store.capacity, 0, 0, ())
+
+
+def writeLog(log, store, n=None):
+  """Rewrite the feed log with the latest n items of the store"""
+  tmp = log + '.tmp'
+  with open(tmp, 'wb') as f:
+    for item in reversed(store.latest(n)):
+      f.write(item)
+  os.rename(tmp, log)
+
+
+def run(store_path, capacity, log, executable, argv=None):
+  """Bound the feed log with the store, then run the executable wrapped by
+  the notifier
+
+  LOG is rewritten with the latest items, leaving room for the one the
+  notifier appends once the executable exits, and the executable replaces
+  the current process: the item is appended to the feed that is served,
+  before the notifier notifies that it changed.
+  """
+  argv = list(sys.argv[1:] if argv is None else argv)
+  store = FeedStore(store_path, capacity)
+  migrate(log, store)
+  writeLog(log, store, store.capacity - 1)
+  os.execv(executable, [executable] + argv)
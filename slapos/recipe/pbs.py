@@ -29,6 +29,7 @@ from __future__ import print_function
 
 import json
 import os
+import posixpath
 import subprocess
 import sys
 import textwrap
@@ -39,6 +40,8 @@ from slapos.recipe.dropbear import KnownHostsFile
 from slapos.recipe.notifier import Notify
 from slapos.recipe.notifier import Callback
 from slapos.recipe.librecipe import shlex
+from slapos.recipe import pbs_journal
+from slapos.recipe.pbs_scheduler import CronSpec
 
 
 def promise(ssh_client, user, host, port):
@@ -96,7 +99,7 @@ class Recipe(GenericSlapRecipe, Notify, Callback):
     )
 
 
-  def wrapper_pull(self, remote_schema, local_dir, remote_dir, rdiff_wrapper_path, remove_backup_older_than):
+  def wrapper_pull(self, remote_schema, local_dir, remote_dir, rdiff_wrapper_path, remove_backup_older_than, journal=''):
     # Wrap rdiff-backup call into a script that checks consistency of backup
     # We need to manually escape the remote schema
 
@@ -127,6 +130,14 @@ class Recipe(GenericSlapRecipe, Notify, Callback):
 
         SUCCEEDED=false
 
+        # Skip the backup if the journal of changes of the exporter tells that
+        # nothing changed since the last one.
+        JOURNAL=%(journal)s
+        if [ "$JOURNAL" -a "$1" != "--fix-corrupted" ]; then
+            $JOURNAL check
+            [ $? -eq %(journal_unchanged)s ] && exit 0
+        fi
+
         # not using --fix-corrupted can lead to an infinite loop
         # in case of manual changes to the backup repository.
 
@@ -151,7 +162,7 @@ class Recipe(GenericSlapRecipe, Notify, Callback):
         $RDIFF_BACKUP \\
                 $CORRUPTED_ARGS \\
                 --remote-schema %(remote_schema)s \\
-                %(remote_dir)s \\
+                %(journal_exclude)s%(remote_dir)s \\
                 $BACKUP_DIR
 
         RDIFF_BACKUP_STATUS=$?
@@ -178,6 +189,7 @@ class Recipe(GenericSlapRecipe, Notify, Callback):
             fi
         else
             # Everything's okay, cleaning up...
+            [ "$JOURNAL" ] && $JOURNAL commit
             $RDIFF_BACKUP --remove-older-than %(remove_backup_older_than)s --force $BACKUP_DIR
         fi
 
@@ -190,8 +202,17 @@ class Recipe(GenericSlapRecipe, Notify, Callback):
       'remote_dir': shlex.quote(remote_dir),
       'local_dir': shlex.quote(local_dir),
       'tmpdir': '/tmp',
-      'remove_backup_older_than': shlex.quote(remove_backup_older_than)
+      'remove_backup_older_than': shlex.quote(remove_backup_older_than),
+      'journal': shlex.quote(journal),
+      'journal_unchanged': pbs_journal.UNCHANGED,
+      'journal_exclude': '',
     }
+    if journal:
+      # The journal of changes of the exporter is not part of the data.
+      template_dict['journal_exclude'] = '--exclude %s \\\n%s' % (
+        shlex.quote(posixpath.join(remote_dir.split('::', 1)[-1],
+                                   pbs_journal.JOURNAL_DIRNAME)),
+        ' ' * 8)
 
     return self.createFile(
       name=rdiff_wrapper_path,
@@ -200,6 +221,35 @@ class Recipe(GenericSlapRecipe, Notify, Callback):
     )
 
 
+  _job_list = None
+
+  def createScheduler(self, job_list):
+    """Create the daemon starting the backups of all slaves
+
+    See slapos.recipe.pbs_scheduler for the meaning of options.
+    """
+    options = self.options
+    run_directory = options['run-directory']
+    config_path = options.get('scheduler-config',
+      os.path.join(run_directory, 'pbs-scheduler-config.json'))
+    config = {
+      'max-concurrency': int(options.get('scheduler-max-concurrency', 4)),
+      'max-per-destination': int(
+        options.get('scheduler-max-per-destination', 1)),
+      'bandwidth-limit': float(options.get('scheduler-bandwidth-limit', 0)),
+      'splay': int(options.get('scheduler-splay', 600)),
+      'state': options.get('scheduler-state',
+        os.path.join(run_directory, 'pbs-scheduler-state.json')),
+      'request-directory': run_directory,
+      'job-list': job_list,
+    }
+    return [
+      self.createFile(config_path, json.dumps(config, indent=2,
+                                              sort_keys=True)),
+      self.createPythonScript(options['scheduler-wrapper'],
+        'slapos.recipe.pbs_scheduler.main', (config_path,)),
+    ]
+
   def add_slave(self, entry, known_hosts_file):
     path_list = []
 
@@ -256,12 +306,23 @@ class Recipe(GenericSlapRecipe, Notify, Callback):
                                         remote_dir,
                                         rdiff_wrapper_path)
     elif slave_type == 'pull':
+      if self.optionIsTrue('journal', False):
+        journal = self.createPythonScript(
+          rdiff_wrapper_path + '_journal',
+          'slapos.recipe.pbs_journal.client',
+          (self.options['rdiffbackup-binary'], remote_schema, remote_dir,
+           local_dir + '.journal',
+           int(self.options.get('journal-max-age', 86400))))
+        path_list.append(journal)
+      else:
+        journal = ''
       # XXX: only 3 increments is not enough by default.
       rdiff_wrapper = self.wrapper_pull(remote_schema,
                                         local_dir,
                                         remote_dir,
                                         rdiff_wrapper_path,
-                                        entry.get('remove-backup-older-than', '3B'))
+                                        entry.get('remove-backup-older-than', '3B'),
+                                        journal)
 
     path_list.append(rdiff_wrapper)
 
@@ -285,6 +346,18 @@ class Recipe(GenericSlapRecipe, Notify, Callback):
     if 'on-notification' in entry:
       path_list.append(self.createCallback(str(entry['on-notification']),
                                            notifier_wrapper))
+    elif self._job_list is not None:
+      CronSpec(entry['frequency']) # check it early
+      self._job_list.append({
+        'id': slave_id,
+        'command': [notifier_wrapper],
+        'destination': '%s:%s' % (parsed_url.hostname, parsed_url.port),
+        'frequency': entry['frequency'],
+        'fix_corrupted_command': [rdiff_wrapper, '--fix-corrupted']
+          if slave_type == 'pull' else None,
+        'statistics_directory': os.path.join(local_dir, 'rdiff-backup-data')
+          if slave_type == 'pull' else None,
+      })
     else:
       cron_entry = os.path.join(self.options['cron-entries'], slave_id)
       with open(cron_entry, 'w') as cron_entry_file:
@@ -301,9 +374,13 @@ class Recipe(GenericSlapRecipe, Notify, Callback):
       self.logger.info("Client mode")
       slaves = self.options['slave-instance-list']
       known_hosts = KnownHostsFile(self.options['known-hosts'])
+      # With the scheduler, slaves are not backed up by cron.
+      self._job_list = [] if self.optionIsTrue('scheduler', False) else None
       with known_hosts:
         for slave in slaves:
           path_list.extend(self.add_slave(slave, known_hosts))
+      if self._job_list is not None:
+        path_list += self.createScheduler(self._job_list)
     else:
       self.logger.info("Server mode")
 
@@ -314,4 +391,10 @@ class Recipe(GenericSlapRecipe, Notify, Callback):
                                        ))
       path_list.append(wrapper)
 
+      # Journal of changes, so that PBS does not pull when nothing changed.
+      journal_wrapper = self.options.get('journal-wrapper')
+      if journal_wrapper:
+        path_list.append(self.createPythonScript(journal_wrapper,
+          'slapos.recipe.pbs_journal.watch', (self.options['path'],)))
+
     return path_list
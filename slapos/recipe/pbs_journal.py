@@ -0,0 +1,306 @@
+##############################################################################
+#
+# Copyright (c) 2010 Vifib SARL and Contributors. All Rights Reserved.
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsibility of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# guarantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+##############################################################################
+"""Journal of the paths changed in a directory backed up by a PBS
+
+On the exporter, a daemon watches the backed up directory with inotify and
+appends the paths that change to a journal, in a subdirectory that PBS can
+pull with rdiff-backup. The journal starts with a generation id, which
+changes whenever the daemon starts or when events may have been lost, and
+each batch of changes has a sequence number. The daemon removes the journal
+when it exits, and it regularly writes the time in a heartbeat file, so
+that a journal that is not maintained any more (e.g. the daemon was killed
+or not started yet after a reboot) is not trusted.
+
+Before pulling, PBS fetches the journal: if the generation and the sequence
+number are the same as when the previous backup succeeded, nothing changed
+and the backup is skipped. Otherwise, if the journal can not be fetched, or
+if the heartbeat is too old (or in the future, clocks being skewed),
+rdiff-backup scans the whole directory as usual: it would consider files
+that it does not scan as deleted, so the journal can not be used to limit
+the scan to changed paths.
+"""
+from __future__ import print_function
+
+import errno
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import uuid
+
+JOURNAL_DIRNAME = '.slapos-journal'
+JOURNAL_FILENAME = 'journal'
+HEARTBEAT_FILENAME = 'heartbeat'
+HEARTBEAT_INTERVAL = 60
+# Maximum age of the heartbeat for the journal to be trusted, which also
+# tolerates small differences between clocks of the exporter and PBS.
+HEARTBEAT_MAX_AGE = 5 * HEARTBEAT_INTERVAL
+# Exit status of 'check' when there is nothing to pull.
+UNCHANGED = 3
+
+
+class Journal(object):
+  """Writer of the journal"""
+
+  def __init__(self, path, max_size=100000):
+    self.path = path
+    self.max_size = max_size
+    self.reset()
+
+  def reset(self):
+    """Start a new generation, which makes PBS scan everything"""
+    self.generation = uuid.uuid4().hex
+    self.sequence = self.size = 0
+    tmp = self.path + '.tmp'
+    with open(tmp, 'w') as f:
+      f.write(self.generation + '\n')
+    os.rename(tmp, self.path)
+
+  def append(self, path_set):
+    if self.size + len(path_set) > self.max_size:
+      return self.reset()
+    self.sequence += 1
+    with open(self.path, 'a') as f:
+      f.write(''.join(json.dumps([self.sequence, path]) + '\n'
+                      for path in sorted(path_set)))
+    self.size += len(path_set)
+
+  def beat(self):
+    """Tell that the journal is maintained"""
+    path = os.path.join(os.path.dirname(self.path), HEARTBEAT_FILENAME)
+    with open(path + '.tmp', 'w') as f:
+      f.write('%s\n' % time.time())
+    os.rename(path + '.tmp', path)
+
+  def remove(self):
+    """Remove the journal, so that PBS scans everything"""
+    for path in self.path, os.path.join(os.path.dirname(self.path),
+                                        HEARTBEAT_FILENAME):
+      try:
+        os.remove(path)
+      except OSError as e:
+        if e.errno != errno.ENOENT:
+          raise
+
+
+def readHeartbeat(path):
+  """Return the time of the last heartbeat, or None"""
+  try:
+    with open(path) as f:
+      return float(f.read())
+  except IOError as e:
+    if e.errno != errno.ENOENT:
+      raise
+  except ValueError:
+    pass
+
+
+def read(path):
+  """Return the generation, the last sequence number and the changed paths by
+  sequence number of a journal, or None if it can not be read"""
+  try:
+    with open(path) as f:
+      generation = f.readline()
+      if not generation.endswith('\n'):
+        return
+      sequence = 0
+      path_dict = {}
+      for line in f:
+        try:
+          sequence, path = json.loads(line)
+        except ValueError: # being written
+          break
+        path_dict.setdefault(sequence, []).append(path)
+  except IOError as e:
+    if e.errno != errno.ENOENT:
+      raise
+    return
+  return generation.strip(), sequence, path_dict
+
+
+def watch(directory, interval=1):
+  """Write the journal of changes in directory"""
+  from inotify_simple import INotify, flags
+  journal_directory = os.path.join(directory, JOURNAL_DIRNAME)
+  try:
+    os.mkdir(journal_directory)
+  except OSError as e:
+    if e.errno != errno.EEXIST:
+      raise
+  mask = (flags.MODIFY | flags.ATTRIB | flags.CLOSE_WRITE | flags.MOVED_FROM
+          | flags.MOVED_TO | flags.CREATE | flags.DELETE | flags.DELETE_SELF)
+  journal_path = os.path.join(journal_directory, JOURNAL_FILENAME)
+  with INotify() as inotify:
+    watch_dict = {}
+    def add(path, path_set=None):
+      for dirpath, dirnames, filenames in os.walk(path):
+        if dirpath == journal_directory:
+          del dirnames[:]
+          continue
+        if path_set is not None:
+          # Created before it was watched.
+          path_set.update(os.path.relpath(os.path.join(dirpath, x), directory)
+                          for x in dirnames + filenames)
+        try:
+          watch_dict[inotify.add_watch(dirpath, mask)] = dirpath
+        except OSError as e:
+          if e.errno == errno.ENOSPC:
+            # Not reliable: PBS will always scan everything.
+            try:
+              os.remove(journal_path)
+            except OSError as e:
+              if e.errno != errno.ENOENT:
+                raise
+            sys.exit("Too many directories to watch, journal disabled")
+          if e.errno != errno.ENOENT:
+            raise
+    # Watch before starting the journal, so that no change is missed.
+    add(directory)
+    journal = Journal(journal_path)
+    # The journal must not be trusted once changes are not recorded.
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit())
+    try:
+      journal.beat()
+      last_beat = time.time()
+      while True:
+        path_set = set()
+        for event in inotify.read(timeout=HEARTBEAT_INTERVAL * 1000,
+                                  read_delay=interval * 1000):
+          if event.mask & flags.Q_OVERFLOW:
+            # Events were lost, including creation of directories to watch.
+            add(directory)
+            journal.reset()
+            path_set = None
+            break
+          dirpath = watch_dict.get(event.wd)
+          if dirpath is None:
+            continue
+          if event.mask & flags.IGNORED:
+            del watch_dict[event.wd]
+            continue
+          path = os.path.join(dirpath, event.name) if event.name else dirpath
+          if event.mask & flags.ISDIR and event.mask & (
+              flags.CREATE | flags.MOVED_TO):
+            add(path, path_set)
+          path_set.add(os.path.relpath(path, directory))
+        if path_set:
+          journal.append(path_set)
+        if time.time() - last_beat >= HEARTBEAT_INTERVAL:
+          journal.beat()
+          last_beat = time.time()
+    finally:
+      journal.remove()
+
+
+def check(rdiff_backup, remote_schema, remote_dir, journal_directory,
+          max_age=86400):
+  """Fetch the journal and tell whether there is anything to pull
+
+  The state of the fetched journal is saved, so that 'commit' records it
+  once the backup succeeds. Exit with UNCHANGED if nothing changed since
+  the last successful backup, unless it is older than max_age seconds.
+  """
+  mirror = os.path.join(journal_directory, 'mirror')
+  try:
+    os.mkdir(journal_directory)
+  except OSError as e:
+    if e.errno != errno.EEXIST:
+      raise
+  pending_path = os.path.join(journal_directory, 'pending.json')
+  try:
+    os.remove(pending_path)
+  except OSError as e:
+    if e.errno != errno.ENOENT:
+      raise
+  if subprocess.call((rdiff_backup, '--remote-schema', remote_schema,
+                      '--force',
+                      '%s/%s' % (remote_dir, JOURNAL_DIRNAME), mirror)):
+    print("Could not fetch the journal of changes, scanning everything")
+    return
+  # The heartbeat changes every minute: do not accumulate increments.
+  subprocess.call((rdiff_backup, '--remove-older-than', '1B', '--force',
+                   mirror))
+  journal = read(os.path.join(mirror, JOURNAL_FILENAME))
+  if journal is None:
+    print("No journal of changes, scanning everything")
+    return
+  generation, sequence, path_dict = journal
+  heartbeat = readHeartbeat(os.path.join(mirror, HEARTBEAT_FILENAME))
+  if heartbeat is None or abs(time.time() - heartbeat) > HEARTBEAT_MAX_AGE:
+    print("Journal of changes not maintained, scanning everything")
+    return
+  try:
+    with open(os.path.join(journal_directory, 'state.json')) as f:
+      state = json.load(f)
+  except (IOError, ValueError):
+    state = {}
+  with open(pending_path, 'w') as f:
+    json.dump({'generation': generation, 'sequence': sequence}, f)
+  if state.get('generation') != generation:
+    print("Journal of changes restarted, scanning everything")
+    return
+  changed = set(path
+                for x, path_list in path_dict.items() if x > state['sequence']
+                for path in path_list)
+  if changed:
+    print("%s path(s) changed since the last backup" % len(changed))
+  elif time.time() < state['time'] + max_age:
+    print("No change since the last backup")
+    sys.exit(UNCHANGED)
+  else:
+    print("No change since the last backup, but it is too old")
+
+
+def commit(journal_directory):
+  """Record that the backup succeeded with the journal fetched by 'check'"""
+  pending_path = os.path.join(journal_directory, 'pending.json')
+  try:
+    with open(pending_path) as f:
+      state = json.load(f)
+  except (IOError, ValueError):
+    return
+  state['time'] = time.time()
+  path = os.path.join(journal_directory, 'state.json')
+  with open(path + '.tmp', 'w') as f:
+    json.dump(state, f)
+  os.rename(path + '.tmp', path)
+  os.remove(pending_path)
+
+
+def client(rdiff_backup, remote_schema, remote_dir, journal_directory,
+           max_age=86400):
+  """Entry point of the script used by the pull wrapper"""
+  command = sys.argv[1:2]
+  if command == ['check']:
+    check(rdiff_backup, remote_schema, remote_dir, journal_directory,
+          max_age)
+  elif command == ['commit']:
+    commit(journal_directory)
+  else:
+    sys.exit("Usage: %s check|commit" % sys.argv[0])
@@ -0,0 +1,342 @@
+##############################################################################
+#
+# Copyright (c) 2010 Vifib SARL and Contributors. All Rights Reserved.
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsibility of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# guarantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+##############################################################################
+"""Scheduler of the backups of a PBS partition
+
+Instead of one cron entry per slave, which makes all backups of the same
+frequency start together, the daemon starts them itself:
+
+- each job is due when its cron spec matches, plus a fixed offset of at most
+  'splay' seconds that depends on the job id, so that start times are spread;
+- at most 'max-concurrency' jobs run at the same time, and at most
+  'max-per-destination' for each remote host;
+- a job is not started while the estimated throughput of running jobs, based
+  on their previous runs, would exceed 'bandwidth-limit' (bytes/s, 0 for no
+  limit), unless nothing is running. The budget is only checked when a job
+  is admitted: running transfers are not throttled, so the actual bandwidth
+  may exceed it when a job transfers more than during its previous run;
+- a job that is due again while it is queued or running is not queued twice.
+
+The duration, the number of bytes transferred (read from the session
+statistics of rdiff-backup when the backup is local) and the lag (delay
+between the time a job is due and the time it starts) of the last run of
+each job are saved to the state file.
+
+Running the daemon script with '--fix-corrupted JOB_ID...' asks the daemon
+to run the rdiff-backup wrapper of these jobs with --fix-corrupted, with the
+same limits as scheduled backups.
+
+Each job runs in its own process group, which is terminated with the daemon,
+so that no rdiff-backup keeps running after it.
+"""
+from __future__ import print_function
+
+import errno
+import glob
+import hashlib
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from slapos.recipe.dcron import symbolic_dict
+
+logger = logging.getLogger(__name__)
+
+FIX_CORRUPTED_SUFFIX = '.fix-corrupted'
+
+
+class CronSpec(object):
+  """Minimal parser of crontab time specs, with a resolution of 1 minute"""
+
+  RANGE_LIST = (0, 59), (0, 23), (1, 31), (1, 12), (0, 7)
+
+  def __init__(self, spec):
+    spec = symbolic_dict.get(spec.lstrip('@'), spec).split()
+    if len(spec) != 5:
+      raise ValueError("Invalid cron spec %r" % ' '.join(spec))
+    self.restricted = [not x.startswith('*') for x in spec]
+    self.field_list = [self._parse(x, a, b)
+                       for x, (a, b) in zip(spec, self.RANGE_LIST)]
+    if 7 in self.field_list[4]: # Sunday
+      self.field_list[4].add(0)
+
+  @staticmethod
+  def _parse(field, first, last):
+    result = set()
+    for x in field.split(','):
+      x, _, step = x.partition('/')
+      if x == '*':
+        a, b = first, last
+      else:
+        a, _, b = x.partition('-')
+        a = int(a)
+        b = int(b) if b else (last if step else a)
+      step = int(step) if step else 1
+      if not (first <= a <= b <= last and step > 0):
+        raise ValueError("Invalid cron field %r" % field)
+      result.update(range(a, b + 1, step))
+    return result
+
+  def match(self, t):
+    t = time.localtime(t)
+    minute, hour, day, month, dow = self.field_list
+    if not (t.tm_min in minute and t.tm_hour in hour and t.tm_mon in month):
+      return False
+    # Like cron, if both day of month and day of week are restricted,
+    # either of them must match.
+    day_match = t.tm_mday in day
+    dow_match = (t.tm_wday + 1) % 7 in dow
+    if self.restricted[2] and self.restricted[4]:
+      return day_match or dow_match
+    return day_match and dow_match
+
+
+class Job(object):
+
+  process = None
+  due = None
+  fix_corrupted = False
+
+  def __init__(self, id, command, destination, frequency,
+               fix_corrupted_command=None, statistics_directory=None,
+               splay=0):
+    self.id = id
+    self.command = command
+    self.destination = destination
+    self.cron = CronSpec(frequency)
+    self.fix_corrupted_command = fix_corrupted_command
+    self.statistics_directory = statistics_directory
+    # Stable offset, so that the period between 2 runs is preserved.
+    self.offset = int(hashlib.md5(id.encode('utf-8')).hexdigest(), 16) % (
+      int(splay) + 1)
+
+
+class Scheduler(object):
+
+  def __init__(self, config):
+    self.max_concurrency = int(config.get('max-concurrency', 1))
+    self.max_per_destination = int(config.get('max-per-destination', 1))
+    self.bandwidth_limit = float(config.get('bandwidth-limit', 0))
+    self.state_path = config['state']
+    self.request_directory = config.get('request-directory')
+    self.job_dict = dict((job['id'], Job(splay=config.get('splay', 0), **job))
+                         for job in config['job-list'])
+    try:
+      with open(self.state_path) as f:
+        self.state_dict = json.load(f)
+    except (IOError, ValueError):
+      self.state_dict = {}
+    self.queue = []
+    # (due, job) of jobs whose offset is not elapsed yet
+    self.pending = []
+    self.running = []
+    self.last_minute = None
+
+  def _getRate(self, job):
+    state = self.state_dict.get(job.id, {})
+    if state.get('bytes') and state.get('duration'):
+      return state['bytes'] / state['duration']
+    return 0
+
+  def _enqueue(self, job, due, fix_corrupted=False):
+    if job.process is None and job.due is None:
+      job.due = due
+      job.fix_corrupted = fix_corrupted
+      self.queue.append(job)
+
+  def schedule(self, now):
+    """Queue the jobs that are due at the given time"""
+    minute = int(now // 60 * 60)
+    if self.last_minute is None:
+      self.last_minute = minute - 60
+    t = self.last_minute
+    # Do not replay more than 1 day if the clock jumped forward.
+    t = max(t, minute - 86400)
+    pending = self.pending
+    while t < minute:
+      t += 60
+      for job in self.job_dict.values():
+        if job.cron.match(t):
+          pending.append((t + job.offset, job))
+    self.last_minute = minute
+    self.pending = []
+    for due, job in sorted(pending, key=lambda x: x[0]):
+      if due <= now:
+        self._enqueue(job, due)
+      else:
+        self.pending.append((due, job))
+    if self.request_directory:
+      for path in glob.glob(os.path.join(self.request_directory,
+                                         '*' + FIX_CORRUPTED_SUFFIX)):
+        job_id = os.path.basename(path)[:-len(FIX_CORRUPTED_SUFFIX)]
+        job = self.job_dict.get(job_id)
+        if job is None or job.fix_corrupted_command is None:
+          logger.warning("Can not fix corrupted backup of %r", job_id)
+          os.remove(path)
+        elif job.process is None and job.due is None:
+          os.remove(path)
+          self._enqueue(job, now, True)
+
+  def start(self, now):
+    """Start queued jobs, in order, as long as limits allow it"""
+    self.queue.sort(key=lambda job: job.due)
+    for job in list(self.queue):
+      if len(self.running) >= self.max_concurrency:
+        break
+      if sum(1 for x in self.running
+             if x.destination == job.destination) >= self.max_per_destination:
+        continue
+      if self.bandwidth_limit and self.running and (
+          sum(map(self._getRate, self.running)) + self._getRate(job)
+          > self.bandwidth_limit):
+        continue
+      self.queue.remove(job)
+      command = job.fix_corrupted_command if job.fix_corrupted else job.command
+      logger.info("Starting %s (%s)", job.id, ' '.join(command))
+      job.start = now
+      try:
+        job.process = subprocess.Popen(command, close_fds=True,
+                                       preexec_fn=os.setsid)
+      except OSError as e:
+        logger.error("Could not start %s: %s", job.id, e)
+        self._record(job, now, None)
+      else:
+        self.running.append(job)
+
+  def reap(self, now):
+    """Record the jobs that finished"""
+    for job in list(self.running):
+      returncode = job.process.poll()
+      if returncode is not None:
+        self.running.remove(job)
+        logger.info("%s exited with status %s after %.0fs",
+                    job.id, returncode, now - job.start)
+        self._record(job, now, returncode)
+
+  def _getTransferredBytes(self, job):
+    # rdiff-backup writes statistics of each session to the destination.
+    if job.statistics_directory:
+      path_list = glob.glob(os.path.join(job.statistics_directory,
+                                         'session_statistics.*.data'))
+      if path_list:
+        path = max(path_list, key=os.path.getmtime)
+        if os.path.getmtime(path) >= int(job.start):
+          stat_dict = {}
+          with open(path) as f:
+            for line in f:
+              line = line.split()
+              if len(line) >= 2:
+                stat_dict[line[0]] = line[1]
+          try:
+            return int(stat_dict['NewFileSize']) + \
+                   int(stat_dict['ChangedSourceSize'])
+          except (KeyError, ValueError):
+            pass
+
+  def _record(self, job, now, returncode):
+    state = self.state_dict.setdefault(job.id, {})
+    state.update({
+      'start': job.start,
+      'duration': now - job.start,
+      'lag': job.start - job.due,
+      'returncode': returncode,
+      'fix-corrupted': job.fix_corrupted,
+    })
+    transferred = self._getTransferredBytes(job)
+    if transferred is not None:
+      state['bytes'] = transferred
+    else:
+      state.pop('bytes', None)
+    if returncode == 0:
+      state['success'] = now
+    job.process = job.due = None
+    self._saveState()
+
+  def _saveState(self):
+    tmp = self.state_path + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump(self.state_dict, f, indent=2, sort_keys=True)
+    os.rename(tmp, self.state_path)
+
+  def step(self, now):
+    self.reap(now)
+    self.schedule(now)
+    self.start(now)
+
+  def _killJobs(self, sig):
+    for job in self.running:
+      try:
+        os.killpg(job.process.pid, sig)
+      except OSError as e:
+        if e.errno != errno.ESRCH:
+          raise
+
+  def stop(self, timeout=10):
+    """Terminate running jobs with all their children, killing them
+    if they are still running after timeout seconds"""
+    self._killJobs(signal.SIGTERM)
+    deadline = time.time() + timeout
+    while any(job.process.poll() is None for job in self.running):
+      if time.time() > deadline:
+        break
+      time.sleep(.1)
+    # Also kill children that outlived their job.
+    self._killJobs(signal.SIGKILL)
+    for job in self.running:
+      job.process.wait()
+
+  def run(self, interval=1):
+    try:
+      while True:
+        self.step(time.time())
+        time.sleep(interval)
+    finally:
+      self.stop()
+
+
+def _sigterm(signum, frame):
+  sys.exit()
+
+def main(config_path, argv=None):
+  """Run the scheduler, or ask it to fix corrupted backups"""
+  with open(config_path) as f:
+    config = json.load(f)
+  argv = sys.argv[1:] if argv is None else argv
+  if argv:
+    if argv[0] != '--fix-corrupted' or len(argv) == 1:
+      sys.exit("Usage: %s [--fix-corrupted JOB_ID...]" % sys.argv[0])
+    for job_id in argv[1:]:
+      open(os.path.join(config['request-directory'],
+                        job_id + FIX_CORRUPTED_SUFFIX), 'w').close()
+    return
+  logging.basicConfig(level=logging.INFO,
+                      format='%(asctime)s %(levelname)s %(message)s')
+  signal.signal(signal.SIGTERM, _sigterm)
+  Scheduler(config).run()
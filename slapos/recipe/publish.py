@@ -25,14 +25,47 @@
 #
 ##############################################################################
 from __future__ import print_function
+import hashlib
+import json
+import logging
+import os
+import time
 import zc.buildout
 from slapos.recipe.librecipe import wrap
-from slapos.recipe.librecipe import GenericSlapRecipe
+from slapos.recipe.librecipe import GenericSlapRecipe, getFileWriter
+from slapos.recipe.librecipe.writer import dumpsCanonicalJSON
 import six
 
 CONNECTION_PARAMETER_STRING = 'connection-'
+STATE_FILENAME = '.slapos-publish.json'
+DEFAULT_REFRESH_INTERVAL = 86400
+
+# Process-wide counters of publications, logged with each decision.
+stats = {'sent': 0, 'skipped': 0}
 
 class Recipe(GenericSlapRecipe):
+  """
+  Publish options of the section, and of the sections it extends, as
+  connection parameters.
+
+  Publishing is skipped if the parameters are unchanged since the last
+  successful publication of the section, which is remembered in the
+  buildout directory, and if nothing else (e.g. publish-early) published
+  other parameters for the same partition or slave during the run.
+
+  Input:
+    -extends (optional)
+      Sections whose options are published too.
+    -publish (optional)
+      Options of the section to publish. Default: all options, except those
+      starting with '-'.
+    -slave-reference (optional)
+      Publish for this slave instead of the partition.
+    -refresh-interval (optional)
+      Seconds after which unchanged parameters are published again, in case
+      the master lost them. 0 to always publish. Default: 1 day.
+  """
+
   def __init__(self, buildout, name, options):
     super(Recipe, self).__init__(buildout, name, options)
     # Tell buildout about the sections we will access during install.
@@ -58,7 +91,41 @@ class Recipe(GenericSlapRecipe):
     return []
 
   def _setConnectionDict(self, publish_dict, slave_reference=None):
-    return self.setConnectionDict(publish_dict, slave_reference)
+    refresh_interval = float(self.options.get('-refresh-interval',
+                                              DEFAULT_REFRESH_INTERVAL))
+    path = os.path.join(self.buildout['buildout']['directory'],
+                        STATE_FILENAME)
+    try:
+      with open(path) as f:
+        state_dict = json.load(f)
+    except (IOError, ValueError):
+      state_dict = {}
+    # Several sections of a partition may publish, for the partition or
+    # for slaves.
+    state = state_dict.setdefault(self.name, {}).setdefault(
+      slave_reference or '', {})
+    digest = hashlib.sha256(dumpsCanonicalJSON([self.server_url,
+      self.computer_id, self.computer_partition_id, publish_dict])
+    ).hexdigest()
+    now = time.time()
+    logger = logging.getLogger(self.name)
+    # What the master has is not known anymore if something else replaced
+    # the parameters during this run.
+    published = self.computer_partition.published_dict.get(
+      slave_reference or None, publish_dict)
+    if (published == publish_dict and state.get('digest') == digest and
+        now < state['time'] + refresh_interval):
+      stats['skipped'] += 1
+      logger.info("Connection parameters unchanged, not published"
+                  " (%(sent)s sent, %(skipped)s skipped)", stats)
+    else:
+      self.setConnectionDict(publish_dict, slave_reference)
+      stats['sent'] += 1
+      state.update(digest=digest, time=now)
+      getFileWriter(self.buildout['buildout']['directory']).writeJSON(
+        path, state_dict)
+      logger.info("Connection parameters published"
+                  " (%(sent)s sent, %(skipped)s skipped)", stats)
 
 class Serialised(Recipe):
   def _setConnectionDict(self, publish_dict, slave_reference=None):
@@ -91,10 +91,9 @@ class Recipe(GenericSlapRecipe):
           except KeyError:
             init[section] = {k: v}
     if init:
-      self.slap.initializeConnection(self.server_url, self.key_file,
-        self.cert_file)
-      computer_partition = self.slap.registerComputerPartition(
-        self.computer_id, self.computer_partition_id)
+      computer_partition = self.slap_client.getComputerPartition(
+        self.server_url, self.computer_id, self.computer_partition_id,
+        self.key_file, self.cert_file)
       published_dict = unwrap(computer_partition.getConnectionParameterDict())
 
       Options = buildout.Options
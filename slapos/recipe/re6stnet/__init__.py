@@ -33,14 +33,11 @@ import os, stat
 import string, random
 import json
 import traceback
-from slapos import slap
 
 class Recipe(GenericBaseRecipe):
   
   def __init__(self, buildout, name, options):
     """Default initialisation"""
-    self.slap = slap.slap()
-
     # SLAP related information
     slap_connection = buildout['slap-connection']
     self.computer_id = slap_connection['computer-id']
@@ -4,7 +4,7 @@ import logging
 import json
 import os
 import time
-import slapos
+from slapos.recipe.librecipe.slapclient import getSlapClient
 import traceback
 import logging
 from re6st import  registry
@@ -39,10 +39,9 @@ def updateFile(file_path, value):
 
 def getComputerPartition(master_url, key_file, cert_file,
                          computer_guid, partition_id):
-  slap = slapos.slap.slap()
   # Redeploy instance to update published information
-  slap.initializeConnection(master_url, key_file, cert_file)
-  return slap.registerComputerPartition(computer_guid, partition_id)
+  return getSlapClient().getComputerPartition(master_url, computer_guid,
+    partition_id, key_file, cert_file)
 
 def requestAddToken(client, token_base_path):
   time.sleep(3)
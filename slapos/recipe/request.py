@@ -27,11 +27,16 @@
 import logging
 from zc.buildout import UserError
 from slapos.recipe.librecipe import wrap, JSON_SERIALISED_MAGIC_KEY
+from slapos.recipe.librecipe.slapclient import getSlapClient
 import json
 from slapos import slap as slapmodule
 from slapos.slap import SoftwareProductCollection
 import slapos.recipe.librecipe.generic as librecipe
+import threading
+import time
 import traceback
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 import six
 
@@ -124,16 +129,22 @@ class Recipe(object):
     requested_state = options.get('state', buildout['slap-connection'].get('requested','started'))
     options['requested-state'] = requested_state
 
-    slap = slapmodule.slap()
-    slap.initializeConnection(
+    slap_client = getSlapClient(buildout)
+    slap = slap_client.getSlap(
       options['server-url'],
       options.get('key-file'),
       options.get('cert-file'),
     )
-    request = slap.registerComputerPartition(
+    request = slap_client.getComputerPartition(
+      options['server-url'],
       options['computer-id'],
       options['partition-id'],
+      options.get('key-file'),
+      options.get('cert-file'),
     ).request
+    self._connection_parameter_key = (options['server-url'],
+      options['computer-id'], options['partition-id'], name, slave)
+    self._connection_parameter_cache = slap_client.connection_parameter_dict
 
     if software_url is not None and \
       software_url.startswith(SOFTWARE_PRODUCT_NAMESPACE):
@@ -205,14 +216,28 @@ class Recipe(object):
   def _filterForStorage(self, partition_parameter_kw):
     return partition_parameter_kw
 
+  def _getConnectionParameterDict(self, instance):
+    # Fetch all connection parameters at once rather than one call per
+    # returned parameter: if the requested instance is not ready, each call
+    # would be a round-trip to the master. The result is cached for the run,
+    # for all sections requesting the same instance.
+    key = self._connection_parameter_key
+    try:
+      return self._connection_parameter_cache[key]
+    except KeyError:
+      pass
+    try:
+      connection_dict = instance.getConnectionParameterDict()
+    except slapmodule.NotFoundError:
+      connection_dict = {}
+    self._connection_parameter_cache[key] = connection_dict
+    return connection_dict
+
   def _getReturnParameterDict(self, instance, return_parameter_list):
-    result = {}
-    for param in return_parameter_list:
-      try:
-        result[param] = str(instance.getConnectionParameter(param))
-      except slapmodule.NotFoundError:
-        pass
-    return result
+    connection_dict = self._getConnectionParameterDict(instance)
+    return {param: str(connection_dict[param])
+      for param in return_parameter_list
+      if param in connection_dict}
 
   def install(self):
     if self._raise_request_exception:
@@ -275,8 +300,9 @@ class JSONCodec(object):
 
   def _getReturnParameterDict(self, instance, return_parameter_list):
     try:
-      return json.loads(instance.getConnectionParameter(JSON_SERIALISED_MAGIC_KEY))
-    except slapmodule.NotFoundError:
+      return json.loads(self._getConnectionParameterDict(instance)
+                        [JSON_SERIALISED_MAGIC_KEY])
+    except KeyError:
       return {}
 
 class RequestJSONEncoded(JSONCodec, Recipe):
@@ -297,26 +323,123 @@ CONNECTION_PARAMETER_STRING = 'connection-'
 class RequestEdge(Recipe):
   """
   For each country in country-list, do a request.
+
+  Input:
+    country-list
+      Comma-separated list of countries (sla-region).
+
+    concurrency (optional, defaults to 1)
+      Maximum number of requests done at the same time.
+
+    timeout (optional)
+      Maximum time to wait for each request, in seconds, counted from the
+      moment it starts, so that time spent queued behind other requests
+      (see concurrency) is not included. A request that times out makes the
+      installation fail. It is not interrupted: its thread keeps running
+      in the background until it returns, and its result is ignored.
+
+  Other options are the same as for slapos.cookbook:request. Connection
+  parameters are output as "connection-<name>-<country>".
   """
   def __init__(self, buildout, name, options):
     self.logger = logging.getLogger(name)
     self.options = options
-    self.request_dict = {}
+    self.request_dict = OrderedDict()
+    self.timeout_list = []
+    country_list = options['country-list'].split(',')
+    concurrency = int(options.get('concurrency') or 1)
+    timeout = float(options.get('timeout') or 0) or None
     # Keep a copy of original options dict
     original_options = options.copy()
-    for country in options['country-list'].split(','):
+
+    def request(country):
       # Request will have its own copy of options dict
       local_options = original_options.copy()
       local_options['name'] = '%s-%s' % (country, name)
       local_options['sla-region'] = country
-
-      self.request_dict[country] = Recipe(buildout, name, local_options)
+      start = time.time()
+      recipe = Recipe(buildout, name, local_options)
+      self.logger.info('Request for %s done in %.3fs',
+                       country, time.time() - start)
+      return recipe, local_options
+
+    if concurrency > 1 or timeout:
+      # Initialise what requests share before starting threads. Requests
+      # that time out may still use them after the pool is terminated.
+      buildout['slap-connection']
+      getSlapClient(buildout)
+      size = min(concurrency, len(country_list))
+      condition = threading.Condition()
+      start_dict = {}
+      blocked_dict = {}
+      finished_set = set()
+
+      def run(country):
+        with condition:
+          start_dict[country] = time.time()
+          condition.notify_all()
+        try:
+          return request(country)
+        finally:
+          with condition:
+            finished_set.add(country)
+            condition.notify_all()
+
+      def getDeadline(country):
+        start = start_dict.get(country)
+        if start is None and size <= sum(
+            x not in finished_set for x in self.timeout_list):
+          # All threads are taken by requests that timed out, and they
+          # may never return: count the time spent waiting for them.
+          start = blocked_dict.setdefault(country, time.time())
+        return start and start + timeout
+
+      pool = ThreadPool(size)
+      try:
+        async_list = [pool.apply_async(run, (country,))
+                      for country in country_list]
+        pool.close()
+        # Results are merged in the order of country-list, whatever the
+        # order requests complete.
+        result_list = []
+        for country, result in zip(country_list, async_list):
+          with condition:
+            while country not in finished_set:
+              deadline = timeout and getDeadline(country)
+              if deadline is None:
+                condition.wait()
+              else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                  break
+                condition.wait(remaining)
+          if country in finished_set:
+            result_list.append(result.get())
+          else:
+            self.logger.warning('Request for %s timed out after %ss',
+                                country, timeout)
+            self.timeout_list.append(country)
+            result_list.append((None, {
+              CONNECTION_PARAMETER_STRING + param: ''
+              for param in options.get('return', '').split()}))
+      finally:
+        # Do not wait for requests that timed out.
+        pool.terminate()
+    else:
+      result_list = map(request, country_list)
+
+    for country, (recipe, local_options) in zip(country_list, result_list):
+      if recipe is not None:
+        self.request_dict[country] = recipe
       # "Bubble" all connection parameters
-      for option, value in six.iteritems(local_options):
+      for option, value in sorted(six.iteritems(local_options)):
         if option.startswith(CONNECTION_PARAMETER_STRING):
           self.options['%s-%s' % (option, country)] = value
 
   def install(self):
+    if self.timeout_list:
+      raise UserError('Request timed out for %s'
+                      % ', '.join(self.timeout_list))
     for country, request in six.iteritems(self.request_dict):
       request.install()
     return []
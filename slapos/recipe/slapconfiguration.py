@@ -29,8 +29,8 @@ import json
 import logging
 import os
 
-import slapos.slap
-from slapos.recipe.librecipe import unwrap
+from slapos.recipe.librecipe import unwrap, getFileWriter
+from slapos.recipe.librecipe.slapclient import getSlapClient
 import six
 from six.moves.configparser import RawConfigParser
 from netaddr import valid_ipv4, valid_ipv6
@@ -105,15 +105,33 @@ class Recipe(object):
       The instance state.
 
     Also note that all information from resource file will be appended
+
+  Snapshot (optional):
+    snapshot
+      Path of a JSON file where output keys are saved. They are reused as
+      long as the master timestamp of the partition, the partition resource
+      file and the input keys are unchanged. The file is also useful to see
+      what the recipe outputs.
+    snapshot-timestamp
+      Expected master timestamp, e.g. ${slap-parameter:timestamp} in a
+      buildout run by slapos.cookbook:softwaretype. If it matches the
+      snapshot, the master is not contacted at all. Else, the timestamp
+      returned by the master is compared: the SLAP protocol has no
+      conditional request, so without snapshot-timestamp the partition is
+      still fetched from the master on every run, and the snapshot only
+      saves the processing of what it returned.
   """
 
   # XXX: used to detect if a configuration key is a valid section key. This
   # assumes buildout uses ConfigParser - which is currently the case.
   OPTCRE_match = RawConfigParser.OPTCRE.match
 
+  SNAPSHOT_INPUT_LIST = ('url', 'key', 'cert', 'computer', 'partition',
+                         'storage-home')
+
   def __init__(self, buildout, name, options):
-      parameter_dict = self.fetch_parameter_dict(options,
-                                      buildout['buildout']['directory'])
+      parameter_dict = self._fetch(buildout, options,
+                                   buildout['buildout']['directory'])
 
       match = self.OPTCRE_match
       for key, value in six.iteritems(parameter_dict):
@@ -121,6 +139,71 @@ class Recipe(object):
               continue
           options['configuration.' + key] = value
 
+  def _fetch(self, buildout, options, instance_root):
+      self.slap_client = getSlapClient(buildout)
+      if options.get('snapshot'):
+          return self._fetchSnapshot(options, instance_root)
+      return self.fetch_parameter_dict(options, instance_root)
+
+  def _fetchSnapshot(self, options, instance_root):
+      snapshot = options['snapshot']
+      resource_file = findResourceFile(instance_root)
+      key = [options.get(k) for k in self.SNAPSHOT_INPUT_LIST]
+      key += resource_file, resource_file and os.stat(resource_file).st_mtime
+      try:
+          with open(snapshot) as f:
+              snapshot_dict = json.load(f)
+      except (IOError, ValueError):
+          snapshot_dict = {}
+      if snapshot_dict.get('key') == key and all(map(os.path.lexists,
+              snapshot_dict['options'].get('storage-dict', {}).values())):
+          timestamp = options.get('snapshot-timestamp')
+          if timestamp != snapshot_dict['timestamp']:
+              # Memoized by the SLAP client for fetch_parameter_dict.
+              timestamp = self.slap_client.getComputerPartition(
+                  options['url'],
+                  options['computer'],
+                  options['partition'],
+                  options.get('key'),
+                  options.get('cert'),
+              ).getInstanceParameterDict().get('timestamp')
+              if timestamp is not None:
+                  timestamp = str(timestamp)
+          # Without timestamp, there is no way to know whether parameters
+          # changed: never use the snapshot ('None' was stored by mistake
+          # in snapshots of such partitions).
+          if (timestamp == snapshot_dict['timestamp'] and
+              timestamp not in (None, 'None')):
+              logger.debug("Using snapshot %s", snapshot)
+              for k, v in six.iteritems(snapshot_dict['options']):
+                  if k in snapshot_dict['set-keys']:
+                      v = set(v)
+                  elif six.PY2 and isinstance(v, unicode):
+                      v = v.encode('UTF-8')
+                  options[k] = v
+              return snapshot_dict['parameter-dict']
+
+      before = dict(options)
+      parameter_dict = self.fetch_parameter_dict(options, instance_root)
+      timestamp = options.get('timestamp')
+      if timestamp is None:
+          logger.debug("No timestamp from the master: no snapshot")
+          return parameter_dict
+      snapshot_options = {k: v for k, v in six.iteritems(options)
+                          if k not in before or before[k] != v}
+      set_key_list = sorted(k for k, v in six.iteritems(snapshot_options)
+                            if isinstance(v, set))
+      for k in set_key_list:
+          snapshot_options[k] = sorted(snapshot_options[k])
+      getFileWriter(instance_root).write(snapshot, json.dumps({
+          'key': key,
+          'timestamp': str(timestamp),
+          'options': snapshot_options,
+          'set-keys': set_key_list,
+          'parameter-dict': parameter_dict,
+      }, indent=2, sort_keys=True).encode('utf-8'), 0o600)
+      return parameter_dict
+
   def fetch_parameter_dict(self, options, instance_root):
       """Gather parameters about current computer and partition.
 
@@ -128,15 +211,12 @@ class Recipe(object):
       1. SlapOS Master - for external computer/partition information
       2. format.Partition.resource_file - for partition specific details
       """
-      slap = slapos.slap.slap()
-      slap.initializeConnection(
+      computer_partition = self.slap_client.getComputerPartition(
           options['url'],
-          options.get('key'),
-          options.get('cert'),
-      )
-      computer_partition = slap.registerComputerPartition(
           options['computer'],
           options['partition'],
+          options.get('key'),
+          options.get('cert'),
       )
       parameter_dict = computer_partition.getInstanceParameterDict()
       options['instance-state'] = computer_partition.getState()
@@ -225,17 +305,12 @@ class Recipe(object):
 
       # The external information transfered from Slap Master has been processed
       # so we extend with information gathered from partition resource file
-      if hasattr(slapformat.Partition, "resource_file"):
-        resource_home = instance_root
-        while not os.path.exists(os.path.join(resource_home, slapformat.Partition.resource_file)):
-          resource_home = os.path.normpath(os.path.join(resource_home, '..'))
-          if resource_home == "/":
-            break
-        else:
-          # no break happened - let's add partition resources into options
+      resource_file = findResourceFile(instance_root)
+      if resource_file:
+          # let's add partition resources into options
           logger.debug("Using partition resource file {}".format(
-            os.path.join(resource_home, slapformat.Partition.resource_file)))
-          with open(os.path.join(resource_home, slapformat.Partition.resource_file)) as fi:
+            resource_file))
+          with open(resource_file) as fi:
             partition_params = json.load(fi)
           # be very careful with overriding master's information
           for key, value in flatten_dict(partition_params).items():
@@ -262,19 +337,43 @@ class Serialised(Recipe):
           return {}
 
 class JsonDump(Recipe):
+  """
+  Like Recipe, but also dump the parameter dict to a JSON file.
+
+  The file is only rewritten when its content changes.
+
+  Input:
+    json-output
+      Path of the JSON file.
+    json-diff (optional)
+      Path of a file listing the keys that were added (+), removed (-) or
+      changed (~) the last time the JSON file changed.
+
+  Output:
+    json-fingerprint
+      SHA-256 of the JSON file content.
+  """
+
   def __init__(self, buildout, name, options):
-    parameter_dict = self.fetch_parameter_dict(options)
-    self._json_output = options['json-output']
-    # XXX: do not touch file if there's no change to avoid excessive IO
-    #      (see https://lab.nexedi.com/nexedi/slapos.recipe.template/commit/14d26bc8c77a1940f389026bdbd3a9b229b241f4
-    #       for an example to fix this)
-    with os.fdopen(os.open(self._json_output, os.O_WRONLY | os.O_CREAT, 0o600), 'w') as fout:
-      json.dump(parameter_dict, fout, indent=2, sort_keys=True)
-
-    def install(self):
-        return [self._json_output]
-
-    update = install
+    instance_root = buildout['buildout']['directory']
+    parameter_dict = self._fetch(buildout, options, instance_root)
+    # The file is written here rather than in install, so that buildout does
+    # not remove it when uninstalling the part.
+    options['json-fingerprint'] = getFileWriter(instance_root).writeJSON(
+      options['json-output'], parameter_dict, diff=options.get('json-diff'))
+
+
+def findResourceFile(instance_root):
+  """Return the path of the partition resource file, looking up from
+  instance_root, or None if there is none."""
+  if hasattr(slapformat.Partition, "resource_file"):
+    resource_home = instance_root
+    while not os.path.exists(os.path.join(resource_home, slapformat.Partition.resource_file)):
+      resource_home = os.path.normpath(os.path.join(resource_home, '..'))
+      if resource_home == "/":
+        break
+    else:
+      return os.path.join(resource_home, slapformat.Partition.resource_file)
 
 
 def flatten_dict(data, key_prefix=''):
@@ -31,13 +31,16 @@ import copy
 from six.moves.configparser import ConfigParser
 import json
 import subprocess
-import slapos.slap
+from slapos.recipe.librecipe.slapclient import getSlapClient
 import netaddr
 import logging
 import errno
 import re
+import time
 
 import zc.buildout
+from slapos.recipe.librecipe.generic import GenericBaseRecipe
+from slapos.recipe.switch_softwaretype import SubBuildout
 import six
 
 class SlapConfigParser(ConfigParser, object):
@@ -153,7 +156,6 @@ class Recipe:
             raise
 
   def install(self):
-    slap = slapos.slap.slap()
     slap_connection = self.buildout['slap_connection']
     computer_id = slap_connection['computer_id']
     computer_partition_id = slap_connection['partition_id']
@@ -169,10 +171,8 @@ class Recipe:
       storage_home = storage_configuration_dict.get('storage-home')
     if network_dict:
       global_ipv4_network = network_dict.get('global-ipv4-network')
-    slap.initializeConnection(server_url, key_file, cert_file)
-    self.computer_partition = slap.registerComputerPartition(
-      computer_id,
-      computer_partition_id)
+    self.computer_partition = getSlapClient(self.buildout).getComputerPartition(
+      server_url, computer_id, computer_partition_id, key_file, cert_file)
     self.parameter_dict = self.computer_partition.getInstanceParameterDict()
     software_type = self.parameter_dict['slap_software_type']
 
@@ -266,14 +266,25 @@ class Recipe:
     with open(buildout_filename, 'w') as buildout_file:
       buildout.write(buildout_file)
 
-    # XXX-Antoine: We gotta find a better way to do this. I tried to check
-    # out how slapgrid-cp was running buildout. But it is worse than that.
-    command_line_args = copy.copy(sys.argv) + ['-c', buildout_filename]
+    start = time.time()
+    if self.options.get('in-process', '').lower() in \
+        GenericBaseRecipe.TRUE_VALUES:
+      # Like switch-softwaretype, run the buildout in this process, with the
+      # eggs and the logger that are already loaded, instead of paying for
+      # the startup of a new interpreter and buildout.
+      self.logger.info("Running %s in process", buildout_filename)
+      SubBuildout(self.buildout, buildout_filename, []).install([])
+    else:
+      # XXX-Antoine: We gotta find a better way to do this. I tried to check
+      # out how slapgrid-cp was running buildout. But it is worse than that.
+      command_line_args = copy.copy(sys.argv) + ['-c', buildout_filename]
 
-    self.logger.info("Invoking commandline : '%s'",
-                     ' '.join(command_line_args))
+      self.logger.info("Invoking commandline : '%s'",
+                       ' '.join(command_line_args))
 
-    subprocess.check_call(command_line_args, cwd=work_directory,
-                          env=os.environ.copy())
+      subprocess.check_call(command_line_args, cwd=work_directory,
+                            env=os.environ.copy())
+    self.logger.info("%s done in %.3fs", buildout_filename,
+                     time.time() - start)
     return []
   update = install
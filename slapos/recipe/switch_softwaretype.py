@@ -25,9 +25,158 @@
 #
 ##############################################################################
 
+import errno
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+
+import zc.buildout.configparser
 from zc.buildout.buildout import Buildout, MissingOption, MissingSection
 from zc.buildout import UserError
 
+_isurl = re.compile('[a-zA-Z0-9+.-]+://').match
+
+def _digest(path):
+  try:
+    with open(path, 'rb') as f:
+      return hashlib.sha256(f.read()).hexdigest()
+  except IOError as e:
+    if e.errno != errno.ENOENT:
+      raise
+
+def _extendsFileList(path, file_list):
+  """Append to file_list the files read by buildout to parse the profile at
+  path, including missing optional ones. Raise ValueError if one of them
+  would be downloaded."""
+  if _isurl(path):
+    raise ValueError(path)
+  if path in file_list: # buildout reports the loop
+    return
+  file_list.append(path)
+  if not os.path.exists(path):
+    return
+  with open(path) as f:
+    buildout_section = zc.buildout.configparser.parse(f, path).get(
+      'buildout', {})
+  base = os.path.dirname(path)
+  for option in 'extends', 'optional-extends':
+    for filename in buildout_section.get(option, '').split():
+      if _isurl(filename):
+        raise ValueError(filename)
+      _extendsFileList(os.path.join(base, filename), file_list)
+
+
+class ProfileCache(object):
+  """Cache of the sections of a profile parsed by buildout
+
+  The raw sections (before substitution) that a sub-buildout got from its
+  profile and extends chain are saved in a file, with the content hashes of
+  all files of the chain and of the user defaults. As long as they are
+  unchanged, and options are the same, the sections are given as options
+  to a sub-buildout without profile, so that buildout parses nothing.
+  Profiles extending URLs, or that can not be scanned for extends, are not
+  cached.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    try:
+      with open(path) as f:
+        self._entry = json.load(f)
+    except (IOError, ValueError):
+      self._entry = None
+    self.hit = self.miss = 0
+
+  def _key(self, profile, options):
+    return json.loads(json.dumps([profile, sorted(map(list, options)),
+                                  sys.version, sys.platform]))
+
+  def get(self, profile, options):
+    """Return the cached sections of profile as a list of options,
+    or None"""
+    entry = self._entry
+    if entry and entry['key'] == self._key(profile, options) and all(
+        _digest(path) == digest for path, digest in entry['file-list']):
+      self.hit += 1
+      return [(section, k, v)
+              for section, option_dict in sorted(entry['sections'].items())
+              for k, v in sorted(option_dict.items())]
+    self.miss += 1
+
+  def load(self, main_buildout, profile, options):
+    """Return a SubBuildout for profile, parsing it only if it is not
+    cached"""
+    all_options = getSubBuildoutOptions(main_buildout, options)
+    sections = self.get(profile, all_options)
+    if sections is None:
+      sub_buildout = SubBuildout(main_buildout, profile, options)
+      self.set(profile, all_options, sub_buildout.getRawSections())
+    else:
+      sub_buildout = SubBuildout(main_buildout, None, sections)
+    return sub_buildout
+
+  def set(self, profile, options, sections):
+    """Save the raw sections parsed by a sub-buildout"""
+    file_list = []
+    try:
+      for path in [profile] + [x[2] for x in options
+                               if tuple(x[:2]) == ('buildout', 'extends')]:
+        _extendsFileList(os.path.abspath(path), file_list)
+      user_config = os.path.join(os.environ.get('BUILDOUT_HOME',
+        os.path.join(os.path.expanduser('~'), '.buildout')), 'default.cfg')
+      _extendsFileList(user_config, file_list)
+    except Exception as e:
+      logging.getLogger(__name__).debug("Profile not cached: %r", e)
+      entry = None
+    else:
+      entry = {
+        'key': self._key(profile, options),
+        'file-list': [(path, _digest(path)) for path in file_list],
+        'sections': sections,
+      }
+    if entry != self._entry:
+      if entry is None:
+        os.remove(self.path)
+      else:
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+          json.dump(entry, f, sort_keys=True)
+        os.rename(tmp, self.path)
+      self._entry = entry
+
+def getSubBuildoutOptions(main_buildout, options):
+  """Return options of a sub-buildout, adding those of the main buildout
+  that it must share"""
+  options = list(options)
+  # Use same options
+  for opt in (
+      'offline',
+      'verbosity',
+      'newest',
+      'directory',
+      'eggs-directory',
+      'develop-eggs-directory',
+  ):
+    if opt in main_buildout['buildout']:
+      options.append((
+          'buildout',
+          opt,
+          main_buildout['buildout'][opt],
+      ))
+  # Use same slap connection
+  try:
+    slap_connection = main_buildout["slap-connection"]
+  except MissingSection:
+    # e.g. slapos.cookbook:softwaretype, whose profile has it already
+    pass
+  else:
+    for k, v in slap_connection.items():
+      options.append(('slap-connection', k, v))
+  return options
+
 class SubBuildout(Buildout):
   """Run buildout in buildout, partially copied from infrae.buildout
   """
@@ -36,26 +185,8 @@ class SubBuildout(Buildout):
     self._logger = main_buildout._logger
     self._log_level = main_buildout._log_level
 
-    # Use same options
-    for opt in (
-        'offline',
-        'verbosity',
-        'newest',
-        'directory',
-        'eggs-directory',
-        'develop-eggs-directory',
-    ):
-      if opt in main_buildout['buildout']:
-        options.append((
-            'buildout',
-            opt,
-            main_buildout['buildout'][opt],
-        ))
-    # Use same slap connection
-    for k, v in main_buildout["slap-connection"].items():
-      options.append(('slap-connection', k, v))
-
-    Buildout.__init__(self, config, options, **kwargs)
+    Buildout.__init__(self, config,
+                      getSubBuildoutOptions(main_buildout, options), **kwargs)
 
   def _setup_logging(self):
     """We don't want to setup any logging, since it's already done
@@ -63,6 +194,11 @@ class SubBuildout(Buildout):
     """
     pass
 
+  def getRawSections(self):
+    """Return the sections as parsed, before any substitution"""
+    return {section: dict(option_dict)
+            for section, option_dict in self._raw.items()}
+
 
 class Recipe:
 
@@ -99,11 +235,15 @@ class Recipe:
       options.append(["buildout", "extends", profile])
       profile = extended_profile
 
-    sub_buildout = SubBuildout(
-        self.buildout,
-        profile,
-        options,
-    )
+    # Parsing the extends chain of the profile is slow, so the result is
+    # cached until a file of the chain changes.
+    profile_cache = ProfileCache(os.path.join(
+      self.buildout['buildout']['directory'],
+      '.slapos-profile-cache-%s.json' % self.name))
+    sub_buildout = profile_cache.load(self.buildout, profile, options)
+    logging.getLogger(self.name).info(
+      "Profile cache: %s hit(s), %s miss(es)",
+      profile_cache.hit, profile_cache.miss)
 
     sub_buildout.install([])
 
@@ -39,6 +39,7 @@ class Recipe(GenericBaseRecipe):
     :param lines hash-existing-files: list of existing files to be checked by hash
     :param str pidfile: path to pidfile ensure exclusivity for the process
     :param lines private-tmpfs: list of "<size> <path>" private tmpfs, using user namespaces
+      (plain directories if user namespaces are not permitted)
     :param bool reserve-cpu: command will ask for an exclusive CPU core
     """
 
@@ -0,0 +1,2 @@
+"""Benchmarks, to be run manually with python -m slapos.test.benchmark.<name>
+"""
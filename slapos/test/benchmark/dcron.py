@@ -0,0 +1,85 @@
+"""Simulate the concurrency of cron entries over a day, with and without splay
+
+Entries are read from the given cron.d directories or files, one partition
+per directory; by default, 100 partitions with a daily backup, an hourly
+logrotate and promises every 5 minutes are simulated. Each run of a command
+is assumed to last 'duration' seconds, and day fields are ignored, as if
+all entries ran on the simulated day. The peak number of commands running
+at the same time is shown, as generated by cron.d Part, then with the given
+splay (in seconds), which is applied like Part does.
+
+  python -m slapos.test.benchmark.dcron [-d duration] [-s splay] [cron.d...]
+"""
+from __future__ import print_function
+import argparse
+import os
+
+from slapos.recipe.dcron import splay_cron, splay_offset
+from slapos.recipe.pbs_scheduler import CronSpec
+
+
+def read_entries(path_list):
+  """Return (partition, name, spec) for all entries"""
+  entry_list = []
+  for path in path_list:
+    if os.path.isdir(path):
+      file_list = sorted(os.path.join(path, x) for x in os.listdir(path))
+    else:
+      file_list = [path]
+    for filename in file_list:
+      with open(filename) as f:
+        for line in f:
+          line = line.strip()
+          if line and not line.startswith('#'):
+            entry_list.append((os.path.dirname(os.path.abspath(filename)),
+                               os.path.basename(filename),
+                               ' '.join(line.split()[:5])))
+  return entry_list
+
+
+def default_entries(count=100):
+  return [('slappart%s' % i, name, spec)
+          for i in range(count)
+          for name, spec in (('backup', '0 0 * * *'),
+                             ('logrotate', '0 * * * *'),
+                             ('promise', '*/5 * * * *'))]
+
+
+def peak(entry_list, duration, splay=0):
+  """Peak number of commands running at the same time, and when"""
+  event_list = []
+  for partition, name, spec in entry_list:
+    delay = 0
+    if splay:
+      spec, delay = splay_cron(spec, splay_offset(partition, name, splay))
+    minute_set, hour_set = CronSpec(spec).field_list[:2]
+    for hour in hour_set:
+      for minute in minute_set:
+        start = (hour * 60 + minute) * 60 + delay
+        event_list.append((start, 1))
+        event_list.append((start + duration, -1))
+  event_list.sort()
+  running = result = when = 0
+  for t, x in event_list:
+    running += x
+    if running > result:
+      result, when = running, t
+  return result, when
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-d', '--duration', type=int, default=30)
+  parser.add_argument('-s', '--splay', type=int, default=1800)
+  parser.add_argument('path', nargs='*')
+  args = parser.parse_args()
+  entry_list = read_entries(args.path) if args.path else default_entries()
+  print('%s entries, each run lasting %ss' % (len(entry_list), args.duration))
+  for splay in 0, args.splay:
+    n, t = peak(entry_list, args.duration, splay)
+    print('splay %5ss  peak concurrency %4s  at %02d:%02d:%02d' % (
+      splay, n, t // 3600 % 24, t // 60 % 60, t % 60))
+
+
+if __name__ == '__main__':
+  main()
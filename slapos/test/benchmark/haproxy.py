@@ -0,0 +1,102 @@
+"""Generate haproxy configurations with many backends
+
+The configuration of 'count' backends with 'servers' servers each is
+generated by the haproxy recipe, which reads its templates once, and by the
+previous implementation, which read the template of a listen section or of
+a server line again for each of them.
+
+  python -m slapos.test.benchmark.haproxy [count [servers]]
+"""
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from slapos.recipe import haproxy
+from slapos.recipe.haproxy import Recipe
+
+
+def template(name):
+  return os.path.join(os.path.dirname(haproxy.__file__), 'template', name)
+
+
+class Legacy(Recipe):
+
+  def install(self):
+    backend_dict = self.options['backend-dict']
+    server_snippet_filename = template('haproxy-server-snippet.cfg.in')
+    listen_snippet_filename = template('haproxy-listen-snippet.cfg.in')
+    server_snippet = ""
+    maxconn = self.options['maxconn']
+    i = 0
+    for name, (port, backend_list) in backend_dict.items():
+      server_snippet += self.substituteTemplate(
+        listen_snippet_filename, {
+          'name': name,
+          'ip': self.options['ip'],
+          'port': port,
+          'httpchk': '',
+          'timeout_queue': '',
+        })
+      for address in backend_list:
+        i += 1
+        server_snippet += self.substituteTemplate(
+          server_snippet_filename, {
+            'name': '%s_%s' % (name, i),
+            'cookie': '%s_%s' % (name, i),
+            'address': address,
+            'cluster_zope_thread_amount': maxconn,
+            'check_interval': '3s',
+          })
+    return self.createFile(self.options['conf-path'],
+      self.substituteTemplate(template('haproxy.cfg.in'),
+        {'socket_path': self.options['socket-path'],
+         'server_text': server_snippet}))
+
+
+class Buildout(dict):
+
+  def __init__(self):
+    dict.__init__(self, buildout={})
+
+
+def main(count=1000, servers=4):
+  count = int(count)
+  servers = int(servers)
+  tmp = tempfile.mkdtemp()
+  try:
+    p = lambda x: os.path.join(tmp, x)
+    options = {
+      'name': 'haproxy',
+      'ip': '10.0.0.1',
+      'maxconn': '1',
+      'conf-path': p('haproxy.cfg'),
+      'wrapper-path': p('haproxy'),
+      'ctl-path': p('haproxyctl'),
+      'socket-path': p('haproxy.sock'),
+      'binary-path': '/bin/haproxy',
+      'backend-dict': dict(
+        ('backend%s' % i, (10000 + i, ['10.0.%s.%s:2200' % (i // 250, j)
+                                       for j in range(servers)]))
+        for i in range(count)),
+    }
+    recipe = Recipe(Buildout(), 'haproxy', options)
+    # Only measure the generation of the configuration.
+    recipe.createWrapper = recipe.createPythonScript = \
+      lambda path, *args, **kw: path
+    print('%s backends with %s servers each' % (count, servers))
+    for name, recipe in (('legacy', Legacy(Buildout(), 'haproxy', options)),
+                         ('haproxy', recipe)):
+      start = time.time()
+      recipe.install()
+      duration = time.time() - start
+      print('%-8s %8.1f ms  %s bytes' % (name, duration * 1000,
+                                        os.path.getsize(p('haproxy.cfg'))))
+  finally:
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+  main(*sys.argv[1:])
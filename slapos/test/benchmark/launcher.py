@@ -0,0 +1,80 @@
+"""Compare wrappers generated by GenericBaseRecipe.createWrapper with options
+
+The legacy wrapper is an egg script importing generic_exec from
+slapos.recipe.librecipe.execute, the other one embeds
+slapos.recipe.librecipe.launcher. Both wait for an existing file and write a
+pidfile before executing /bin/true. Exec latency is measured until the
+wrapped process exits, and RSS is the peak of the wrapper process, which is
+kept across exec. Note that it can not be lower than the RSS of the measuring
+process, which is a Python interpreter started without site.
+
+  python -m slapos.test.benchmark.launcher [count]
+"""
+from __future__ import print_function
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import zc.buildout.easy_install
+import pkg_resources
+
+from slapos.recipe.librecipe import GenericBaseRecipe
+
+
+class Recipe(GenericBaseRecipe):
+
+  def __init__(self):
+    self.buildout = {'buildout': {}}
+
+
+# The peak RSS recorded by the kernel for a process includes the memory of the
+# process it was forked from, so measurements are done by a small process.
+MEASURE = """
+import os, sys, time
+path = sys.argv[1]
+elapsed = rss = 0
+for _ in range(int(sys.argv[2])):
+  start = time.time()
+  pid = os.fork()
+  if not pid:
+    os.execv(path, [path])
+  _, status, rusage = os.wait4(pid, 0)
+  elapsed += time.time() - start
+  assert status == 0, (path, status)
+  rss = max(rss, rusage.ru_maxrss)
+print(elapsed / int(sys.argv[2]), rss)
+"""
+
+def measure(path, count):
+  latency, rss = subprocess.check_output(
+    (sys.executable, '-S', '-c', MEASURE, path, str(count))).split()
+  return float(latency), int(rss)
+
+
+def main(count=20):
+  tmp = tempfile.mkdtemp()
+  try:
+    existing = os.path.join(tmp, 'existing')
+    open(existing, 'w').close()
+    kw = {
+      'wait_list': [existing],
+      'pidfile': os.path.join(tmp, 'pid'),
+    }
+    legacy = os.path.join(tmp, 'legacy')
+    zc.buildout.easy_install.scripts(
+      [('legacy', 'slapos.recipe.librecipe.execute', 'generic_exec')],
+      pkg_resources.working_set, sys.executable, tmp,
+      arguments='%r, **%r' % (['/bin/true'], kw))
+    launcher = Recipe().createWrapper(
+      os.path.join(tmp, 'launcher'), ['/bin/true'], **kw)
+    for name, path in ('egg script', legacy), ('launcher', launcher):
+      latency, rss = measure(path, count)
+      print('%-10s  %7.1f ms  %7d kB' % (name, latency * 1000, rss))
+  finally:
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+  main(*map(int, sys.argv[1:]))
@@ -0,0 +1,85 @@
+"""Compare the codecs supported by the logrotate recipe
+
+A synthetic access log (Apache combined format, with a limited set of
+clients, paths and user agents, like real logs) is compressed by each codec
+found in PATH, the way logrotate runs compresscmd, i.e. from stdin to stdout,
+with the options generated by the recipe. Throughput is given in MB of log
+per second of wall-clock time, and ratio is the size of the log divided by
+the size of the compressed file.
+
+  python -m slapos.test.benchmark.logrotate [size in MB]
+"""
+from __future__ import print_function
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from slapos.recipe.logrotate import CODEC_DICT
+
+
+def corpus(path, size):
+  rnd = random.Random(0)
+  ip_list = ['10.0.%s.%s' % (rnd.randrange(256), rnd.randrange(256))
+             for _ in range(500)]
+  path_list = ['/%s/%s' % (rnd.choice(('erp5', 'static', 'api', 'web')),
+                           '/'.join('%x' % rnd.getrandbits(16)
+                                    for _ in range(rnd.randrange(1, 4))))
+               for _ in range(2000)]
+  agent_list = ['Mozilla/5.0 (X11; Linux x86_64) Firefox/%s.0' % i
+                for i in range(60, 120)] + ['curl/7.%s.0' % i
+                                            for i in range(50, 80)]
+  t = 1500000000
+  with open(path, 'w') as f:
+    while size > 0:
+      t += rnd.randrange(3)
+      line = '%s - - [%s] "%s %s HTTP/1.1" %s %s "-" "%s" %s\n' % (
+        rnd.choice(ip_list),
+        time.strftime('%d/%b/%Y:%H:%M:%S +0000', time.gmtime(t)),
+        rnd.choice(('GET', 'GET', 'GET', 'POST')), rnd.choice(path_list),
+        rnd.choice((200, 200, 200, 304, 404, 500)), rnd.randrange(100000),
+        rnd.choice(agent_list), rnd.randrange(1000000))
+      f.write(line)
+      size -= len(line)
+
+
+def main(size=64):
+  size = int(size) << 20
+  tmp = tempfile.mkdtemp()
+  try:
+    log = os.path.join(tmp, 'access.log')
+    corpus(log, size)
+    size = os.path.getsize(log)
+    print('%.1f MB of log, %s cores' % (size / 1e6, os.cpu_count()
+                                        if hasattr(os, 'cpu_count') else '?'))
+    for codec, level_list in (('gzip', (6, 9)),
+                              ('pigz', (6, 9)),
+                              ('zstd', (3, 9, 19)),
+                              ('xz', (1, 6))):
+      binary = shutil.which(codec) if hasattr(shutil, 'which') else codec
+      if not binary:
+        print('%-5s not found' % codec)
+        continue
+      compress_options, extension, _ = CODEC_DICT[codec]
+      for level in level_list:
+        options = compress_options % {'level': level, 'threads': 0}
+        if codec == 'pigz':
+          options = options.split(' -p', 1)[0]
+        output = log + extension
+        with open(log, 'rb') as stdin, open(output, 'wb') as stdout:
+          start = time.time()
+          subprocess.check_call([binary] + options.split(),
+                                stdin=stdin, stdout=stdout)
+          duration = time.time() - start
+        print('%-5s %-9s %8.1f MB/s  ratio %5.2f' % (codec, options,
+          size / 1e6 / duration, size / float(os.path.getsize(output))))
+        os.remove(output)
+  finally:
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+  main(*sys.argv[1:])
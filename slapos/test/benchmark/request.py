@@ -0,0 +1,117 @@
+"""Count master round-trips of request sections returning many parameters
+
+A local stand-in master answers the requests of a few request sections that
+each return many connection parameters, and counts the HTTP requests it
+receives. The legacy recipe reads returned parameters one by one: if the
+requested instance is not ready yet, each of them may be a failing round-trip
+to the master. The request recipe now fetches them all at once.
+
+Note that slapos.core does not do any round-trip if the requested instance is
+not allocated, or if its connection parameters come with the response of the
+request.
+
+  python -m slapos.test.benchmark.request [sections] [parameters]
+"""
+from __future__ import print_function
+import sys
+import threading
+
+from six.moves import BaseHTTPServer, socketserver
+
+from slapos import slap
+from slapos.util import dumps
+from slapos.recipe import request
+
+
+class LegacyRecipe(request.Recipe):
+
+  def _getReturnParameterDict(self, instance, return_parameter_list):
+    result = {}
+    for param in return_parameter_list:
+      try:
+        result[param] = str(instance.getConnectionParameter(param))
+      except slap.NotFoundError:
+        pass
+    return result
+
+
+class Master(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+  daemon_threads = True
+  count = 0
+  # 'not ready': the requested instance is not allocated yet
+  # 'ready': connection parameters are sent with the requested instance
+  # 'lagging': they are not, and reading them fails for the moment
+  state = 'not ready'
+
+  class RequestHandlerClass(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+      pass
+
+    def reply(self, code, body=b''):
+      self.server.count += 1
+      self.send_response(code)
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def do_GET(self):
+      if self.path.startswith('/getHateoasUrl'):
+        self.server.count -= 1 # done once per process by slapos.core
+      self.reply(404)
+
+    def do_POST(self):
+      self.rfile.read(int(self.headers['Content-Length']))
+      state = self.server.state
+      if state == 'not ready':
+        return self.reply(408)
+      kw = {}
+      if state == 'ready':
+        kw['_connection_dict'] = self.server.connection_dict
+      self.reply(200, dumps(slap.SoftwareInstance(
+        slap_computer_id='COMP-0',
+        slap_computer_partition_id='slappart1',
+        **kw)))
+
+
+def run(master, recipe, sections, parameter_list):
+  master.count = 0
+  buildout = type('Buildout', (dict,), {})(
+    {'buildout': {}, 'slap-connection': {}})
+  for i in range(sections):
+    options = {
+      'server-url': 'http://%s:%s' % master.server_address,
+      'computer-id': 'COMP-0',
+      'partition-id': 'slappart0',
+      'software-url': 'http://example.com/software.cfg',
+      'name': 'instance-%s' % i,
+      'return': ' '.join(parameter_list),
+    }
+    recipe(buildout, 'request', options)
+  return master.count
+
+
+def main(sections=10, parameters=25):
+  master = Master(('127.0.0.1', 0), Master.RequestHandlerClass)
+  thread = threading.Thread(target=master.serve_forever)
+  thread.daemon = True
+  thread.start()
+  try:
+    parameter_list = ['parameter-%s' % i for i in range(parameters)]
+    master.connection_dict = dict.fromkeys(parameter_list, 'value')
+    print('%s sections returning %s parameters' % (sections, parameters))
+    for master.state in 'not ready', 'ready', 'lagging':
+      print('%-10s' % master.state, ', '.join(
+        '%s: %3d round-trips' % (name, run(master, recipe, sections,
+                                           parameter_list))
+        for name, recipe in (('legacy', LegacyRecipe),
+                             ('bulk', request.Recipe))))
+  finally:
+    master.shutdown()
+
+
+if __name__ == '__main__':
+  main(*map(int, sys.argv[1:]))
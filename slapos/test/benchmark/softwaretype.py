@@ -0,0 +1,71 @@
+"""Compare the execution modes of slapos.cookbook:softwaretype
+
+The recipe runs the buildout of the instance profile selected by the software
+type, either with a new buildout process, or in the process of the main
+buildout when 'in-process' is true. The instance profile does nothing, so
+that the time that is measured is mostly the cost of starting the
+sub-buildout.
+
+  python -m slapos.test.benchmark.softwaretype [count]
+"""
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import mock
+from zc.buildout.buildout import Buildout
+
+from slapos.recipe import softwaretype
+
+MAIN = """[buildout]
+parts =
+
+[slap_connection]
+computer_id = COMP-0
+partition_id = slappart0
+server_url = http://127.0.0.1:1
+"""
+
+INSTANCE = """[buildout]
+parts =
+"""
+
+def main(count=5):
+  tmp = tempfile.mkdtemp()
+  try:
+    main_cfg = os.path.join(tmp, 'buildout.cfg')
+    with open(main_cfg, 'w') as f:
+      f.write(MAIN)
+    instance_cfg = os.path.join(tmp, 'instance.cfg')
+    with open(instance_cfg, 'w') as f:
+      f.write(INSTANCE)
+    buildout = Buildout(main_cfg, [('buildout', 'directory', tmp)])
+    partition = mock.MagicMock(_requested_state='started')
+    partition.getInstanceParameterDict.return_value = {
+      'slap_software_type': 'default',
+      'ip_list': [('tap0', '10.0.0.1'), ('tap0', '2001:db8::1')],
+    }
+    # The new process runs buildout with the same command line.
+    argv = [os.path.join(os.path.dirname(sys.executable), 'buildout')]
+    with mock.patch.object(softwaretype, 'getSlapClient') as getSlapClient, \
+         mock.patch.object(sys, 'argv', argv):
+      getSlapClient.return_value.getComputerPartition.return_value = partition
+      for in_process in 'false', 'true':
+        recipe = softwaretype.Recipe(buildout, 'switch', {
+          'default': instance_cfg,
+          'in-process': in_process,
+        })
+        start = time.time()
+        for _ in range(count):
+          recipe.install()
+        print('in-process = %-5s  %7.1f ms' % (
+          in_process, (time.time() - start) / count * 1000))
+  finally:
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+  main(*map(int, sys.argv[1:]))
@@ -0,0 +1,123 @@
+"""Measure the time to recovery of a takeover against a stand-in master
+
+A local stand-in master answers the calls of the takeover script, which runs
+in dry-run mode. Like the SlapOS master, it needs some time (the 'lag') to
+allocate the requested winner partition, and to process the rename of the
+broken partition before its reference can be given to the winner. The time
+to recovery is the duration of the takeover, with the duration of each of
+its phases. Retrying every 10 seconds, as the takeover script used to do, is
+shown for comparison.
+
+  python -m slapos.test.benchmark.takeover [lag...]
+"""
+from __future__ import print_function
+import logging
+import sys
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs
+
+from slapos import slap
+from slapos.util import dumps
+from slapos.recipe.addresiliency import takeover
+
+
+class Master(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+  daemon_threads = True
+  lag = 0
+
+  def reset(self, lag):
+    self.lag = lag
+    self.first_request = None
+    self.renamed = None
+    # partition id -> reference
+    self.reference_dict = {'slappart0': 'backup0', 'slappart1': 'backup1'}
+
+  class RequestHandlerClass(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+      pass
+
+    def reply(self, code, body=b''):
+      self.send_response(code)
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def do_GET(self):
+      self.reply(404)
+
+    def do_POST(self):
+      master = self.server
+      data = dict((k, v[0]) for k, v in parse_qs(self.rfile.read(
+        int(self.headers['Content-Length'])).decode()).items())
+      now = time.time()
+      if self.path.endswith('/requestComputerPartition'):
+        reference = data['partition_reference']
+        for partition_id, x in master.reference_dict.items():
+          if x == reference:
+            break
+        else:
+          partition_id = 'slappart2'
+        if partition_id == 'slappart1':
+          # the winner is allocated after some time
+          if master.first_request is None:
+            master.first_request = now
+          if now < master.first_request + master.lag:
+            return self.reply(408)
+        self.reply(200, dumps(slap.SoftwareInstance(
+          slap_computer_id='COMP-0',
+          slap_computer_partition_id=partition_id)))
+      elif self.path.endswith('/softwareInstanceRename'):
+        partition_id = data['computer_partition_id']
+        new_name = data['new_name']
+        if new_name in master.reference_dict.values() or (
+            master.renamed and now < master.renamed[1] + master.lag and
+            new_name == master.renamed[0]):
+          # the old reference is freed when the rename is processed
+          return self.reply(404)
+        master.renamed = master.reference_dict[partition_id], now
+        master.reference_dict[partition_id] = new_name
+        self.reply(200)
+      else: # softwareInstanceBang
+        self.reply(200)
+
+
+def run(master, lag, backoff):
+  master.reset(lag)
+  return takeover.takeover(
+    server_url='http://%s:%s' % master.server_address,
+    key_file=None, cert_file=None,
+    computer_guid='COMP-0', partition_id='slappart2',
+    software_release='http://example.com/software.cfg',
+    namebase='backup', winner_instance_suffix='1',
+    dry_run=True, backoff=backoff)
+
+
+def main(*lag_list):
+  logging.disable(logging.WARNING)
+  master = Master(('127.0.0.1', 0), Master.RequestHandlerClass)
+  thread = threading.Thread(target=master.serve_forever)
+  thread.daemon = True
+  thread.start()
+  try:
+    for lag in map(float, lag_list or (0, .5, 2)):
+      for name, backoff in (
+          ('backoff', takeover.Backoff(initial=.1)),
+          ('fixed 10s', takeover.Backoff(initial=10, factor=1, jitter=0))):
+        report = run(master, lag, backoff)
+        print('lag %4.1fs %-9s  RTO %6.2fs  (%s)' % (lag, name,
+          report['duration'], ', '.join('%s: %.2fs/%s' % (
+            x['name'], x['duration'], x['attempts'])
+            for x in report['phase-list'])))
+  finally:
+    master.shutdown()
+
+
+if __name__ == '__main__':
+  main(*sys.argv[1:])
@@ -0,0 +1,118 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from mock import patch
+
+from slapos.recipe.certificate_authority import certificate_authority
+
+try:
+  import cryptography
+except ImportError:
+  cryptography = None
+
+TEMPLATE = os.path.join(os.path.dirname(certificate_authority.__file__),
+                        'template', 'openssl.cnf.ca.in')
+
+
+@unittest.skipUnless(cryptography, "cryptography is not available")
+class CertificateAuthorityTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    p = self.path
+    for d in 'private', 'certs', 'newcerts', 'crl', 'requests':
+      os.mkdir(p(d))
+    for f in 'crlnumber', 'serial':
+      with open(p(f), 'w') as f:
+        f.write('01')
+    open(p('index.txt'), 'w').close()
+    with open(TEMPLATE) as f:
+      template = f.read()
+    with open(p('openssl.cnf'), 'w') as f:
+      f.write(template % dict(working_directory=self.tmp, country_code='XX',
+        state='State', city='City', company='Company',
+        email_address='xx@example.com'))
+    self.ca = certificate_authority.CertificateAuthority(
+      p('private', 'cakey.pem'), p('cacert.pem'), 'openssl',
+      p('openssl.cnf'), p('requests'))
+    try:
+      self.ca.checkAuthority()
+    except OSError:
+      self.skipTest("openssl is not available")
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def path(self, *args):
+    return os.path.join(self.tmp, *args)
+
+  def request(self, name):
+    request_file = self.path('requests', name)
+    with open(request_file, 'w') as f:
+      f.write('[certificate]\nname = %s\nkey_file = %s\ncertificate_file = %s\n'
+        % (name, self.path('certs', name + '.key'),
+                 self.path('certs', name + '.crt')))
+    return request_file
+
+  def verify(self, name):
+    subprocess.check_output(('openssl', 'verify', '-CAfile',
+      self.path('cacert.pem'), self.path('certs', name + '.crt')))
+    subject = subprocess.check_output(('openssl', 'x509', '-noout',
+      '-subject', '-nameopt', 'compat', '-in',
+      self.path('certs', name + '.crt')), universal_newlines=True)
+    self.assertEqual(subject.strip(),
+      'subject=/C=XX/ST=State/O=Company/CN=%s/emailAddress=xx@example.com'
+      % name)
+
+  def test_checkRequest(self):
+    request_file = self.request('foo')
+    with patch.object(certificate_authority, 'popenCommunicate') as popen:
+      self.ca.checkRequest(request_file)
+      # already issued
+      self.ca.checkRequest(request_file)
+    popen.assert_not_called()
+    self.verify('foo')
+    with open(self.path('serial')) as f:
+      self.assertEqual(f.read(), '02\n')
+    with open(self.path('index.txt')) as f:
+      index, = f.read().splitlines()
+    self.assertTrue(index.endswith(
+      '\t01\tunknown\t/C=XX/ST=State/O=Company/CN=foo'
+      '/emailAddress=xx@example.com'), index)
+    self.assertTrue(os.path.exists(self.path('newcerts', '01.pem')))
+    self.assertEqual(self.ca._request_lock_dict, {})
+
+  def test_serial(self):
+    self.assertEqual([certificate_authority.serialHex(x)
+                      for x in (1, 0xff, 0x100, 0xfff, 0x1000)],
+                     ['01', 'FF', '0100', '0FFF', '1000'])
+    with open(self.path('serial'), 'w') as f:
+      f.write('FF\n')
+    self.ca.checkRequest(self.request('foo'))
+    with open(self.path('serial')) as f:
+      self.assertEqual(f.read(), '0100\n')
+    self.assertTrue(os.path.exists(self.path('newcerts', 'FF.pem')))
+    # openssl accepts the serial file written after 256 certificates
+    self.ca._issuer = None
+    self.ca.checkRequest(self.request('bar'))
+    self.verify('bar')
+    with open(self.path('index.txt')) as f:
+      self.assertEqual([x.split('\t')[3] for x in f.read().splitlines()],
+                       ['FF', '0100'])
+
+  def test_openssl_database(self):
+    # Certificates issued in-process and by openssl share the database.
+    self.ca.checkRequest(self.request('foo'))
+    self.ca._issuer = None
+    self.ca.checkRequest(self.request('bar'))
+    self.verify('bar')
+    with open(self.path('index.txt')) as f:
+      self.assertEqual([x.split('\t')[3] for x in f.read().splitlines()],
+                       ['01', '02'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,5 +1,15 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
-from slapos.recipe.dcron import systemd_to_cron
+
+import mock
+
+from slapos.recipe.dcron import Part, limit, splay_cron, splay_offset, \
+  systemd_to_cron
+from slapos.test.utils import makeRecipe
 
 class TestDcron(unittest.TestCase):
   def test(self):
@@ -36,3 +46,94 @@ class TestDcron(unittest.TestCase):
     _("1-0"); _("1-32"); _("1-14/18")
     _("24:0"); _("8/16:0")
     _("0:60"); _("0:15/45")
+
+  def test_splay_cron(self):
+    def _(spec, offset, expected):
+      self.assertEqual(splay_cron(spec, offset), expected)
+    _("0 0 * * *", 0, ("0 0 * * *", 0))
+    _("0 0 * * *", 125, ("2 0 * * *", 5))
+    _("50 3 * * 1", 1200, ("10 3 * * 1", 0))
+    _("0,30 * * * *", 660, ("11,41 * * * *", 0))
+    _("*/5 * * * *", 430, ("2-59/5 * * * *", 10))
+    _("10-59/30 * * * *", 1500, ("5-59/30 * * * *", 0))
+    _("daily", 61, ("1 0 * * *", 1))
+    # The minute field can not be shifted: delay of less than a minute.
+    _("* * * * *", 125, ("* * * * *", 5))
+    _("1-5 * * * *", 125, ("1-5 * * * *", 5))
+    _("0-20/10 * * * *", 125, ("0-20/10 * * * *", 5))
+    _("@reboot", 125, ("@reboot", 125))
+
+  def test_splay_offset(self):
+    offset_set = set(splay_offset('slappart%s' % i, 'backup', 3600)
+                     for i in range(100))
+    self.assertGreater(len(offset_set), 90)
+    self.assertTrue(all(0 <= x <= 3600 for x in offset_set))
+    self.assertEqual(splay_offset('slappart0', 'backup', 3600),
+                     splay_offset('slappart0', 'backup', 3600))
+    self.assertNotEqual(splay_offset('slappart0', 'backup', 3600),
+                        splay_offset('slappart0', 'logrotate', 3600))
+
+
+class TestPart(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+
+  def install(self, **options):
+    options.update(name='backup', command='run-backup',
+                   frequency='0 0 * * *', **{'cron-entries': self.tmp})
+    recipe = makeRecipe(Part, options, name='cron-entry-backup',
+                        slap_connection={'partition-id': 'slappart3'})
+    with mock.patch.object(recipe, 'createPythonScript',
+                           side_effect=lambda path, *args: path) as script:
+      path_list = recipe.install()
+    with open(os.path.join(self.tmp, 'backup')) as f:
+      return path_list, f.read(), script
+
+  def test_splay(self):
+    offset = splay_offset('slappart3', 'backup', 3600)
+    minute, delay = divmod(offset, 60)
+    path_list, entry, _ = self.install(splay='3600')
+    self.assertEqual(path_list, [os.path.join(self.tmp, 'backup')])
+    self.assertEqual(entry, '%s 0 * * * %srun-backup\n' % (
+      minute, 'sleep %s && ' % delay if delay else ''))
+
+  def test_concurrency(self):
+    wrapper = os.path.join(self.tmp, 'backup-limited')
+    path_list, entry, script = self.install(**{
+      'concurrency-tag': 'backup',
+      'concurrency-limit': '2',
+      'concurrency-wrapper': wrapper,
+    })
+    self.assertEqual(path_list, [os.path.join(self.tmp, 'backup'), wrapper])
+    self.assertEqual(entry, '0 0 * * * %s\n' % wrapper)
+    script.assert_called_once_with(wrapper, 'slapos.recipe.dcron.limit',
+                                   ('/tmp', 'backup', 2, 'run-backup'))
+
+  def test_limit(self):
+    log = os.path.join(self.tmp, 'log')
+    command = ('echo start >> %s; while [ ! -e %s ]; do sleep .01; done;'
+               'echo end >> %s' % (log, os.path.join(self.tmp, 'gate'), log))
+    def run():
+      with self.assertRaises(SystemExit) as cm:
+        limit(self.tmp, 'test', 2, command, interval=.01)
+      self.assertEqual(cm.exception.code, 0)
+    thread_list = [threading.Thread(target=run) for _ in range(3)]
+    for thread in thread_list:
+      thread.daemon = True
+      thread.start()
+    def count():
+      with open(log) as f:
+        return f.read().split()
+    for _ in range(500):
+      if os.path.exists(log) and len(count()) == 2:
+        break
+      time.sleep(.01)
+    time.sleep(.1)
+    self.assertEqual(count(), ['start', 'start'])
+    open(os.path.join(self.tmp, 'gate'), 'w').close()
+    for thread in thread_list:
+      thread.join(10)
+      self.assertFalse(thread.is_alive())
+    self.assertEqual(sorted(count()), ['end'] * 3 + ['start'] * 3)
@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from slapos.recipe.equeue_server import EqueueServer
+
+
+class EqueueServerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.log = os.path.join(self.tmp, 'log')
+    self.gate = os.path.join(self.tmp, 'gate')
+    self.db = {}
+
+  def makeServer(self, **kw):
+    server = EqueueServer(os.path.join(self.tmp, 'sock'), self.db,
+                          logging.getLogger('equeue'),
+                          os.path.join(self.tmp, 'equeue.lock'),
+                          stats_file=os.path.join(self.tmp, 'stats.json'),
+                          **kw)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.addCleanup(server.server_close)
+    self.addCleanup(server.shutdown)
+    return server
+
+  def makeCommand(self, name, wait=False):
+    path = os.path.join(self.tmp, name)
+    with open(path, 'w') as f:
+      f.write('#!/bin/sh\n%secho %s >> %s\n' % (
+        'while [ ! -e %s ]; do sleep .01; done\n' % self.gate if wait else '',
+        name, self.log))
+    os.chmod(path, 0o700)
+    return path
+
+  def send(self, command, timestamp):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.connect(os.path.join(self.tmp, 'sock'))
+    s.sendall(json.dumps({'command': command,
+                          'timestamp': timestamp}).encode())
+    s.shutdown(socket.SHUT_WR)
+    self.assertEqual(s.recv(len(command) + 1).decode(), command)
+    s.close()
+
+  def waitFor(self, server, condition, timeout=30):
+    deadline = time.time() + timeout
+    while True:
+      with server.condition:
+        if condition():
+          return
+      if time.time() > deadline:
+        self.fail('timeout')
+      time.sleep(.01)
+
+  def waitForPath(self, path, timeout=30):
+    deadline = time.time() + timeout
+    while not os.path.exists(path):
+      if time.time() > deadline:
+        self.fail('timeout waiting for %s' % path)
+      time.sleep(.01)
+
+  def wait(self, server, processed):
+    self.waitFor(server, lambda: server.stats['processed'] >= processed
+                 and not server.queue and not server.running_set)
+
+  def stats(self):
+    with open(os.path.join(self.tmp, 'stats.json')) as f:
+      return json.load(f)
+
+  def ran(self):
+    with open(self.log) as f:
+      return f.read().split()
+
+  def test_priority(self):
+    slow = self.makeCommand('slow', wait=True)
+    server = self.makeServer(priority_list=[(10, '*/import*')])
+    self.send(slow, 1)
+    self.waitFor(server, lambda: server.running_set)
+    self.assertTrue(os.path.exists(os.path.join(self.tmp, 'equeue.lock')))
+    self.send(self.makeCommand('import'), 1)
+    self.send(self.makeCommand('notify'), 1)
+    self.waitFor(server, lambda: len(server.queue) == 2)
+    # identical pending command
+    self.send(self.makeCommand('notify'), 2)
+    self.waitFor(server, lambda: server.stats['deduplicated'])
+    stats = self.stats()
+    self.assertEqual((stats['pending'], stats['running']), (2, 1))
+    self.assertEqual(stats['pending-by-priority'], {'0': 1, '10': 1})
+    self.assertEqual(stats['deduplicated'], 1)
+    open(self.gate, 'w').close()
+    self.wait(server, 3)
+    self.assertEqual(self.ran(), ['slow', 'notify', 'import'])
+    self.assertEqual(self.db[os.path.join(self.tmp, 'notify')], '2')
+    self.assertFalse(os.path.exists(os.path.join(self.tmp, 'equeue.lock')))
+    # already run
+    self.send(os.path.join(self.tmp, 'notify'), 2)
+    self.wait(server, 4)
+    stats = self.stats()
+    self.assertEqual((stats['processed'], stats['skipped'], stats['pending']),
+                     (4, 1, 0))
+    self.assertGreater(stats['max-wait'], 0)
+
+  def test_workers(self):
+    slow = self.makeCommand('slow', wait=True)
+    server = self.makeServer(workers=2)
+    self.send(slow, 1)
+    self.waitFor(server, lambda: server.running_set)
+    self.send(slow + '\0arg', 2) # same executable: not in parallel
+    self.send(self.makeCommand('other'), 1)
+    self.waitFor(server, lambda: server.stats['processed'] == 2
+                 and len(server.running_set) == 1)
+    self.assertEqual(self.ran(), ['other'])
+    self.assertEqual(self.stats()['running'], 1)
+    open(self.gate, 'w').close()
+    self.wait(server, 3)
+    self.assertEqual(self.ran(), ['other', 'slow', 'slow'])
+
+
+  def test_main(self):
+    # gdbm is replaced by a dict, and commands are run in their own process
+    # group, which is killed by the server when it exits.
+    sock = os.path.join(self.tmp, 'sock')
+    pid_file = os.path.join(self.tmp, 'pid')
+    command = os.path.join(self.tmp, 'command')
+    with open(command, 'w') as f:
+      f.write('#!/bin/sh\necho $$ > %s.tmp\nmv %s.tmp %s\nexec sleep 60\n'
+              % (pid_file, pid_file, pid_file))
+    os.chmod(command, 0o700)
+    server = subprocess.Popen((sys.executable, '-c',
+      'import sys, types;'
+      ' sys.modules["dbm.gnu"] = sys.modules["gdbm"] ='
+      ' types.ModuleType("gdbm");'
+      ' sys.modules["gdbm"].open = lambda *args: {};'
+      ' from slapos.recipe.equeue_server import main;'
+      ' main(*sys.argv[1:])',
+      sock, os.path.join(self.tmp, 'db'), self.log,
+      os.path.join(self.tmp, 'equeue.lock')), preexec_fn=os.setsid)
+    try:
+      self.waitForPath(sock)
+      # the log file is reopened after rotation
+      os.rename(self.log, self.log + '.1')
+      self.send(command, 1)
+      self.waitForPath(pid_file)
+      with open(pid_file) as f:
+        pid = int(f.read())
+    finally:
+      server.send_signal(signal.SIGTERM)
+      self.assertEqual(server.wait(), -signal.SIGKILL)
+    self.assertFalse(os.path.exists(sock))
+    try:
+      with open('/proc/%s/stat' % pid) as f:
+        state = f.read().rsplit(')', 1)[1].split()[0]
+    except IOError:
+      pass
+    else:
+      self.assertEqual(state, 'Z') # not reaped yet
+    with open(self.log + '.1') as f:
+      self.assertIn('Starting server on %r' % sock, f.read())
+    with open(self.log) as f:
+      self.assertIn('New command %r at 1' % command, f.read())
+
+
+if __name__ == '__main__':
+  unittest.main()
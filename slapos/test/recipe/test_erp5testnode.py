@@ -15,6 +15,9 @@ class UserInfoTest(unittest.TestCase):
 
     self.get_temp_path = functools.partial(os.path.join, self.tmp_dir)
 
+    # zc.buildout.testing.Buildout runs in the current directory
+    self.addCleanup(os.chdir, os.getcwd())
+    os.chdir(self.tmp_dir)
     self.buildout = buildout = zc.buildout.testing.Buildout()
     buildout['slap-connection'] = {
         'computer-id': 'computer-id',
@@ -0,0 +1,142 @@
+import hashlib
+import importlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+# slapos.recipe.librecipe.filehash is also the name of a function
+filehash = importlib.import_module('slapos.recipe.librecipe.filehash')
+
+
+class DirHashTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.tree = os.path.join(self.tmp, 'tree')
+    self.manifest = os.path.join(self.tmp, 'manifest.json')
+    os.makedirs(os.path.join(self.tree, 'a', 'b'))
+    self.write('a/b/c', b'c' * 3000000)
+    self.write('a/d', b'\xff\x00binary')
+    self.write('e', b'')
+    os.symlink('missing', os.path.join(self.tree, 'broken'))
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def write(self, name, content):
+    with open(os.path.join(self.tree, name), 'wb') as f:
+      f.write(content)
+
+  def dirhash(self):
+    with patch.object(filehash, '_hashfile',
+                      side_effect=filehash._hashfile) as _hashfile:
+      digest = filehash.dirhash(self.tree, manifest=self.manifest)
+    self.assertEqual(digest, filehash.dirhash(self.tree))
+    return digest, sorted(os.path.relpath(call[0][0], self.tree)
+                          for call in _hashfile.call_args_list)
+
+  def test_incremental(self):
+    digest, hashed = self.dirhash()
+    self.assertEqual(hashed, ['a/b/c', 'a/d', 'e'])
+    self.assertEqual(self.dirhash(), (digest, []))
+
+    self.write('a/d', b'modified')
+    modified, hashed = self.dirhash()
+    self.assertNotEqual(modified, digest)
+    self.assertEqual(hashed, ['a/d'])
+
+    os.remove(os.path.join(self.tree, 'e'))
+    removed, hashed = self.dirhash()
+    self.assertNotIn(removed, (digest, modified))
+    self.assertEqual(hashed, [])
+
+  def test_manifest_type(self):
+    self.dirhash()
+    with patch.object(filehash, '_hashfile',
+                      side_effect=filehash._hashfile) as _hashfile:
+      filehash.dirhash(self.tree, 'md5', self.manifest)
+    self.assertEqual(_hashfile.call_count, 3)
+
+  def test_structure(self):
+    digest = filehash.dirhash(self.tree)
+    os.rename(os.path.join(self.tree, 'e'), os.path.join(self.tree, 'f'))
+    self.assertNotEqual(filehash.dirhash(self.tree), digest)
+
+  def test_main(self):
+    with patch.object(filehash, 'print', create=True) as print_:
+      filehash.main(['-m', self.manifest, 'md5', self.tree])
+    print_.assert_called_once_with(self.tree, '-',
+                                   filehash.dirhash(self.tree, 'md5'))
+    self.assertTrue(os.path.exists(self.manifest))
+    with patch.object(filehash, '_hashfile') as _hashfile, \
+         patch.object(filehash, 'print', create=True) as print_:
+      filehash.main(['--manifest', self.manifest, '-j', '2', 'md5', self.tree])
+    _hashfile.assert_not_called()
+    with patch.object(filehash, 'print', create=True) as print_:
+      filehash.main([self.tree])
+    print_.assert_called_once_with(self.tree, '-', filehash.dirhash(self.tree))
+
+  def test_filehash(self):
+    self.assertEqual(filehash.pathhash(os.path.join(self.tree, 'a', 'd'), 'md5'),
+                     '1977190847c4801022b2dbeb55f53e03')
+
+
+class HashFromFilesTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.file_list = [os.path.join(self.tmp, x) for x in 'ab']
+    for i, path in enumerate(self.file_list):
+      with open(path, 'wb') as f:
+        f.write(b'x' * (i * 3000000))
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def digest(self, *content_list):
+    return hashlib.md5(b''.join(b'%u\n' % len(content)
+                                + hashlib.md5(content).digest()
+                                for content in content_list)).hexdigest()
+
+  def test_cache(self):
+    stats = filehash.hash_from_files_stats
+    read = stats['read']
+    expected = self.digest(b'', b'x' * 3000000)
+    self.assertEqual(filehash.generateHashFromFiles(self.file_list), expected)
+    self.assertEqual(filehash.generateHashFromFiles(self.file_list), expected)
+    self.assertEqual(stats['read'], read + 2)
+    # Files are cached individually, so overlapping lists share digests...
+    self.assertEqual(filehash.generateHashFromFiles(self.file_list[:1]),
+                     self.digest(b''))
+    self.assertEqual(filehash.generateHashFromFiles(self.file_list[::-1]),
+                     self.digest(b'x' * 3000000, b''))
+    self.assertEqual(stats['read'], read + 2)
+    # ... and only modified files are read again.
+    with open(self.file_list[0], 'wb') as f:
+      f.write(b'!')
+    self.assertEqual(filehash.generateHashFromFiles(self.file_list),
+                     self.digest(b'!', b'x' * 3000000))
+    self.assertEqual(stats['read'], read + 3)
+
+  @unittest.skipUnless(hasattr(os.stat_result, 'st_mtime_ns'),
+                       "no nanosecond timestamps")
+  def test_cache_mtime_ns(self):
+    # Rewritten in place within the same second, with the same size:
+    # only the nanoseconds of mtime differ, which float mtime can't see.
+    path = self.file_list[:1]
+    mtime_ns = 1700000000 * 10**9
+    with open(path[0], 'wb') as f:
+      f.write(b'a')
+    os.utime(path[0], ns=(mtime_ns, mtime_ns + 10))
+    self.assertEqual(filehash.generateHashFromFiles(path), self.digest(b'a'))
+    with open(path[0], 'r+b') as f:
+      f.write(b'b')
+    os.utime(path[0], ns=(mtime_ns, mtime_ns + 50))
+    self.assertEqual(filehash.generateHashFromFiles(path), self.digest(b'b'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,5 +1,9 @@
+import json
+import multiprocessing
+import os
+import shutil
 import socket
-import sys
+import tempfile
 import unittest
 
 from mock import patch
@@ -61,5 +65,91 @@ class FreePortTest(unittest.TestCase):
     self.assertEqual(recipe.options['port'], '0')
 
 
+def allocate(args):
+  from slapos.recipe.free_port import PortRegistry
+  directory, worker, count = args
+  registry = PortRegistry(directory)
+  is_free = lambda port: True
+  return [registry.allocate('partition%s section%s' % (worker, i),
+                            20000, 20000 + count * 8, is_free)
+          for i in range(count)]
+
+class PortRegistryTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.directory = os.path.join(self.tmp, 'registry')
+    self.path = os.path.join(self.directory, 'slapos-free-port.json')
+
+  def test_allocate(self):
+    from slapos.recipe.free_port import PortRegistry
+    registry = PortRegistry(self.directory)
+    busy = set([2001])
+    is_free = lambda port: port not in busy
+    checked = []
+    def check(port):
+      checked.append(port)
+      return is_free(port)
+    self.assertEqual(registry.allocate('a', 2000, 2005, check), 2000)
+    self.assertEqual(registry.allocate('b', 2000, 2005, check), 2002)
+    self.assertEqual(checked, [2000, 2001, 2002])
+    # Stable, with a single check.
+    del checked[:]
+    self.assertEqual(registry.allocate('a', 2000, 2005, check), 2000)
+    self.assertEqual(checked, [2000])
+    # Reallocated if not free any more, and not to an allocated port.
+    busy.add(2000)
+    self.assertEqual(registry.allocate('a', 2000, 2005, is_free), 2003)
+    self.assertEqual(registry.allocate('c', 2000, 2005, is_free), 2004)
+    busy.remove(2000)
+    self.assertEqual(registry.allocate('d', 2000, 2005, is_free), 2000)
+    self.assertEqual(registry.allocate('e', 2000, 2005, is_free), 0)
+    # Other range
+    self.assertEqual(registry.allocate('a', 3000, 3005, is_free), 3000)
+    with open(self.path) as f:
+      self.assertEqual(json.load(f)['allocated'], {
+        'a': 3000, 'b': 2002, 'c': 2004, 'd': 2000})
+
+  def test_recipe(self):
+    from slapos.recipe import free_port
+    buildout = {
+      'buildout': {'directory': '/srv/slapgrid/slappart3',
+                   'installed': os.path.join(self.tmp, '.installed.cfg')},
+    }
+    def new_recipe(name):
+      return free_port.Recipe(buildout, name, {
+        'ip': '127.0.0.1',
+        'minimum': '2000',
+        'maximum': '3000',
+        'registry-directory': self.directory,
+      })
+    with patch.object(free_port.Recipe, '_isFree', lambda self, port: True):
+      self.assertEqual(new_recipe('a').options['port'], '2000')
+      self.assertEqual(new_recipe('b').options['port'], '2001')
+      self.assertEqual(new_recipe('a').options['port'], '2000')
+    with open(self.path) as f:
+      self.assertEqual(json.load(f)['allocated'], {
+        '/srv/slapgrid/slappart3 a': 2000,
+        '/srv/slapgrid/slappart3 b': 2001})
+
+  def test_stress(self):
+    # Concurrent allocations by several processes never give the same port.
+    workers = 8
+    count = 50
+    pool = multiprocessing.Pool(workers)
+    try:
+      result = pool.map(allocate, [(self.directory, worker, count)
+                                   for worker in range(workers)])
+    finally:
+      pool.close()
+      pool.join()
+    port_list = [port for x in result for port in x]
+    self.assertNotIn(0, port_list)
+    self.assertEqual(len(set(port_list)), workers * count)
+    # Allocations are stable.
+    self.assertEqual(allocate((self.directory, 3, count)), result[3])
+
+
 if __name__ == '__main__':
   unittest.main()
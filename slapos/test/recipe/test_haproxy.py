@@ -0,0 +1,226 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import mock
+from six.moves import socketserver
+from six.moves.urllib.request import urlopen
+
+from slapos.recipe import haproxy
+from slapos.recipe.haproxy import haproxy as stats
+from slapos.test.utils import makeRecipe
+
+STAT = '''\
+# pxname,svname,qcur,qmax,scur,smax,slim,stot,status,rate,rtime,
+front,FRONTEND,,,3,10,2000,100,OPEN,2,,
+default,default_1,0,0,1,1,1,20,UP,1,120,
+default,default_2,0,0,1,1,1,20,DOWN,1,80,
+default,BACKEND,%s,5,2,2,200,40,UP,%s,%s,
+'''
+INFO = '''\
+Name: HAProxy
+Version: 1.8.8
+Uptime_sec: 42
+CurrConns: 3
+Pid: 1234
+'''
+
+
+class HaproxyTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+
+  def install(self, **options):
+    p = lambda x: os.path.join(self.tmp, x)
+    options.update({
+      'name': 'haproxy',
+      'ip': '10.0.0.1',
+      'maxconn': '1',
+      'conf-path': p('haproxy.cfg'),
+      'wrapper-path': p('haproxy'),
+      'ctl-path': p('haproxyctl'),
+      'socket-path': p('haproxy.sock'),
+      'binary-path': '/bin/haproxy',
+      'server-check-path': '/check',
+    })
+    recipe = makeRecipe(haproxy.Recipe, options, name='haproxy')
+    with mock.patch.object(recipe, 'createPythonScript',
+                           side_effect=lambda path, *args: path) as script:
+      self.path_list = recipe.install()
+    self.script = script
+    with open(p('haproxy.cfg')) as f:
+      return f.read()
+
+  def test_backend_list(self):
+    conf = self.install(**{'port': '8080',
+                           'backend-list': '10.0.0.2:2200 10.0.0.3:2200'})
+    self.assertIn('listen haproxy\n  bind 10.0.0.1:8080\n', conf)
+    self.assertIn('  option httpchk GET /check\n  \n', conf)
+    self.assertIn(
+      '  server haproxy_1 10.0.0.2:2200 cookie haproxy_d86786b3b0 check inter 3s'
+      ' rise 1 fall 2 maxqueue 5 maxconn 1\n'
+      '  server haproxy_2 10.0.0.3:2200 cookie haproxy_737a3a4a42 check inter 3s'
+      ' rise 1 fall 2 maxqueue 5 maxconn 1\n', conf)
+
+  def test_backend_dict(self):
+    conf = self.install(**{
+      'timeout-queue': '30s',
+      'backend-dict': {
+        'default': (2000, ['10.0.0.2:2200']),
+        'activities': (2001, ['10.0.0.3:2200', '10.0.0.4:2200'], {
+          'maxconn': 4,
+          'timeout-queue': '5m',
+          'check-interval': '10s',
+        }),
+      },
+    })
+    self.assertIn(
+      'listen activities\n  bind 10.0.0.1:2001\n'
+      '  cookie  SERVERID insert\n  balance roundrobin\n'
+      '  option httpchk GET /check\n  timeout queue 5m\n', conf)
+    self.assertIn(
+      '  server activities_1 10.0.0.3:2200 cookie activities_737a3a4a42'
+      ' check inter 10s rise 1 fall 2 maxqueue 5 maxconn 4\n'
+      '  server activities_2 10.0.0.4:2200 cookie activities_c738a46e28'
+      ' check inter 10s rise 1 fall 2 maxqueue 5 maxconn 4\n'
+      'listen default\n  bind 10.0.0.1:2000\n', conf)
+    self.assertIn('  option httpchk GET /check\n  timeout queue 30s\n'
+      '  stats uri /haproxy\n  stats realm Global\\ statistics\n'
+      '  server default_3 10.0.0.2:2200 cookie default_d86786b3b0'
+      ' check inter 3s rise 1 fall 2 maxqueue 5 maxconn 1\n', conf)
+
+  def test_cookie(self):
+    # Adding a backend renumbers the servers, not their cookies.
+    backend_dict = {'default': (2000, ['10.0.0.2:2200'])}
+    conf = self.install(**{'backend-dict': backend_dict})
+    self.assertIn('  server default_1 10.0.0.2:2200'
+                  ' cookie default_d86786b3b0 ', conf)
+    backend_dict['activities'] = (2001, ['10.0.0.3:2200'])
+    conf = self.install(**{'backend-dict': backend_dict})
+    self.assertIn('  server default_2 10.0.0.2:2200'
+                  ' cookie default_d86786b3b0 ', conf)
+
+  def test_stats_exporter(self):
+    self.install(**{'port': '8080', 'backend-list': '10.0.0.2:2200',
+                    'stats-exporter-path': os.path.join(self.tmp, 'exporter'),
+                    'stats-exporter-port': '9100'})
+    self.assertEqual(self.path_list[3], os.path.join(self.tmp, 'exporter'))
+    self.script.assert_called_with(
+      os.path.join(self.tmp, 'exporter'),
+      'slapos.recipe.haproxy.haproxy.exporter',
+      (os.path.join(self.tmp, 'haproxy.sock'), '10.0.0.1', 9100, 10., 60))
+
+
+class StatsExporterTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.socket_path = os.path.join(self.tmp, 'haproxy.sock')
+    self.sample = 0, 0, 0
+    test = self
+    class Handler(socketserver.StreamRequestHandler):
+      def handle(self):
+        command = self.rfile.readline().strip()
+        if command == b'show stat':
+          self.wfile.write((STAT % test.sample).encode())
+        elif command == b'show info':
+          self.wfile.write(INFO.encode())
+    self.haproxy = socketserver.ThreadingUnixStreamServer(
+      self.socket_path, Handler)
+    thread = threading.Thread(target=self.haproxy.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.addCleanup(self.haproxy.server_close)
+    self.addCleanup(self.haproxy.shutdown)
+
+  def test_collector(self):
+    collector = stats.StatsCollector(self.socket_path, window=4)
+    self.assertEqual(collector.getSnapshot()['backends'], {})
+    for sample in (1, 10, 100), (3, 20, 400), (0, 30, 200), (2, 40, 300), \
+                  (4, 50, 500):
+      self.sample = sample
+      collector.poll()
+    snapshot = collector.getSnapshot()
+    self.assertIsNone(snapshot['error'])
+    self.assertEqual(snapshot['info'], {'Name': 'HAProxy', 'Version': '1.8.8',
+                                        'Uptime_sec': '42', 'CurrConns': '3'})
+    self.assertEqual(snapshot['backends'], {'default': {
+      'status': 'UP',
+      'sessions-current': 2,
+      'sessions-total': 40,
+      'queue-current': 4,
+      'queue-max': 4,
+      'queue-average': 2.25,
+      'session-rate-current': 50,
+      'session-rate-average': 35.,
+      'response-time-current': 500,
+      'response-time-p50': 300,
+      'response-time-p90': 500,
+      'response-time-p99': 500,
+      'servers-up': 1,
+      'samples': 4,
+    }})
+
+    metrics = stats.prometheus(snapshot)
+    self.assertIn('# TYPE haproxy_backend_queue_current gauge\n'
+                  'haproxy_backend_queue_current{backend="default"} 4\n',
+                  metrics)
+    self.assertIn('haproxy_backend_response_time_milliseconds'
+                  '{backend="default",quantile="0.9"} 500\n', metrics)
+    self.assertTrue(metrics.endswith('haproxy_up 1\n'))
+
+    # haproxy is down: last stats are kept
+    self.haproxy.shutdown()
+    self.haproxy.server_close()
+    os.remove(self.socket_path)
+    collector.poll()
+    snapshot = collector.getSnapshot()
+    self.assertTrue(snapshot['error'])
+    self.assertEqual(snapshot['backends']['default']['samples'], 4)
+    self.assertTrue(stats.prometheus(snapshot).endswith('haproxy_up 0\n'))
+
+  def test_run(self):
+    # An unexpected error is reported, and polling goes on.
+    collector = stats.StatsCollector(self.socket_path)
+    class Stop(Exception):
+      pass
+    snapshot_list = []
+    def sleep(interval):
+      snapshot_list.append(collector.getSnapshot())
+      if len(snapshot_list) == 3:
+        raise Stop
+    with mock.patch.object(stats, 'parse_info',
+                           side_effect=[{}, KeyError('x'), {}]), \
+         mock.patch.object(stats.logger, 'exception') as exception, \
+         mock.patch('time.sleep', side_effect=sleep):
+      self.assertRaises(Stop, collector.run, 10)
+    exception.assert_called_once()
+    self.assertEqual([x['error'] for x in snapshot_list],
+                     [None, repr(KeyError('x')), None])
+    self.assertEqual(snapshot_list[1]['backends'],
+                     snapshot_list[0]['backends'])
+    self.assertTrue(stats.prometheus(snapshot_list[1]).endswith(
+      'haproxy_up 0\n'))
+
+  def test_server(self):
+    collector = stats.StatsCollector(self.socket_path)
+    self.sample = 1, 2, 3
+    collector.poll()
+    server = stats.StatsServer(('127.0.0.1', 0), collector)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.addCleanup(server.server_close)
+    self.addCleanup(server.shutdown)
+    url = 'http://127.0.0.1:%s' % server.server_address[1]
+    result = json.loads(urlopen(url + '/stats.json').read().decode())
+    self.assertEqual(result['backends']['default']['queue-current'], 1)
+    result = urlopen(url + '/metrics').read().decode()
+    self.assertIn('haproxy_backend_session_rate{backend="default"} 2\n',
+                  result)
@@ -0,0 +1,46 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from slapos.recipe import jsondump
+from slapos.test.utils import makeRecipe
+
+
+class JsonDumpTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.output = os.path.join(self.tmp, 'output.json')
+
+  def makeRecipe(self, **kw):
+    options = {
+      'recipe': 'slapos.cookbook:jsondump',
+      'json-output': self.output,
+      'json-diff': self.output + '.diff',
+    }
+    options.update(kw)
+    return makeRecipe(jsondump.Recipe, options)
+
+  def test_install(self):
+    recipe = self.makeRecipe(foo='1', bar='2')
+    fingerprint = recipe.options['json-fingerprint']
+    self.assertEqual(recipe.install(), [self.output])
+    with open(self.output) as f:
+      self.assertEqual(json.load(f), {'foo': '1', 'bar': '2'})
+    mtime = os.stat(self.output).st_mtime_ns
+    recipe = self.makeRecipe(bar='2', foo='1')
+    self.assertEqual(recipe.options['json-fingerprint'], fingerprint)
+    recipe.install()
+    self.assertEqual(os.stat(self.output).st_mtime_ns, mtime)
+    recipe = self.makeRecipe(bar='3')
+    self.assertNotEqual(recipe.options['json-fingerprint'], fingerprint)
+    recipe.install()
+    with open(self.output + '.diff') as f:
+      self.assertEqual(f.read(), '~ bar\n- foo\n')
+
+
+if __name__ == '__main__':
+  unittest.main()
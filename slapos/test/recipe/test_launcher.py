@@ -0,0 +1,140 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from slapos.recipe.librecipe import GenericBaseRecipe
+from slapos.test.utils import makeRecipe
+
+
+def unshare_permitted():
+  try:
+    return not subprocess.call(('unshare', '-Urm', 'true'),
+                               stderr=subprocess.STDOUT)
+  except OSError: # no unshare command
+    return False
+
+
+class LauncherTest(unittest.TestCase):
+  """Check the behaviour of wrappers embedding librecipe.launcher"""
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.recipe = makeRecipe(GenericBaseRecipe, {})
+    self.path = os.path.join(self.tmp, 'wrapper')
+
+  def createWrapper(self, args, env=None, **kw):
+    path = self.recipe.createWrapper(self.path, args, env, **kw)
+    with open(path) as f:
+      self.assertIn('generic_exec(', f.read())
+    return path
+
+  def waitFor(self, condition, timeout=30):
+    deadline = time.time() + timeout
+    while not condition():
+      if time.time() > deadline:
+        self.fail('timeout')
+      time.sleep(.01)
+
+  def test_args_env(self):
+    wrapper = self.createWrapper(
+      ['/bin/sh', '-c', 'echo "$FOO" "$@"', 'sh', 'a b'], {'FOO': 'bar'},
+      pidfile=os.path.join(self.tmp, 'pid'))
+    self.assertEqual(subprocess.check_output((wrapper, 'c', 'd e')),
+                     b'bar a b c d e\n')
+
+  def test_pidfile(self):
+    pidfile = os.path.join(self.tmp, 'pid')
+    wrapper = self.createWrapper(['/bin/sleep', '60'], pidfile=pidfile)
+    process = subprocess.Popen((wrapper,))
+    self.addCleanup(process.wait)
+    self.addCleanup(process.kill)
+    def running():
+      try:
+        with open('/proc/%s/cmdline' % process.pid, 'rb') as f:
+          return f.read() == b'/bin/sleep\x0060\x00'
+      except IOError:
+        return False
+    self.waitFor(running)
+    with open(pidfile) as f:
+      self.assertEqual(int(f.read()), process.pid)
+    second = subprocess.Popen((wrapper,), stderr=subprocess.PIPE)
+    _, err = second.communicate()
+    self.assertEqual(second.returncode, 1)
+    self.assertEqual(err.decode(),
+                     'Already running with pid %s.\n' % process.pid)
+    # Once the process is gone, the pidfile does not prevent a new start.
+    process.kill()
+    process.wait()
+    wrapper = self.createWrapper(['/bin/true'], pidfile=pidfile)
+    self.assertEqual(subprocess.call((wrapper,)), 0)
+
+  def test_wait_list(self):
+    path = os.path.join(self.tmp, 'subdir', 'file')
+    os.mkdir(os.path.dirname(path))
+    wrapper = self.createWrapper(['/bin/echo', 'started'], wait_list=[path])
+    process = subprocess.Popen((wrapper,), stdout=subprocess.PIPE)
+    self.addCleanup(process.stdout.close)
+    time.sleep(.5)
+    self.assertIsNone(process.poll())
+    # A file created next to the awaited one does not unblock.
+    open(path + '.tmp', 'w').close()
+    time.sleep(.5)
+    self.assertIsNone(process.poll())
+    os.rename(path + '.tmp', path)
+    self.waitFor(lambda: process.poll() is not None)
+    self.assertEqual(process.returncode, 0)
+    self.assertEqual(process.stdout.read(), b'started\n')
+
+  def test_reserve_cpu(self):
+    wrapper = self.createWrapper(['/bin/true'], reserve_cpu=True)
+    env = dict(os.environ, HOME=self.tmp)
+    process = subprocess.Popen((wrapper,), env=env)
+    self.assertEqual(process.wait(), 0)
+    with open(os.path.join(self.tmp, '.slapos-cpu-exclusive')) as f:
+      self.assertEqual(f.read(), '%s\n' % process.pid)
+
+  @unittest.skipUnless(unshare_permitted(), 'user namespaces not permitted')
+  def test_private_tmpfs(self):
+    path = os.path.join(self.tmp, 'private')
+    wrapper = self.createWrapper(
+      ['/bin/sh', '-c', 'stat -f -c %T "$0" && touch "$0/file"', path],
+      private_tmpfs=[('1M', path)])
+    self.assertEqual(subprocess.check_output((wrapper,)), b'tmpfs\n')
+    self.assertEqual(os.listdir(path), [])
+
+  def test_private_tmpfs_not_permitted(self):
+    # Run generic_exec in a process where unshare(2) fails like in a
+    # container without user namespaces.
+    path = os.path.join(self.tmp, 'private')
+    code = """if 1:
+      import errno, sys
+      from slapos.recipe.librecipe import launcher
+      class libc(object):
+        pass
+      def unshare(flags):
+        import ctypes
+        ctypes.set_errno(errno.EPERM)
+        return -1
+      def mount(*args):
+        raise AssertionError
+      libc = libc()
+      libc.unshare = unshare
+      libc.mount = mount
+      launcher._libc = lambda: libc
+      launcher.generic_exec(%r, private_tmpfs=[('1M', %r)])
+    """ % (['/bin/sh', '-c', 'touch "$0/file"', path], path)
+    process = subprocess.Popen((sys.executable, '-c', code),
+                               stderr=subprocess.PIPE)
+    _, err = process.communicate()
+    self.assertEqual(process.returncode, 0, err)
+    self.assertIn(b'private_tmpfs not permitted', err)
+    self.assertEqual(os.listdir(path), ['file'])
+
+
+if __name__ == '__main__':
+  unittest.main()
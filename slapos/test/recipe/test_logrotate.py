@@ -0,0 +1,124 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+import mock
+
+from slapos.recipe import logrotate
+from slapos.test.utils import makeRecipe
+
+
+class LogrotateTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.entries = os.path.join(self.tmp, 'logrotate.d')
+    os.mkdir(self.entries)
+
+  def install(self, **options):
+    options.update({
+      'logrotate-entries': self.entries,
+      'conf': os.path.join(self.tmp, 'logrotate.conf'),
+      'state-file': os.path.join(self.tmp, 'logrotate.status'),
+      'wrapper': os.path.join(self.tmp, 'logrotate'),
+      'logrotate-binary': '/bin/logrotate',
+      'gzip-binary': '/bin/gzip',
+      'gunzip-binary': '/bin/gunzip',
+    })
+    recipe = makeRecipe(logrotate.Recipe, options, name='logrotate')
+    with mock.patch.object(recipe, 'createPythonScript',
+                           side_effect=lambda path, *args: path) as script:
+      recipe.install()
+    with open(options['conf']) as f:
+      return f.read().splitlines(), script
+
+  def test_default(self):
+    conf, script = self.install()
+    self.assertEqual(conf, [
+      'compresscmd /bin/gzip',
+      'compressoptions -9',
+      'compressext .gz',
+      'uncompresscmd /bin/gunzip',
+      'include ' + self.entries,
+    ])
+    script.assert_not_called()
+
+  def test_codec(self):
+    def check(options, compress_options, extension):
+      conf, _ = self.install(**options)
+      self.assertEqual(conf[:4], [
+        'compresscmd /bin/compress',
+        'compressoptions ' + compress_options,
+        'compressext ' + extension,
+        'uncompresscmd /bin/uncompress',
+      ])
+    binaries = {'compress-binary': '/bin/compress',
+                'uncompress-binary': '/bin/uncompress'}
+    check(dict(binaries, **{'compress-codec': 'zstd'}), '-3 -T0', '.zst')
+    check(dict(binaries, **{'compress-codec': 'xz', 'compress-level': '9',
+                            'compress-threads': '4'}), '-9 -T4', '.xz')
+    check(dict(binaries, **{'compress-codec': 'pigz'}), '-9', '.gz')
+    check(dict(binaries, **{'compress-codec': 'pigz',
+                            'compress-threads': '2'}), '-9 -p 2', '.gz')
+    check(dict(binaries, **{'compress-codec': 'gzip',
+                            'compress-level': '6'}), '-6', '.gz')
+
+  def test_parallel(self):
+    conf, script = self.install(parallel='4')
+    self.assertNotIn('include ' + self.entries, conf)
+    script.assert_called_once_with(
+      os.path.join(self.tmp, 'logrotate'), 'slapos.recipe.logrotate.run',
+      ('/bin/logrotate', os.path.join(self.tmp, 'logrotate.conf'),
+       self.entries, os.path.join(self.tmp, 'logrotate.status'), 4))
+
+  def test_run(self):
+    # fake logrotate writing its arguments to its state file
+    binary = os.path.join(self.tmp, 'fake-logrotate')
+    with open(binary, 'w') as f:
+      f.write('#!/bin/sh\necho "$@" >> "$3"\n'
+              '[ "${5##*/}" != killed ] || kill -9 $$\n'
+              '[ "${5##*/}" != failing ]\n')
+    os.chmod(binary, stat.S_IRWXU)
+    for name in 'apache', 'zope', 'failing', '.hidden', 'zope~':
+      open(os.path.join(self.entries, name), 'w').close()
+    state_file = os.path.join(self.tmp, 'logrotate.status')
+    with open(state_file, 'w') as f:
+      f.write('old state\n')
+    with mock.patch.object(sys, 'argv', ['logrotate', '-f']), \
+         self.assertRaises(SystemExit) as cm:
+      logrotate.run(binary, 'logrotate.conf', self.entries, state_file, 2)
+    self.assertEqual(cm.exception.code, 1)
+    state_d = state_file + '.d'
+    self.assertEqual(sorted(os.listdir(state_d)),
+                     ['apache', 'failing', 'zope'])
+    with open(os.path.join(state_d, 'zope')) as f:
+      self.assertEqual(f.read(), 'old state\n-f -s %s logrotate.conf %s\n' % (
+        os.path.join(state_d, 'zope'), os.path.join(self.entries, 'zope')))
+    # a logrotate killed by a signal is a failure too
+    os.remove(os.path.join(self.entries, 'failing'))
+    open(os.path.join(self.entries, 'killed'), 'w').close()
+    with mock.patch.object(sys, 'argv', ['logrotate', '-f']), \
+         self.assertRaises(SystemExit) as cm:
+      logrotate.run(binary, 'logrotate.conf', self.entries, state_file, 2)
+    self.assertEqual(cm.exception.code, 9)
+
+
+class PartTest(unittest.TestCase):
+
+  def test_rotate(self):
+    tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tmp)
+    recipe = makeRecipe(logrotate.Part, {
+      'logrotate-entries': tmp,
+      'backup': '/srv/backup',
+      'log': '/srv/log/*.log',
+      'name': 'apache',
+      'rotate': '30',
+    }, name='logrotate-entry-apache')
+    recipe.install()
+    with open(os.path.join(tmp, 'apache')) as f:
+      self.assertIn('\nrotate 30\n', f.read())
@@ -0,0 +1,239 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import mock
+
+from slapos.recipe import notifier_feed
+from slapos.recipe.notifier_feed import FeedStore
+
+# How the notifier of slapos.toolbox writes an item to its feed log
+NOTIFY = """\
+import csv, os, shutil, time, uuid
+def notify(log, title, content):
+  temp_file = log + '.tmp'
+  try:
+    shutil.copy2(log, temp_file)
+  except IOError:
+    pass
+  with open(temp_file, 'a') as file_:
+    csvfile = csv.writer(file_)
+    csvfile.writerow([
+      int(time.time()),
+      title,
+      content,
+      'slapos:%s' % uuid.uuid4(),
+    ])
+  os.rename(temp_file, log)
+"""
+exec(NOTIFY)
+
+
+class TestFeedStore(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.path = os.path.join(self.tmp, 'feed')
+
+  def test_append_latest(self):
+    store = FeedStore(self.path, 3)
+    self.assertEqual(store.latest(), [])
+    self.assertEqual(len(store), 0)
+    for i in range(5):
+      store.append(('item%s' % i).encode())
+    self.assertEqual(len(store), 3)
+    self.assertEqual(store.latest(), [b'item4', b'item3', b'item2'])
+    self.assertEqual(store.latest(1), [b'item4'])
+    self.assertEqual(store.latest(10), [b'item4', b'item3', b'item2'])
+    # The capacity is the one of the existing index.
+    self.assertEqual(FeedStore(self.path, 10).latest(),
+                     [b'item4', b'item3', b'item2'])
+
+  def test_compact(self):
+    store = FeedStore(self.path, 2)
+    item = b'x' * (notifier_feed.COMPACT_MIN_SIZE // 4)
+    for i in range(20):
+      store.append(b'%02d' % i + item)
+      self.assertLessEqual(
+        sum(os.path.getsize(os.path.join(self.tmp, x))
+            for x in os.listdir(self.tmp) if x.endswith('.segment')),
+        notifier_feed.COMPACT_MIN_SIZE + len(item) + 2)
+    self.assertEqual([x[:2] for x in store.latest()], [b'19', b'18'])
+    self.assertEqual(1, sum(x.endswith('.segment')
+                            for x in os.listdir(self.tmp)))
+
+  def test_migrate(self):
+    log = os.path.join(self.tmp, 'log')
+    for i in range(4):
+      notify(log, 'item%s' % i, 'multi\nline, "content"')
+    with open(log, 'rb') as f:
+      data = f.read()
+    item_list = notifier_feed.splitLog(data)
+    self.assertEqual(b''.join(item_list), data)
+    self.assertEqual(len(item_list), 4)
+    store = FeedStore(self.path, 3)
+    notifier_feed.migrate(log, store)
+    self.assertEqual(store.latest(), item_list[:0:-1])
+    # Items already in the store are not imported again.
+    notifier_feed.migrate(log, store)
+    self.assertEqual(store.latest(), item_list[:0:-1])
+    notify(log, 'item4', '')
+    notifier_feed.migrate(log, store)
+    self.assertEqual(store.latest()[1:], item_list[:1:-1])
+    self.assertIn(b',item4,', store.latest()[0])
+
+    store = FeedStore(os.path.join(self.tmp, 'missing'), 3)
+    notifier_feed.migrate(os.path.join(self.tmp, 'missing-log'), store)
+    self.assertTrue(store.exists())
+    self.assertEqual(store.latest(), [])
+
+  def test_run(self):
+    log = os.path.join(self.tmp, 'log')
+    published = os.path.join(self.tmp, 'published')
+    notify(log, 'old', 'old item')
+    # Like the notifier, run the executable, append the item, then fetch the
+    # feed and notify.
+    notifier = os.path.join(self.tmp, 'notifier')
+    with open(notifier, 'w') as f:
+      f.write('#!%s\n%s\n%s' % (sys.executable, NOTIFY, """
+import subprocess, sys
+status = sys.argv[-1]
+log = sys.argv[sys.argv.index('-l') + 1]
+executable = sys.argv[sys.argv.index('--executable') + 1]
+subprocess.call((executable,))
+notify(log, status, 'content')
+with open(log) as f:
+  feed = f.read()
+with open(%r, 'a') as f:
+  f.write('%%s %%s %%s\\n' %% (status, feed.count('slapos:'),
+                             ',%%s,content,' %% status in feed))
+sys.exit(status == 'fail')
+""" % published))
+    os.chmod(notifier, 0o700)
+    # The executable sees the bounded log.
+    executable = os.path.join(self.tmp, 'executable')
+    with open(executable, 'w') as f:
+      f.write('#!/bin/sh\ngrep -c slapos: %s >> %s.count\n' % (log, log))
+    os.chmod(executable, 0o700)
+    feed = os.path.join(self.tmp, 'feed-script')
+    with open(feed, 'w') as f:
+      f.write('#!%s\nfrom slapos.recipe.notifier_feed import run\n'
+              'run(%r, 3, %r, %r)\n' % (sys.executable, self.path, log,
+                                        executable))
+    os.chmod(feed, 0o700)
+    for status in 'a', 'b', 'fail', 'c':
+      self.assertEqual(subprocess.call((notifier, '-l', log,
+                                        '--executable', feed, status)),
+                       status == 'fail')
+    # The served feed has the new item when the notifier publishes it.
+    with open(published) as f:
+      self.assertEqual(f.read().splitlines(), [
+        'a 2 True', 'b 3 True', 'fail 3 True', 'c 3 True'])
+    with open(log + '.count') as f:
+      self.assertEqual(f.read().split(), ['1', '2', '2', '2'])
+    with open(log, 'rb') as f:
+      self.assertEqual([x.split(b',')[1] for x in
+                        notifier_feed.splitLog(f.read())],
+                       [b'b', b'fail', b'c'])
+    self.assertEqual([x.split(b',')[1] for x in FeedStore(self.path).latest()],
+                     [b'fail', b'b', b'a'])
+
+
+class TestNotify(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.feeds = os.path.join(self.tmp, 'feeds')
+    self.store_directory = os.path.join(self.tmp, 'feed-store')
+    os.mkdir(self.feeds)
+    os.mkdir(self.store_directory)
+    self.wrapper = os.path.join(self.tmp, 'notifier')
+
+  def makeRecipe(self, **options):
+    from slapos.recipe import notifier
+    from slapos.test.utils import makeRecipe
+    options = dict({
+      'feeds': self.feeds,
+      'name': 'test',
+      'notifier-binary': '/bin/notifier',
+      'wrapper': self.wrapper,
+      'executable': '/bin/true',
+      'title': 'Test',
+      'pidfile': os.path.join(self.tmp, 'pid'),
+      'notify': 'http://example.com/notify',
+      'host': 'localhost',
+      'port': '8080',
+      'feed-store-directory': self.store_directory,
+      'feed-max-items': '10',
+    }, **options)
+    return makeRecipe(notifier.Notify, options=options, name='notifier')
+
+  def test_install(self):
+    log = os.path.join(self.feeds, 'test')
+    notify(log, 'old', 'old item')
+    recipe = self.makeRecipe()
+    wrapper = self.wrapper
+    with mock.patch.object(recipe, 'createPythonScript',
+                           return_value=wrapper + '-feed') as script:
+      self.assertEqual(recipe.install(), [wrapper, wrapper + '-feed'])
+    script.assert_called_once_with(
+      wrapper + '-feed', 'slapos.recipe.notifier_feed.run',
+      (os.path.join(self.store_directory, 'test'), 10, log, '/bin/true'))
+    with open(wrapper) as f:
+      content = f.read()
+    self.assertIn(repr(['/bin/notifier', '-l'])[:-1], content)
+    self.assertIn(repr(['--executable', wrapper + '-feed'])[1:-1], content)
+    store = FeedStore(os.path.join(self.store_directory, 'test'), 10)
+    with open(log, 'rb') as f:
+      self.assertEqual(store.latest(), [f.read()])
+
+  def test_pidfile(self):
+    # The notifier runs the executable, which waits until it is told to
+    # exit, and 2 runs of the wrapper must not overlap (a second executable
+    # would exit at once).
+    notifier = os.path.join(self.tmp, 'notifier-binary')
+    with open(notifier, 'w') as f:
+      f.write('#!%s\nimport subprocess, sys\n'
+              'subprocess.call(sys.argv[sys.argv.index("--executable") + 1])\n'
+              % sys.executable)
+    os.chmod(notifier, 0o700)
+    started = os.path.join(self.tmp, 'started')
+    stop = os.path.join(self.tmp, 'stop')
+    executable = os.path.join(self.tmp, 'executable')
+    with open(executable, 'w') as f:
+      f.write('#!/bin/sh\n[ -e %s ] && exit\ntouch %s\n'
+              'while [ ! -e %s ]; do sleep .01; done\n'
+              % (started, started, stop))
+    os.chmod(executable, 0o700)
+    def createPythonScript(name, absolute_function, args):
+      module, function = absolute_function.rsplit('.', 1)
+      with open(name, 'w') as f:
+        f.write('#!%s\nfrom %s import %s\n%s%r\n' % (
+          sys.executable, module, function, function, args))
+      os.chmod(name, 0o700)
+      return name
+    recipe = self.makeRecipe(**{'notifier-binary': notifier,
+                                'executable': executable})
+    with mock.patch.object(recipe, 'createPythonScript',
+                           side_effect=createPythonScript):
+      recipe.install()
+    process = subprocess.Popen((self.wrapper,))
+    self.addCleanup(process.wait)
+    self.addCleanup(lambda: open(stop, 'w').close())
+    deadline = time.time() + 30
+    while not os.path.exists(started):
+      self.assertLess(time.time(), deadline, 'timeout')
+      time.sleep(.01)
+    second = subprocess.Popen((self.wrapper,), stderr=subprocess.PIPE)
+    _, err = second.communicate()
+    self.assertEqual(second.returncode, 1)
+    self.assertEqual(err.decode(),
+                     'Already running with pid %s.\n' % process.pid)
+    open(stop, 'w').close()
+    self.assertEqual(process.wait(), 0)
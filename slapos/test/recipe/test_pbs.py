@@ -1,10 +1,12 @@
 
+import json
 import os
 import shutil
 import sys
 import tempfile
 import unittest
 
+import mock
 import six
 
 
@@ -48,6 +50,37 @@ class PBSTest(unittest.TestCase):
             self.assertIn('TEST_LOCAL_DIR', content)
             self.assertIn('TEST_REMOTE_DIR', content)
             self.assertIn('--remove-older-than TEST_OLDER', content)
+            self.assertIn('JOURNAL=\'\'\n', content)
+            self.assertNotIn('--exclude', content)
+
+    def test_pull_journal(self):
+        recipe = self.new_recipe()
+
+        with tempfile.NamedTemporaryFile('w+') as rdiff_wrapper:
+            recipe.wrapper_pull(remote_schema='TEST_REMOTE_SCHEMA',
+                                local_dir='TEST_LOCAL_DIR',
+                                remote_dir='TEST_REMOTE_DIR',
+                                rdiff_wrapper_path=rdiff_wrapper.name,
+                                remove_backup_older_than='TEST_OLDER',
+                                journal='TEST_JOURNAL')
+            content = open(rdiff_wrapper.name, 'r').read()
+            self.assertIn('JOURNAL=TEST_JOURNAL\n', content)
+            self.assertIn('$JOURNAL check\n', content)
+            self.assertIn('$JOURNAL commit\n', content)
+
+    def test_pull_exclude_journal(self):
+        recipe = self.new_recipe()
+
+        with tempfile.NamedTemporaryFile('w+') as rdiff_wrapper:
+            recipe.wrapper_pull(remote_schema='TEST_REMOTE_SCHEMA',
+                                local_dir='TEST_LOCAL_DIR',
+                                remote_dir='2222::/srv/backup/',
+                                rdiff_wrapper_path=rdiff_wrapper.name,
+                                remove_backup_older_than='TEST_OLDER',
+                                journal='TEST_JOURNAL')
+            content = open(rdiff_wrapper.name, 'r').read()
+            self.assertIn('--exclude /srv/backup/.slapos-journal \\\n'
+                          '        2222::/srv/backup/ \\\n', content)
 
     def test_invalid_type(self):
         recipe = self.new_recipe()
@@ -131,3 +164,58 @@ class PBSTest(unittest.TestCase):
         shutil.rmtree(cron_directory)
 
 
+
+    def test_install_scheduler(self):
+        recipe = self.new_recipe()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        for name in ('promises', 'wrappers', 'directory', 'feeds', 'run',
+                     'cron'):
+            os.mkdir(os.path.join(tmp, name))
+        recipe.options.update({
+            'promises-directory': os.path.join(tmp, 'promises'),
+            'wrappers-directory': os.path.join(tmp, 'wrappers'),
+            'sshclient-binary': 'TEST_SSH_CLIENT',
+            'directory': os.path.join(tmp, 'directory'),
+            'notifier-binary': 'TEST_NOTIFIER',
+            'feeds': os.path.join(tmp, 'feeds'),
+            'notifier-url': 'http://url.to.notifier/',
+            'run-directory': os.path.join(tmp, 'run'),
+            'cron-entries': os.path.join(tmp, 'cron'),
+            'known-hosts': os.path.join(tmp, 'known_hosts'),
+            'scheduler': 'true',
+            'scheduler-wrapper': os.path.join(tmp, 'pbs-scheduler'),
+            'scheduler-max-concurrency': '2',
+            'slave-instance-list': [{
+                "url": "ssh://user@[::1]:%s/path" % port,
+                "type": type,
+                "notification-id": "%stest" % type,
+                "server-key": "TEST_SERVER_KEY",
+                "name": "%s_NAME" % type,
+                "notify": "http://url.to.notify/",
+                "frequency": "0 * * * *",
+            } for type, port in (('pull', 22), ('push', 23))],
+        })
+
+        with mock.patch.object(recipe, 'createPythonScript') as script:
+            recipe._install()
+        script.assert_called_with(
+            os.path.join(tmp, 'pbs-scheduler'),
+            'slapos.recipe.pbs_scheduler.main',
+            (os.path.join(tmp, 'run', 'pbs-scheduler-config.json'),))
+
+        self.assertEqual(os.listdir(os.path.join(tmp, 'cron')), [])
+        with open(os.path.join(tmp, 'run', 'pbs-scheduler-config.json')) as f:
+            config = json.load(f)
+        self.assertEqual(config['max-concurrency'], 2)
+        self.assertEqual(config['splay'], 600)
+        pull, push = sorted(config['job-list'], key=lambda x: x['id'])
+        self.assertEqual(pull['command'],
+                         [os.path.join(tmp, 'wrappers', 'pulltest')])
+        self.assertEqual(pull['destination'], '::1:22')
+        self.assertEqual(pull['fix_corrupted_command'], [
+            os.path.join(tmp, 'wrappers', 'pulltest_raw'), '--fix-corrupted'])
+        self.assertEqual(pull['statistics_directory'], os.path.join(
+            tmp, 'directory', 'pull_NAME', 'rdiff-backup-data'))
+        self.assertIsNone(push['fix_corrupted_command'])
+        self.assertEqual(push['frequency'], '0 * * * *')
@@ -0,0 +1,156 @@
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import mock
+
+from slapos.recipe import pbs_journal
+
+
+class PBSJournalTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.remote = os.path.join(self.tmp, 'remote')
+    os.mkdir(self.remote)
+    self.journal_path = os.path.join(self.remote, 'journal')
+    self.journal_directory = os.path.join(self.tmp, 'local.journal')
+    self.prune_list = []
+
+  def test_journal(self):
+    journal = pbs_journal.Journal(self.journal_path, max_size=3)
+    generation = journal.generation
+    self.assertEqual(pbs_journal.read(self.journal_path),
+                     (generation, 0, {}))
+    journal.append({'a', 'b/c'})
+    self.assertEqual(pbs_journal.read(self.journal_path),
+                     (generation, 1, {1: ['a', 'b/c']}))
+    with open(self.journal_path, 'a') as f:
+      f.write('[2, "partial')
+    self.assertEqual(pbs_journal.read(self.journal_path)[1], 1)
+    # too many changes: a new generation starts
+    journal.append({'d', 'e'})
+    self.assertNotEqual(journal.generation, generation)
+    self.assertEqual(pbs_journal.read(self.journal_path),
+                     (journal.generation, 0, {}))
+    self.assertIsNone(pbs_journal.read(self.journal_path + '.missing'))
+
+  def fetch(self, args):
+    # rdiff-backup mirroring the journal directory
+    if '--remove-older-than' in args:
+      self.prune_list.append(args)
+      return 0
+    if not os.path.exists(self.journal_path):
+      return 1
+    mirror = args[-1]
+    if not os.path.isdir(mirror):
+      os.mkdir(mirror)
+    for name in os.listdir(self.remote):
+      shutil.copy(os.path.join(self.remote, name), mirror)
+    return 0
+
+  def beat(self, journal, now=1000):
+    with mock.patch('time.time', return_value=now):
+      journal.beat()
+
+  def check(self, now=1000, max_age=100):
+    with mock.patch('subprocess.call', side_effect=self.fetch), \
+         mock.patch('time.time', return_value=now):
+      try:
+        pbs_journal.check('rdiff-backup', 'ssh', '22::/srv/backup',
+                          self.journal_directory, max_age)
+      except SystemExit as e:
+        self.assertEqual(e.code, pbs_journal.UNCHANGED)
+        return False
+    return True
+
+  def commit(self, now=1000):
+    with mock.patch('time.time', return_value=now):
+      pbs_journal.commit(self.journal_directory)
+
+  def test_check(self):
+    # no journal
+    self.assertTrue(self.check())
+    self.assertEqual(self.prune_list, [])
+    self.commit()
+    journal = pbs_journal.Journal(self.journal_path)
+    # no heartbeat
+    self.assertTrue(self.check())
+    # increments of the mirror are not kept
+    self.assertEqual(self.prune_list, [('rdiff-backup', '--remove-older-than',
+      '1B', '--force', os.path.join(self.journal_directory, 'mirror'))])
+    self.beat(journal)
+    # new generation
+    self.assertTrue(self.check())
+    # backup failed
+    self.assertTrue(self.check())
+    self.commit()
+    self.assertFalse(self.check())
+    journal.append({'a'})
+    self.assertTrue(self.check())
+    journal.append({'b'})
+    self.commit()
+    # b changed after the journal was fetched
+    self.assertTrue(self.check())
+    self.commit()
+    self.beat(journal, 1050)
+    self.assertFalse(self.check(1099))
+    # last backup too old
+    self.assertTrue(self.check(1100))
+    with open(os.path.join(self.journal_directory, 'state.json')) as f:
+      state = json.load(f)
+    self.assertEqual(state, {'generation': journal.generation,
+                             'sequence': 2, 'time': 1000})
+
+  def test_heartbeat(self):
+    journal = pbs_journal.Journal(self.journal_path)
+    self.beat(journal)
+    self.assertTrue(self.check())
+    self.commit()
+    max_age = pbs_journal.HEARTBEAT_MAX_AGE
+    self.assertFalse(self.check(1000 + max_age, 2 * max_age))
+    # the watcher died without removing the journal
+    self.assertTrue(self.check(1001 + max_age, 2 * max_age))
+    # clocks too far apart
+    self.assertTrue(self.check(999 - max_age, 2 * max_age))
+    # the journal is removed when the watcher exits
+    journal.remove()
+    self.assertEqual(os.listdir(self.remote), [])
+    self.assertTrue(self.check())
+    journal.remove()
+
+  def test_watch(self):
+    directory = os.path.join(self.tmp, 'srv')
+    os.mkdir(directory)
+    journal_directory = os.path.join(directory, pbs_journal.JOURNAL_DIRNAME)
+    journal_path = os.path.join(journal_directory, pbs_journal.JOURNAL_FILENAME)
+    process = subprocess.Popen((sys.executable, '-c',
+      'import sys; from slapos.recipe.pbs_journal import watch;'
+      ' watch(sys.argv[1], .1)', directory))
+    try:
+      def wait(condition):
+        for _ in range(100):
+          if condition():
+            return
+          time.sleep(.1)
+        self.fail("timeout")
+      wait(lambda: os.path.exists(os.path.join(journal_directory,
+                                               pbs_journal.HEARTBEAT_FILENAME)))
+      open(os.path.join(directory, 'a'), 'w').close()
+      wait(lambda: (pbs_journal.read(journal_path) or [0, 0])[1])
+      self.assertEqual(pbs_journal.read(journal_path)[2], {1: ['a']})
+    finally:
+      process.send_signal(signal.SIGTERM)
+      process.wait()
+    self.assertEqual(os.listdir(journal_directory), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,220 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+
+from slapos.recipe import pbs_scheduler
+from slapos.recipe.pbs_scheduler import CronSpec, Scheduler
+
+
+def localtime(*args):
+  return time.mktime(args + (0, 0, 0, -1))
+
+
+class CronSpecTest(unittest.TestCase):
+
+  def test_match(self):
+    t = localtime(2020, 3, 2, 10, 30) # Monday
+    self.assertTrue(CronSpec('* * * * *').match(t))
+    self.assertTrue(CronSpec('30 10 * * *').match(t))
+    self.assertTrue(CronSpec('*/15 8-12 * * 1').match(t))
+    self.assertTrue(CronSpec('0,30 * 2 3 *').match(t))
+    self.assertFalse(CronSpec('0 * * * *').match(t))
+    self.assertFalse(CronSpec('30 10 * * 0').match(t))
+    # day of month or day of week
+    self.assertTrue(CronSpec('30 10 1 * 1').match(t))
+    self.assertFalse(CronSpec('30 10 */2 * *').match(t))
+    self.assertTrue(CronSpec('@hourly').match(localtime(2020, 3, 2, 10, 0)))
+    self.assertTrue(CronSpec('0 0 * * 7').match(localtime(2020, 3, 1, 0, 0)))
+    for spec in '* * * *', '60 * * * *', '*/0 * * * *', 'a * * * *':
+      self.assertRaises(ValueError, CronSpec, spec)
+
+
+class Process(object):
+
+  returncode = None
+
+  def __init__(self, command, **kw):
+    self.command = command
+
+  def poll(self):
+    return self.returncode
+
+
+class SchedulerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    popen_patch = mock.patch('subprocess.Popen', side_effect=self.popen)
+    popen_patch.start()
+    self.addCleanup(popen_patch.stop)
+    self.process_list = []
+
+  def popen(self, command, **kw):
+    process = Process(command)
+    self.process_list.append(process)
+    return process
+
+  def makeScheduler(self, job_list, **config):
+    config.setdefault('state', os.path.join(self.tmp, 'state.json'))
+    config.setdefault('request-directory', self.tmp)
+    config['job-list'] = [dict({
+        'command': [job['id']],
+        'destination': 'host:22',
+        'frequency': '0 * * * *',
+      }, **job) for job in job_list]
+    return Scheduler(config)
+
+  def started(self):
+    return [p.command for p in self.process_list if p.returncode is None]
+
+  def finish(self, returncode=0):
+    for p in self.process_list:
+      if p.returncode is None:
+        p.returncode = returncode
+
+  def test_concurrency(self):
+    scheduler = self.makeScheduler([
+        {'id': 'a'}, {'id': 'b'},
+        {'id': 'c', 'destination': 'other:22'},
+        {'id': 'd', 'destination': 'other:22'},
+        {'id': 'e', 'destination': 'another:22'},
+      ], **{'max-concurrency': 2, 'max-per-destination': 1})
+    now = localtime(2020, 3, 2, 10, 0)
+    scheduler.step(now - 60)
+    self.assertEqual(self.started(), [])
+    scheduler.step(now)
+    self.assertEqual(len(self.started()), 2)
+    self.assertEqual(len(set(scheduler.job_dict[x].destination
+                             for x, in self.started())), 2)
+    # due again while queued or running: not queued twice
+    scheduler.step(now + 3600)
+    self.assertEqual(len(scheduler.queue), 3)
+    for i in range(3):
+      self.finish()
+      scheduler.step(now + 3601 + i)
+    self.assertEqual(len(self.process_list), 5)
+    self.finish()
+    scheduler.step(now + 3700)
+    self.assertEqual(self.started(), [])
+    with open(os.path.join(self.tmp, 'state.json')) as f:
+      state = json.load(f)
+    self.assertEqual(sorted(state), ['a', 'b', 'c', 'd', 'e'])
+    self.assertEqual(max(x['lag'] for x in state.values()), 3602)
+    self.assertEqual(state['a']['returncode'], 0)
+
+  def test_splay(self):
+    scheduler = self.makeScheduler([{'id': str(i)} for i in range(20)],
+      **{'max-concurrency': 20, 'max-per-destination': 20, 'splay': 600})
+    offset_list = sorted(job.offset for job in scheduler.job_dict.values())
+    self.assertTrue(0 <= offset_list[0] < offset_list[-1] <= 600)
+    now = localtime(2020, 3, 2, 10, 0)
+    scheduler.step(now - 60)
+    for t in range(0, 601, 10):
+      scheduler.step(now + t)
+      self.assertEqual(len(self.process_list),
+                       sum(1 for x in offset_list if x <= t))
+    self.assertEqual(len(self.process_list), 20)
+
+  def test_bandwidth(self):
+    scheduler = self.makeScheduler([{'id': 'a'}, {'id': 'b'}, {'id': 'c'}],
+      **{'max-concurrency': 3, 'max-per-destination': 3,
+         'bandwidth-limit': 1000})
+    scheduler.state_dict = {
+      'a': {'bytes': 60000, 'duration': 100},
+      'b': {'bytes': 50000, 'duration': 100},
+    }
+    now = localtime(2020, 3, 2, 10, 0)
+    scheduler.step(now - 60)
+    scheduler.step(now)
+    # c has no known throughput
+    self.assertEqual(sorted(self.started()), [['a'], ['c']])
+
+  def test_fix_corrupted(self):
+    scheduler = self.makeScheduler([
+      {'id': 'a', 'fix_corrupted_command': ['a_raw', '--fix-corrupted']},
+      {'id': 'b'},
+    ])
+    with open(os.path.join(self.tmp, 'config.json'), 'w') as f:
+      json.dump({'request-directory': self.tmp}, f)
+    pbs_scheduler.main(os.path.join(self.tmp, 'config.json'),
+                       ['--fix-corrupted', 'a', 'b'])
+    scheduler.step(localtime(2020, 3, 2, 10, 30))
+    self.assertEqual(self.started(), [['a_raw', '--fix-corrupted']])
+    self.assertEqual(sorted(os.listdir(self.tmp)), ['config.json'])
+
+  def test_statistics(self):
+    statistics_directory = os.path.join(self.tmp, 'rdiff-backup-data')
+    os.mkdir(statistics_directory)
+    scheduler = self.makeScheduler([
+      {'id': 'a', 'statistics_directory': statistics_directory}])
+    now = time.time() // 3600 * 3600
+    scheduler.step(now - 60)
+    scheduler.step(now)
+    with open(os.path.join(statistics_directory,
+                           'session_statistics.x.data'), 'w') as f:
+      f.write("SourceFiles 10\nNewFileSize 100 (100 bytes)\n"
+              "ChangedSourceSize 20 (20 bytes)\n")
+    self.finish(1)
+    scheduler.step(now + 5)
+    state = scheduler.state_dict['a']
+    self.assertEqual(state['bytes'], 120)
+    self.assertEqual(state['duration'], 5)
+    self.assertNotIn('success', state)
+
+
+class StopTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+
+  def isRunning(self, pid):
+    try:
+      with open('/proc/%s/stat' % pid) as f:
+        return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except IOError:
+      return False
+
+  def test_stop(self):
+    pid_file = os.path.join(self.tmp, 'pid')
+    # rdiff-backup run by a wrapper, both ignoring SIGTERM
+    scheduler = Scheduler({
+      'state': os.path.join(self.tmp, 'state.json'),
+      'job-list': [{
+        'id': 'a',
+        'command': ['sh', '-c', 'trap "" TERM; sleep 60 & echo $! > %s; wait'
+                                % pid_file],
+        'destination': 'host:22',
+        'frequency': '* * * * *',
+      }],
+    })
+    now = time.time() // 60 * 60
+    scheduler.step(now - 60)
+    scheduler.step(now)
+    for _ in range(3000):
+      if os.path.exists(pid_file) and os.path.getsize(pid_file):
+        break
+      time.sleep(.01)
+    else:
+      self.fail("job not started")
+    with open(pid_file) as f:
+      pid = int(f.read())
+    self.assertTrue(self.isRunning(pid))
+    scheduler.stop(timeout=.5)
+    for _ in range(1000):
+      if not self.isRunning(pid):
+        break
+      time.sleep(.01)
+    else:
+      os.kill(pid, 9)
+      self.fail("child of the job still running")
+
+
+if __name__ == '__main__':
+  unittest.main()
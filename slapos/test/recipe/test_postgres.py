@@ -1,12 +1,17 @@
 import unittest
 import tempfile
 import shutil
-import os.path
+import os
 import zc.buildout.testing
 
 
 class PostgresTest(unittest.TestCase):
   def setUp(self):
+    # zc.buildout.testing.Buildout runs in the current directory
+    buildout_directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, buildout_directory)
+    self.addCleanup(os.chdir, os.getcwd())
+    os.chdir(buildout_directory)
     self.buildout = buildout = zc.buildout.testing.Buildout()
     self.pgdata_directory = tempfile.mkdtemp()
     self.addCleanup(shutil.rmtree, self.pgdata_directory)
@@ -0,0 +1,119 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from slapos.recipe import publish
+from slapos.recipe.librecipe.slapclient import getSlapClient
+
+
+class Buildout(dict):
+  """Buildout holding the SLAP client shared by its recipes"""
+
+
+class PublishTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.buildout = {
+      'buildout': {'directory': self.tmp},
+      'slap-connection': {
+        'computer-id': 'COMP-0',
+        'partition-id': 'slappart0',
+        'server-url': 'http://master',
+        'software-release-url': 'http://example.com/software.cfg',
+      },
+    }
+    slap_patch = mock.patch('slapos.slap.slap')
+    slap = slap_patch.start()
+    self.addCleanup(slap_patch.stop)
+    self.setConnectionDict = slap.return_value.registerComputerPartition \
+      .return_value.setConnectionDict
+    self.now = 1000
+
+  def publish(self, recipe=publish.Recipe, name='publish', **options):
+    self.buildout[name] = options
+    with mock.patch('time.time', return_value=self.now):
+      recipe(self.buildout, name, options).install()
+    with open(os.path.join(self.tmp, publish.STATE_FILENAME)) as f:
+      return json.load(f)
+
+  def test_skip_unchanged(self):
+    state = self.publish(url='http://a')
+    self.setConnectionDict.assert_called_once_with({'url': 'http://a'}, None)
+    self.assertEqual(state['publish']['']['time'], 1000)
+
+    self.now += 3600
+    path = os.path.join(self.tmp, publish.STATE_FILENAME)
+    os.utime(path, (0, 0))
+    self.assertEqual(self.publish(url='http://a'), state)
+    self.assertEqual(self.setConnectionDict.call_count, 1)
+    # the state is not rewritten when nothing is published
+    self.assertEqual(os.stat(path).st_mtime, 0)
+
+    state = self.publish(url='http://b')
+    self.setConnectionDict.assert_called_with({'url': 'http://b'}, None)
+    self.assertEqual(state['publish']['']['time'], 4600)
+
+    # slaves are published independently
+    state = self.publish(url='http://b', **{'-slave-reference': 'SLAVE-0'})
+    self.setConnectionDict.assert_called_with({'url': 'http://b'}, 'SLAVE-0')
+    self.assertEqual(sorted(state['publish']), ['', 'SLAVE-0'])
+
+    # so are serialised parameters
+    self.publish(publish.Serialised, url='http://b')
+    self.assertEqual(self.setConnectionDict.call_count, 4)
+
+  def test_sections(self):
+    # each section remembers what it published
+    for _ in range(2):
+      self.publish(url='http://a')
+      state = self.publish(name='publish-other', port='80')
+    self.assertEqual(self.setConnectionDict.call_count, 2)
+    self.assertEqual(sorted(state), ['publish', 'publish-other'])
+
+  def test_stats(self):
+    stats = publish.stats.copy()
+    self.addCleanup(publish.stats.update, stats)
+    self.publish(url='http://a')
+    self.publish(url='http://a')
+    self.publish(url='http://a')
+    self.assertEqual(publish.stats, {'sent': stats['sent'] + 1,
+                                     'skipped': stats['skipped'] + 2})
+
+  def test_published_by_other(self):
+    self.publish(url='http://a')
+    # Next run, publish-early replaces the parameters before publish.
+    self.buildout = Buildout(self.buildout)
+    getSlapClient(self.buildout).getComputerPartition(
+      'http://master', 'COMP-0', 'slappart0').setConnectionDict({'x': '1'})
+    self.publish(url='http://a')
+    self.assertEqual(self.setConnectionDict.call_args_list, [
+      mock.call({'url': 'http://a'}, None),
+      mock.call({'x': '1'}, None),
+      mock.call({'url': 'http://a'}, None)])
+    # but a slave is not affected
+    self.publish(url='http://a', **{'-slave-reference': 'SLAVE-0'})
+    self.publish(url='http://a', **{'-slave-reference': 'SLAVE-0'})
+    self.assertEqual(self.setConnectionDict.call_count, 4)
+
+  def test_refresh(self):
+    self.publish(url='http://a', **{'-refresh-interval': '60'})
+    self.now += 59
+    self.publish(url='http://a', **{'-refresh-interval': '60'})
+    self.assertEqual(self.setConnectionDict.call_count, 1)
+    self.now += 1
+    state = self.publish(url='http://a', **{'-refresh-interval': '60'})
+    self.assertEqual(self.setConnectionDict.call_count, 2)
+    self.assertEqual(state['publish']['']['time'], 1060)
+    # 0 disables skipping
+    self.publish(url='http://a', **{'-refresh-interval': '0'})
+    self.assertEqual(self.setConnectionDict.call_count, 3)
+
+
+if __name__ == '__main__':
+  unittest.main()
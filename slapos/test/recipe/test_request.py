@@ -1,11 +1,13 @@
 import mock
+import time
 import unittest
 from collections import defaultdict
 from slapos.recipe import request
 from testfixtures import LogCapture
+from zc.buildout import UserError
 
 
-class RecipeTestMixin(object):
+class SlapTestMixin(object):
 
   def setUp(self):
     self.buildout = {
@@ -26,12 +28,17 @@ class RecipeTestMixin(object):
     register_instance.request = self.request_instance
     slap_instance.registerComputerPartition.return_value = register_instance
     slap.return_value = slap_instance
+    self.instance_getConnectionParameterDict = \
+        requested_instance.getConnectionParameterDict
     self.instance_getConnectionParameter = \
         requested_instance.getConnectionParameter
 
+
+class RecipeTestMixin(SlapTestMixin):
+
   def test_no_return_in_options_logs(self):
     options = defaultdict(str)
-    self.instance_getConnectionParameter.return_value = self.return_value_empty
+    self.instance_getConnectionParameterDict.return_value = self.return_value_empty
     with LogCapture() as log:
       self.recipe(self.buildout, "request", options)
     log.check(
@@ -47,7 +54,7 @@ class RecipeTestMixin(object):
     options = defaultdict(str)
     options['return'] = 'anything'
 
-    self.instance_getConnectionParameter.return_value = self.return_value_empty
+    self.instance_getConnectionParameterDict.return_value = self.return_value_empty
 
     with LogCapture() as log:
       self.recipe(self.buildout, "request", options)
@@ -61,7 +68,7 @@ class RecipeTestMixin(object):
     options = defaultdict(str)
     options['return'] = 'anything'
 
-    self.instance_getConnectionParameter.side_effect = \
+    self.instance_getConnectionParameterDict.side_effect = \
         request.slapmodule.NotFoundError()
 
     recipe = self.recipe(self.buildout, "request", options)
@@ -77,7 +84,7 @@ class RecipeTestMixin(object):
     options = defaultdict(str)
     options['return'] = 'anything'
 
-    self.instance_getConnectionParameter.return_value = self.return_value
+    self.instance_getConnectionParameterDict.return_value = self.return_value
 
     recipe = self.recipe(self.buildout, "request", options)
     result = recipe.install()
@@ -89,34 +96,126 @@ class RecipeTestMixin(object):
       partition_parameter_kw=self.called_partition_parameter_kw,
       shared=False, state='started')
 
+  def test_return_many(self):
+    options = defaultdict(str)
+    options['return'] = 'anything missing other'
+
+    self.instance_getConnectionParameterDict.return_value = \
+        self.return_value_many
+
+    recipe = self.recipe(self.buildout, "request", options)
+    self.assertEqual(options['connection-anything'], 'done')
+    self.assertEqual(options['connection-other'], 'more')
+    self.assertEqual(options['connection-missing'], '')
+    self.instance_getConnectionParameterDict.assert_called_once_with()
+    self.instance_getConnectionParameter.assert_not_called()
+
+  def test_return_cached(self):
+    # sections requesting the same instance share its connection parameters
+    buildout = type('Buildout', (dict,), {})(self.buildout)
+    self.instance_getConnectionParameterDict.return_value = self.return_value
+    for name in 'foo', 'foo', 'bar':
+      options = defaultdict(str)
+      options['name'] = name
+      options['return'] = 'anything'
+      self.recipe(buildout, "request", options)
+      self.assertEqual(options['connection-anything'], 'done')
+    self.assertEqual(self.instance_getConnectionParameterDict.call_count, 2)
+
 
 class RecipeTest(RecipeTestMixin, unittest.TestCase):
   recipe = request.Recipe
   raises = True
   return_value_empty = {}
-  return_value = 'done'
+  return_value = {'anything': 'done'}
+  return_value_many = {'anything': 'done', 'other': 'more', 'extra': 'x'}
   called_partition_parameter_kw = {}
 
 
 class RequestOptionalTest(RecipeTestMixin, unittest.TestCase):
   recipe = request.RequestOptional
   raises = False
-  return_value = 'done'
+  return_value = {'anything': 'done'}
+  return_value_many = {'anything': 'done', 'other': 'more', 'extra': 'x'}
   return_value_empty = {}
   called_partition_parameter_kw = {}
 
 
 class RequestJSONEncodedTest(RecipeTestMixin, unittest.TestCase):
   recipe = request.RequestJSONEncoded
-  return_value_empty = "{}"
-  return_value = '{"anything": "done"}'
+  return_value_empty = {'_': '{}'}
+  return_value = {'_': '{"anything": "done"}'}
+  return_value_many = {'_': '{"anything": "done", "other": "more"}'}
   raises = True
   called_partition_parameter_kw = {'_': '{}'}
 
 
 class RequestOptionalJSONEncodedTest(RecipeTestMixin, unittest.TestCase):
   recipe = request.RequestOptionalJSONEncoded
-  return_value_empty = "{}"
-  return_value = '{"anything": "done"}'
+  return_value_empty = {'_': '{}'}
+  return_value = {'_': '{"anything": "done"}'}
+  return_value_many = {'_': '{"anything": "done", "other": "more"}'}
   raises = False
   called_partition_parameter_kw = {'_': '{}'}
+
+
+class RequestEdgeTest(SlapTestMixin, unittest.TestCase):
+
+  def recipe(self, buildout, name, options):
+    options.setdefault('country-list', 'fr,de,jp')
+    return request.RequestEdge(buildout, name, options)
+
+  def setUp(self):
+    super(RequestEdgeTest, self).setUp()
+    requested_instance = self.request_instance.return_value
+    def request(software_url, software_type, name, **kw):
+      # requests complete in reverse order
+      time.sleep({'fr': .3, 'de': .2, 'jp': .1}[name.split('-')[0]])
+      return requested_instance
+    self.request_instance.side_effect = request
+    requested_instance.getConnectionParameterDict.return_value = \
+      {'anything': 'done'}
+
+  def test_concurrency(self):
+    option_list = []
+    for concurrency in '1', '3':
+      options = defaultdict(str)
+      options['return'] = 'anything'
+      options['concurrency'] = concurrency
+      start = time.time()
+      recipe = self.recipe(self.buildout, "request", options)
+      elapsed = time.time() - start
+      self.assertEqual(recipe.install(), [])
+      option_list.append([x for x in options if x.startswith('connection-')])
+    self.assertLess(elapsed, .5)
+    self.assertEqual(option_list, [['connection-anything-fr',
+      'connection-anything-de', 'connection-anything-jp']] * 2)
+    self.assertEqual(options['connection-anything-fr'], 'done')
+
+  def test_timeout(self):
+    options = defaultdict(str)
+    options['return'] = 'anything'
+    options['concurrency'] = '3'
+    options['timeout'] = '.25'
+    with LogCapture() as log:
+      recipe = self.recipe(self.buildout, "request", options)
+    self.assertRaises(UserError, recipe.install)
+    self.assertEqual(options['connection-anything-fr'], '')
+    self.assertEqual(options['connection-anything-de'], 'done')
+    self.assertIn(('request', 'WARNING', 'Request for fr timed out after 0.25s'),
+                  log.actual())
+
+  def test_timeout_queued(self):
+    # The timeout is counted from the start of each request: de and jp
+    # wait for fr to return, but they are not considered timed out.
+    options = defaultdict(str)
+    options['return'] = 'anything'
+    options['timeout'] = '.25'
+    with LogCapture() as log:
+      recipe = self.recipe(self.buildout, "request", options)
+    self.assertEqual(recipe.timeout_list, ['fr'])
+    self.assertEqual(options['connection-anything-fr'], '')
+    self.assertEqual(options['connection-anything-de'], 'done')
+    self.assertEqual(options['connection-anything-jp'], 'done')
+    self.assertIn(('request', 'WARNING', 'Request for fr timed out after 0.25s'),
+                  log.actual())
@@ -0,0 +1,68 @@
+import errno
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from slapos.recipe.librecipe.shared import openSharedFile
+
+
+class SharedFileTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    self.directory = os.path.join(self.tmp, 'shared')
+
+  def mode(self, path):
+    return stat.S_IMODE(os.lstat(path).st_mode)
+
+  def open(self, name='file'):
+    fd = openSharedFile(self.directory, name)
+    self.addCleanup(os.close, fd)
+    return fd
+
+  def test_create(self):
+    umask = os.umask(0o077)
+    try:
+      fd = self.open()
+    finally:
+      os.umask(umask)
+    os.write(fd, b'x')
+    path = os.path.join(self.directory, 'file')
+    self.assertEqual(self.mode(self.directory), 0o1777)
+    self.assertEqual(self.mode(path), 0o666)
+    with open(path, 'rb') as f:
+      self.assertEqual(f.read(), b'x')
+
+  def test_existing(self):
+    # the mode of a file created by someone else is not changed
+    os.mkdir(self.directory)
+    path = os.path.join(self.directory, 'file')
+    open(path, 'w').close()
+    os.chmod(path, 0o640)
+    self.open()
+    self.assertEqual(self.mode(path), 0o640)
+
+  def test_symlink(self):
+    target = os.path.join(self.tmp, 'target')
+    open(target, 'w').close()
+    os.chmod(target, 0o600)
+    os.mkdir(self.directory)
+    os.symlink(target, os.path.join(self.directory, 'file'))
+    with self.assertRaises(OSError) as cm:
+      self.open()
+    self.assertEqual(cm.exception.errno, errno.ELOOP)
+    self.assertEqual(self.mode(target), 0o600)
+    # nor for the directory
+    os.symlink(self.tmp, os.path.join(self.tmp, 'link'))
+    self.directory = os.path.join(self.tmp, 'link')
+    with self.assertRaises(OSError) as cm:
+      self.open('other')
+    self.assertEqual(cm.exception.errno, errno.ENOTDIR)
+    self.assertFalse(os.path.exists(os.path.join(self.tmp, 'other')))
+
+
+if __name__ == '__main__':
+  unittest.main()
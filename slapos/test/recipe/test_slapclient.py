@@ -0,0 +1,88 @@
+import unittest
+
+import mock
+import requests
+from slapos import slap
+
+from slapos.recipe.librecipe import slapclient
+
+
+class Buildout(dict):
+  pass
+
+
+class ConnectionHelper(object):
+
+  def __init__(self):
+    self.method_list = []
+
+  def do_request(self, method, path):
+    self.method_list.append(method)
+
+
+class SlapClientTest(unittest.TestCase):
+
+  def setUp(self):
+    slap_patch = mock.patch("slapos.slap.slap")
+    self.slap = slap_patch.start()
+    self.addCleanup(slap_patch.stop)
+    self.partition = partition = mock.MagicMock()
+    partition.getInstanceParameterDict.return_value = {'foo': 'bar'}
+    partition.getConnectionParameterDict.return_value = {'url': 'old'}
+    partition.getState.return_value = 'started'
+    self.slap.return_value.registerComputerPartition.return_value = partition
+
+  def test_getSlapClient(self):
+    buildout = Buildout()
+    client = slapclient.getSlapClient(buildout)
+    self.assertIs(slapclient.getSlapClient(buildout), client)
+    # a plain dict can not hold the client
+    self.assertIsNot(slapclient.getSlapClient({}), slapclient.getSlapClient({}))
+    # without buildout, the client is shared by the process
+    self.assertIs(slapclient.getSlapClient(), slapclient.getSlapClient())
+
+  def test_getComputerPartition(self):
+    client = slapclient.SlapClient()
+    partition = client.getComputerPartition('http://master', 'COMP', 'part')
+    self.assertIs(client.getComputerPartition('http://master', 'COMP', 'part'),
+                  partition)
+    self.assertIsNot(client.getComputerPartition('http://master', 'COMP',
+      'part', 'key', 'cert'), partition)
+    self.assertEqual(self.slap.call_count, 2)
+    self.slap.return_value.initializeConnection.assert_called_with(
+      'http://master', 'key', 'cert')
+
+    for _ in range(2):
+      parameter_dict = partition.getInstanceParameterDict()
+      self.assertEqual(parameter_dict, {'foo': 'bar'})
+      # callers may modify returned values
+      parameter_dict.pop('foo')
+      self.assertEqual(partition.getState(), 'started')
+      self.assertEqual(partition.getConnectionParameter('url'), 'old')
+      self.assertRaises(slap.NotFoundError,
+                        partition.getConnectionParameter, 'missing')
+    self.assertEqual(self.partition.getInstanceParameterDict.call_count, 1)
+    self.assertEqual(self.partition.getState.call_count, 1)
+    self.assertEqual(self.partition.getConnectionParameterDict.call_count, 1)
+
+    partition.setConnectionDict({'url': 'new'})
+    self.partition.setConnectionDict.assert_called_once_with({'url': 'new'},
+                                                             None)
+    self.assertEqual(partition.getConnectionParameterDict(), {'url': 'new'})
+    self.assertIs(partition.request, self.partition.request)
+
+  def test_round_trips(self):
+    connection_helper = ConnectionHelper()
+    self.slap.return_value._connection_helper = connection_helper
+    client = slapclient.SlapClient()
+    client.getSlap('http://master')
+    connection_helper.do_request(requests.get, 'registerComputerPartition')
+    connection_helper.do_request(requests.post, 'setConnectionXml')
+    self.assertEqual(client.round_trips, 2)
+    session_get, session_post = connection_helper.method_list
+    self.assertIs(session_get.__self__, session_post.__self__)
+    self.assertIsInstance(session_get.__self__, requests.Session)
+
+
+if __name__ == '__main__':
+  unittest.main()
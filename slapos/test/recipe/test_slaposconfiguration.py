@@ -2,6 +2,7 @@
 import json
 import mock
 import os
+import shutil
 import unittest
 import tempfile
 from collections import defaultdict
@@ -34,8 +35,7 @@ class SlapConfigurationTest(unittest.TestCase):
     }
 
   def tearDown(self):
-    os.unlink(self.resource_file)
-    os.rmdir(self.instance_root)
+    shutil.rmtree(self.instance_root)
 
   @mock.patch("slapos.slap.slap")
   def test_correct_naming(self, MockClient):
@@ -52,3 +52,60 @@ class SlapConfigurationTest(unittest.TestCase):
 
     self.assertEqual(options['address-list'], [10, 20],
       "All underscores should be replaced with -")
+
+  @mock.patch("slapos.slap.slap")
+  def test_snapshot(self, MockClient):
+    partition = MockClient.return_value.registerComputerPartition.return_value
+    partition.getInstanceParameterDict.side_effect = lambda: {
+      'timestamp': '1234',
+      'ip_list': [('tap0', '10.0.0.1'), ('tap0', 'fe80::1')],
+      'foo': 'bar',
+    }
+    partition.getState.return_value = 'started'
+    partition.getInstanceGuid.return_value = 'SOFTINST-1'
+    snapshot = os.path.join(self.instance_root, 'snapshot.json')
+
+    def run(**kw):
+      options = defaultdict(str, snapshot=snapshot, **kw)
+      MockClient.reset_mock()
+      slapconfiguration.Recipe(self.buildout, "slapconfiguration", options)
+      self.assertEqual(options['ipv4'], {'10.0.0.1'})
+      self.assertEqual(options['instance-guid'], 'SOFTINST-1')
+      self.assertEqual(options['tun-ipv4'], '192.168.0.1')
+      self.assertEqual(options['configuration.foo'], 'bar')
+      self.assertEqual(options['configuration'], {'foo': 'bar'})
+      return partition.getInstanceParameterDict.call_count, \
+             partition.getState.call_count
+
+    self.assertEqual(run(), (1, 1))
+    with open(snapshot) as f:
+      self.assertEqual(json.load(f)['timestamp'], '1234')
+    # same timestamp: no master call at all
+    self.assertEqual(run(**{'snapshot-timestamp': '1234'}), (0, 0))
+    # timestamp is asked to the master
+    self.assertEqual(run(), (1, 0))
+    # resource file changed
+    os.utime(self.resource_file, (0, 0))
+    self.assertEqual(run(**{'snapshot-timestamp': '1234'}), (1, 1))
+    # the master is right
+    self.assertEqual(run(**{'snapshot-timestamp': '1235'}), (1, 0))
+    partition.getInstanceParameterDict.side_effect = lambda: {
+      'timestamp': '1235', 'ip_list': [], 'foo': 'baz'}
+    options = defaultdict(str, snapshot=snapshot)
+    slapconfiguration.Recipe(self.buildout, "slapconfiguration", options)
+    self.assertEqual(options['configuration.foo'], 'baz')
+    self.assertEqual(options['ipv4'], set())
+
+    # no timestamp from the master: the snapshot is never used
+    partition.getInstanceParameterDict.side_effect = lambda: {
+      'ip_list': [('tap0', '10.0.0.1')], 'foo': 'bar'}
+    with open(snapshot) as f:
+      snapshot_dict = json.load(f)
+    snapshot_dict['timestamp'] = 'None'
+    with open(snapshot, 'w') as f:
+      json.dump(snapshot_dict, f)
+    self.assertEqual(run(), (1, 1))
+    self.assertEqual(run(**{'snapshot-timestamp': 'None'}), (1, 1))
+    os.remove(snapshot)
+    self.assertEqual(run(), (1, 1))
+    self.assertFalse(os.path.exists(snapshot))
@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+import unittest
+
+from mock import patch
+
+from slapos.recipe import sshkeys_authority
+
+def which(name):
+  for path in os.environ.get('PATH', '').split(os.pathsep):
+    path = os.path.join(path, name)
+    if os.access(path, os.X_OK):
+      return path
+
+
+class PublicKeyTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  @unittest.skipUnless(which('ssh-keygen'), "ssh-keygen is not available")
+  def test_openssh(self):
+    for key_type, size in ('rsa', '1024'), ('ecdsa', '256'), ('ed25519', ''):
+      private_key = os.path.join(self.tmp, key_type)
+      subprocess.check_call(('ssh-keygen', '-q', '-N', '', '-C', '',
+        '-t', key_type, '-f', private_key) + (('-b', size) if size else ()))
+      expected = subprocess.check_output(('ssh-keygen', '-y', '-f',
+        private_key), universal_newlines=True)
+      self.assertEqual(
+        sshkeys_authority.publicKeyFromPrivateKey(private_key),
+        expected.strip())
+
+  def test_dropbear(self):
+    string = lambda x: struct.pack('>I', len(x)) + x
+    public_blob = string(b'ssh-rsa') + string(b'\1\0\1') + string(b'\0\xff' * 3)
+    private_key = os.path.join(self.tmp, 'dropbear')
+    with open(private_key, 'wb') as f:
+      f.write(public_blob + string(b'd') + string(b'p') + string(b'q'))
+    self.assertEqual(sshkeys_authority.publicKeyFromPrivateKey(private_key),
+      'ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAAABgD/AP8A/w==')
+    with open(private_key, 'wb') as f:
+      f.write(b'garbage')
+    self.assertIsNone(sshkeys_authority.publicKeyFromPrivateKey(private_key))
+
+
+@unittest.skipUnless(which('ssh-keygen'), "ssh-keygen is not available")
+class KeyFactoryTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    # the keygen binary type is detected from its path
+    os.mkdir(os.path.join(self.tmp, 'openssh'))
+    self.keygen = os.path.join(self.tmp, 'openssh', 'ssh-keygen')
+    os.symlink(which('ssh-keygen'), self.keygen)
+    self.pool = os.path.join(self.tmp, 'pool')
+    os.mkdir(self.pool)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def request(self, name):
+    request_file = os.path.join(self.tmp, name + '.json')
+    with open(request_file, 'w') as f:
+      json.dump({
+        'type': 'ed25519',
+        'size': 256,
+        'private_key': os.path.join(self.tmp, name),
+        'public_key': os.path.join(self.tmp, name + '.pub'),
+      }, f)
+    return request_file
+
+  def waitPool(self, count):
+    pool = os.path.join(self.pool, 'ed25519-256')
+    for _ in range(100):
+      if os.path.isdir(pool) and len(
+          [x for x in os.listdir(pool) if not x.startswith('.')]) == count:
+        return
+      time.sleep(.1)
+    self.fail("pool was not refilled")
+
+  def test_pool(self):
+    factory = sshkeys_authority.KeyFactory(self.keygen, self.pool, 2)
+    self.addCleanup(factory.stop)
+    factory.processRequest(self.request('first'))
+    self.waitPool(2)
+    # Otherwise, the refill thread could call the mock.
+    factory.stop()
+    with patch.object(factory, 'generate') as generate:
+      factory.processRequest(self.request('second'))
+    generate.assert_not_called()
+    with open(os.path.join(self.tmp, 'second.pub')) as f:
+      public_key = f.read()
+    self.assertEqual(public_key, subprocess.check_output((self.keygen, '-y',
+      '-f', os.path.join(self.tmp, 'second')), universal_newlines=True).strip())
+    self.waitPool(1)
+    self.assertEqual((factory.pool_hit_count, factory.key_count), (1, 2))
+
+  def test_no_pool(self):
+    factory = sshkeys_authority.KeyFactory(self.keygen)
+    factory.processRequest(self.request('key'))
+    self.assertTrue(os.path.exists(os.path.join(self.tmp, 'key.pub')))
+    self.assertEqual(os.listdir(self.pool), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,84 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+from zc.buildout.configparser import parse
+
+
+from slapos.recipe.switch_softwaretype import ProfileCache
+
+
+class MainBuildout(dict):
+  _logger = logging.getLogger('buildout')
+  _log_level = logging.INFO
+
+
+class ProfileCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+    # buildout changes the current directory
+    self.addCleanup(os.chdir, os.getcwd())
+    self.writeFile('base.cfg', "[buildout]\nparts =\n[foo]\nbar = 1\n")
+    self.writeFile('instance.cfg', "[buildout]\nextends = base.cfg\n"
+                                   "[foo]\nbaz = ${:bar} # not a comment\n")
+    self.path = os.path.join(self.tmp, 'cache.json')
+    self.main_buildout = MainBuildout({
+      'buildout': {'directory': self.tmp},
+      'slap-connection': {'computer-id': 'COMP-0'},
+    })
+    # no user defaults
+    patcher = patch.dict(os.environ, BUILDOUT_HOME=self.tmp)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def writeFile(self, name, content):
+    with open(os.path.join(self.tmp, name), 'w') as f:
+      f.write(content)
+
+  def load(self, *override):
+    cache = ProfileCache(self.path)
+    with patch('zc.buildout.configparser.parse',
+               side_effect=parse) as parse_:
+      buildout = cache.load(self.main_buildout,
+        os.path.join(self.tmp, 'instance.cfg'), list(override))
+      foo = dict(buildout['foo'])
+    return (cache.hit, cache.miss, parse_.call_count), foo
+
+  def test_cache(self):
+    expected = {'bar': '1', 'baz': '1 # not a comment'}
+    # buildout parses 2 files, then the cache scans them for extends
+    self.assertEqual(self.load(), ((0, 1, 4), expected))
+    self.assertEqual(self.load(), ((1, 0, 0), expected))
+    # options are part of the key
+    expected = {'bar': '2', 'baz': '2 # not a comment'}
+    self.assertEqual(self.load(('foo', 'bar', '2')), ((0, 1, 4), expected))
+    self.assertEqual(self.load(('foo', 'bar', '2')), ((1, 0, 0), expected))
+    # any change in the extends chain invalidates the entry
+    self.writeFile('base.cfg', "[buildout]\nparts =\n[foo]\nbar = 3\n")
+    expected = {'bar': '3', 'baz': '3 # not a comment'}
+    self.assertEqual(self.load(), ((0, 1, 4), expected))
+    self.assertEqual(self.load(), ((1, 0, 0), expected))
+    # including the creation of user defaults
+    self.writeFile('default.cfg', "[foo]\nbar = 4\nqux = 5\n")
+    self.assertEqual(self.load()[0], (0, 1, 6))
+    # (buildout still reads them, below the cached sections)
+    self.assertEqual(self.load(), ((1, 0, 1),
+      {'bar': '3', 'baz': '3 # not a comment', 'qux': '5'}))
+
+  def test_url(self):
+    self.writeFile('instance.cfg', "[buildout]\nextends =\n  base.cfg\n"
+                                   "  https://example.invalid/base.cfg\n")
+    with patch('slapos.recipe.switch_softwaretype.SubBuildout') as sub:
+      cache = ProfileCache(self.path)
+      cache.load(self.main_buildout,
+                 os.path.join(self.tmp, 'instance.cfg'), [])
+    sub.assert_called_once()
+    self.assertFalse(os.path.exists(self.path))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from slapos.recipe.addresiliency import takeover
+from slapos.slap import NotFoundError, ResourceNotReady
+
+
+class TakeoverTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp)
+
+  def test_backoff(self):
+    delay_list = []
+    for delay in takeover.Backoff(initial=1, maximum=10, jitter=.5):
+      delay_list.append(delay)
+      if len(delay_list) == 6:
+        break
+    for delay, maximum in zip(delay_list, (1, 2, 4, 8, 10, 10)):
+      self.assertTrue(maximum / 2. <= delay <= maximum, delay_list)
+
+  def test_takeover(self):
+    current = mock.MagicMock()
+    winner = current.request.return_value
+    broken = winner.request.return_value
+    # not allocated yet, then allocated
+    winner.getId.side_effect = [ResourceNotReady, 'slappart1', 'slappart1']
+    # the broken partition is not renamed yet
+    winner.rename.side_effect = [NotFoundError, NotFoundError, None]
+    report_path = os.path.join(self.tmp, 'report.json')
+    triggered_path = os.path.join(self.tmp, 'takeover_triggered')
+    with mock.patch.object(takeover, 'getSlapClient') as getSlapClient, \
+         mock.patch('time.sleep') as sleep:
+      getSlapClient.return_value.getComputerPartition.return_value = current
+      takeover.takeover('http://master', None, None, 'COMP-0', 'slappart2',
+                        'http://example.com/software.cfg', 'backup',
+                        winner_instance_suffix='1',
+                        takeover_triggered_file_path=triggered_path,
+                        report_file_path=report_path)
+    self.assertEqual(sleep.call_count, 3)
+    self.assertEqual(current.request.call_count, 2)
+    broken.rename.assert_called_once()
+    winner.rename.assert_called_with(new_name='backup0')
+    winner.bang.assert_called_once()
+    self.assertTrue(os.path.exists(triggered_path))
+    with open(report_path) as f:
+      report = json.load(f)
+    self.assertFalse(report['dry-run'])
+    self.assertEqual(
+      [(x['name'], x['attempts']) for x in report['phase-list']],
+      [('request-winner', 2), ('freeze-broken', 1), ('rename-broken', 1),
+       ('rename', 3), ('bang', 1)])
+
+  def test_timeout(self):
+    current = mock.MagicMock()
+    current.request.return_value.getId.side_effect = ResourceNotReady
+    clock = [1000.]
+    def sleep(delay):
+      clock[0] += delay
+    triggered_path = os.path.join(self.tmp, 'takeover_triggered')
+    with mock.patch.object(takeover, 'getSlapClient') as getSlapClient, \
+         mock.patch('time.time', lambda: clock[0]), \
+         mock.patch('time.sleep', sleep):
+      getSlapClient.return_value.getComputerPartition.return_value = current
+      self.assertRaises(ResourceNotReady, takeover.takeover,
+                        'http://master', None, None, 'COMP-0', 'slappart2',
+                        'http://example.com/software.cfg', 'backup',
+                        winner_instance_suffix='1',
+                        takeover_triggered_file_path=triggered_path,
+                        timeout=300)
+    # the last delay is cut so that the phase is given up at the deadline
+    self.assertEqual(clock[0], 1300)
+    self.assertGreater(current.request.call_count, 8)
+    self.assertFalse(os.path.exists(triggered_path))
+
+  def test_dry_run(self):
+    triggered_path = os.path.join(self.tmp, 'takeover_triggered')
+    with mock.patch.object(takeover, 'getSlapClient'):
+      report = takeover.takeover('http://master', None, None, 'COMP-0',
+                                 'slappart1', 'http://example.com/software.cfg',
+                                 'backup',
+                                 takeover_triggered_file_path=triggered_path,
+                                 dry_run=True)
+    self.assertFalse(os.path.exists(triggered_path))
+    self.assertEqual([x['name'] for x in report['phase-list']],
+                     ['freeze-broken', 'rename-broken', 'rename', 'bang'])
+
+
+if __name__ == '__main__':
+  unittest.main()
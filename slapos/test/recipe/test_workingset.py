@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from slapos.recipe.librecipe import GenericBaseRecipe, workingset
+from slapos.test.utils import makeRecipe
+import pkg_resources
+
+
+class WorkingSetCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.eggs = os.path.join(self.tmp, 'eggs')
+    self.develop_eggs = os.path.join(self.tmp, 'develop-eggs')
+    os.mkdir(self.eggs)
+    os.mkdir(self.develop_eggs)
+    self.cache_file = os.path.join(self.tmp, workingset.CACHE_FILENAME)
+    self.stats = workingset.stats.copy()
+    workingset._memory_cache.clear()
+    self.resolve_count = 0
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+    workingset._memory_cache.clear()
+    workingset.stats.update(self.stats)
+
+  def resolve(self):
+    self.resolve_count += 1
+    ws = pkg_resources.WorkingSet([])
+    ws.add(pkg_resources.get_distribution('mock'))
+    return ws
+
+  def getWorkingSet(self, egg_list=('slapos.cookbook',), options=None):
+    return workingset.getWorkingSet(egg_list, self.eggs, self.develop_eggs,
+                                    self.resolve, self.cache_file, options)
+
+  def test_memory_cache(self):
+    ws = self.getWorkingSet()
+    self.assertIs(ws, self.getWorkingSet())
+    self.assertEqual(self.resolve_count, 1)
+
+  def test_disk_cache(self):
+    miss = workingset.stats['miss']
+    hit = workingset.stats['hit']
+    ws = self.getWorkingSet()
+    self.assertTrue(os.path.exists(self.cache_file))
+    # simulate a new buildout process
+    workingset._memory_cache.clear()
+    cached_ws = self.getWorkingSet()
+    self.assertEqual(self.resolve_count, 1)
+    self.assertEqual([(d.key, d.location) for d in cached_ws],
+                     [(d.key, d.location) for d in ws])
+    self.assertEqual(workingset.stats['miss'], miss + 1)
+    self.assertEqual(workingset.stats['hit'], hit + 1)
+
+  def test_invalidation(self):
+    self.getWorkingSet()
+    self.getWorkingSet(('slapos.cookbook', 'other'))
+    self.assertEqual(self.resolve_count, 2)
+    workingset._memory_cache.clear()
+    st = os.stat(self.develop_eggs)
+    os.utime(self.develop_eggs, (st.st_atime, st.st_mtime + 1))
+    self.getWorkingSet()
+    self.assertEqual(self.resolve_count, 3)
+
+  def test_options(self):
+    self.getWorkingSet(options={'versions': 'mock = 1'})
+    self.getWorkingSet(options={'versions': 'mock = 1'})
+    self.assertEqual(self.resolve_count, 1)
+    workingset._memory_cache.clear()
+    self.getWorkingSet(options={'versions': 'mock = 1'})
+    self.assertEqual(self.resolve_count, 1)
+    # the eggs directory is not modified if the new pin is already there
+    self.getWorkingSet(options={'versions': 'mock = 2'})
+    self.assertEqual(self.resolve_count, 2)
+    workingset._memory_cache.clear()
+    self.getWorkingSet(options={'versions': 'mock = 1'})
+    self.assertEqual(self.resolve_count, 3)
+
+  def test_recipe(self):
+    buildout_directory = self.tmp
+    class Recipe(GenericBaseRecipe):
+      def __init__(self, buildout, name, options):
+        buildout['buildout']['directory'] = buildout_directory
+        GenericBaseRecipe.__init__(self, buildout, name, options)
+    with patch('zc.recipe.egg.Egg.working_set',
+               side_effect=lambda: ((), self.resolve())):
+      for _ in range(2):
+        workingset._memory_cache.clear()
+        recipe = makeRecipe(Recipe, {})
+        self.assertIn('mock', [d.key for d in recipe._ws])
+    self.assertEqual(self.resolve_count, 1)
+    self.assertTrue(os.path.exists(self.cache_file))
+
+  def test_recipe_versions(self):
+    versions = {}
+    class Recipe(GenericBaseRecipe):
+      def __init__(self, buildout, name, options):
+        buildout['buildout']['versions'] = 'versions'
+        buildout['versions'] = versions
+        GenericBaseRecipe.__init__(self, buildout, name, options)
+    with patch('zc.recipe.egg.Egg.working_set',
+               side_effect=lambda: ((), self.resolve())):
+      for pin in '1', '1', '2':
+        versions['mock'] = pin
+        makeRecipe(Recipe, {})._ws
+    self.assertEqual(self.resolve_count, 2)
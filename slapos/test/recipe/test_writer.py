@@ -0,0 +1,157 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from collections import OrderedDict
+
+from mock import patch
+
+from slapos.recipe.librecipe import writer
+
+
+class FileWriterTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.index_path = os.path.join(self.tmp, writer.INDEX_FILENAME)
+    self.path = os.path.join(self.tmp, 'file')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def read(self):
+    with open(self.path, 'rb') as f:
+      return f.read()
+
+  def test_write(self):
+    w = writer.FileWriter(self.index_path)
+    self.assertTrue(w.write(self.path, b'hello', 0o640))
+    self.assertEqual(self.read(), b'hello')
+    self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o640)
+    self.assertFalse(w.write(self.path, b'hello', 0o640))
+    self.assertTrue(w.write(self.path, b'hello', 0o600))
+    self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+    self.assertTrue(w.write(self.path, b'world', 0o600))
+    self.assertEqual(self.read(), b'world')
+    self.assertEqual((w.written_files, w.written_bytes, w.unchanged_files),
+                     (2, 10, 2))
+    self.assertEqual(os.listdir(self.tmp), ['file'])
+    w.commit()
+    self.assertEqual(sorted(os.listdir(self.tmp)),
+                     [writer.INDEX_FILENAME, 'file'])
+
+  def test_index(self):
+    w = writer.FileWriter(self.index_path)
+    w.write(self.path, b'hello', 0o600)
+    w.commit()
+    # Files listed in the index are not read again.
+    w = writer.FileWriter(self.index_path)
+    with patch.object(w, '_updateIndex') as _updateIndex, \
+         patch('slapos.recipe.librecipe.writer.open', create=True) as open_:
+      self.assertFalse(w.write(self.path, b'hello', 0o600))
+    open_.assert_not_called()
+    _updateIndex.assert_not_called()
+    # A file modified behind the writer's back is detected.
+    with open(self.path, 'wb') as f:
+      f.write(b'HELLO!')
+    self.assertTrue(w.write(self.path, b'hello', 0o600))
+    self.assertEqual(self.read(), b'hello')
+
+  def test_index_mtime_ns(self):
+    w = writer.FileWriter(self.index_path)
+    w.write(self.path, b'hello', 0o600)
+    st = os.stat(self.path)
+    # Same size, inode and mtime in seconds (as a float), different content.
+    with open(self.path, 'r+b') as f:
+      f.write(b'HELLO')
+    os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 10))
+    self.assertTrue(w.write(self.path, b'hello', 0o600))
+    self.assertEqual(self.read(), b'hello')
+
+  def test_default_mode(self):
+    w = writer.FileWriter(self.index_path)
+    umask = os.umask(0o027)
+    try:
+      with patch.object(os, 'umask') as umask_:
+        w.write(self.path, b'hello')
+      umask_.assert_not_called()
+    finally:
+      os.umask(umask)
+    self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o640)
+    os.chmod(self.path, 0o604)
+    w.write(self.path, b'world')
+    self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o604)
+
+  def test_no_index(self):
+    w = writer.FileWriter()
+    with open(self.path, 'wb') as f:
+      f.write(b'hello')
+    os.chmod(self.path, 0o600)
+    self.assertFalse(w.write(self.path, b'hello', 0o600))
+    self.assertTrue(w.write(self.path, b'hello!', None))
+    self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+    w.commit()
+    self.assertEqual(os.listdir(self.tmp), ['file'])
+    # The index is kept in memory.
+    with patch('slapos.recipe.librecipe.writer.open', create=True) as open_:
+      self.assertFalse(w.write(self.path, b'hello!', 0o600))
+    open_.assert_not_called()
+
+  def test_getFileWriter(self):
+    cwd = os.getcwd()
+    os.chdir(self.tmp)
+    try:
+      self.assertIs(writer.getFileWriter(), writer.getFileWriter(''))
+      self.assertIsNone(writer.getFileWriter().index_path)
+      self.assertIs(writer.getFileWriter('.'),
+                    writer.getFileWriter(os.path.realpath(self.tmp)))
+    finally:
+      os.chdir(cwd)
+      for directory in None, os.path.realpath(self.tmp):
+        writer._writer_dict.pop(directory, None)
+
+  def test_fsync_before_rename(self):
+    w = writer.FileWriter(self.index_path)
+    call_list = []
+    fsync = os.fsync
+    rename = os.rename
+    def _fsync(fd):
+      call_list.append(('fsync', os.fstat(fd).st_ino))
+      fsync(fd)
+    def _rename(src, dst):
+      call_list.append(('rename', os.stat(src).st_ino))
+      rename(src, dst)
+    with patch.object(os, 'fsync', _fsync), \
+         patch.object(os, 'rename', _rename):
+      w.write(self.path, b'hello', 0o600)
+    ino = os.stat(self.path).st_ino
+    self.assertEqual(call_list, [('fsync', ino), ('rename', ino)])
+
+  def test_commit_removed_directory(self):
+    w = writer.FileWriter(self.index_path)
+    w.write(self.path, b'hello', 0o600)
+    shutil.rmtree(self.tmp)
+    w.commit()
+    os.mkdir(self.tmp)
+
+  def test_writeJSON(self):
+    w = writer.FileWriter(self.index_path)
+    diff = os.path.join(self.tmp, 'diff')
+    fingerprint = w.writeJSON(self.path, {'b': [1, 2], 'a': 'x', 'c': None},
+                              diff=diff)
+    self.assertEqual(self.read(),
+                     b'{\n  "a": "x",\n  "b": [\n    1,\n    2\n  ],\n  "c": null\n}')
+    with open(diff) as f:
+      self.assertEqual(f.read(), '+ a\n+ b\n+ c\n')
+    self.assertEqual(w.writeJSON(self.path, OrderedDict(
+      (('c', None), ('b', [1, 2]), ('a', 'x'))), diff=diff), fingerprint)
+    self.assertEqual(w.written_files, 2)
+    self.assertNotEqual(w.writeJSON(self.path, {'b': [1, 3], 'a': 'x', 'd': 1},
+                                    diff=diff), fingerprint)
+    with open(diff) as f:
+      self.assertEqual(f.read(), '~ b\n- c\n+ d\n')
+
+
+if __name__ == '__main__':
+  unittest.main()